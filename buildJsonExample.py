@@ -1,8 +1,6 @@
-import ijson
-import json
 from typing import Any, Dict, List, Union, Optional
-from utils import count_items, get_datetime, find_root_key, CustomJSONEncoder
-from tqdm import tqdm
+from utils import count_items, get_datetime, open_json_items
+from jsonSerializer import dump_json
 
 
 # function to combine the current json object with new key:value pairs or any new nested key:value pairs
@@ -21,25 +19,24 @@ def combine_json_objects(obj1: Dict[str, Any], obj2: Dict[str, Any],
 
 
 def build_example_json(input_json: Union[str, Dict], root_key: Optional[str] = None,
-                       ignore_new_array_indices: bool = True):
-    # Get the total number objects in the input json file (no matter how large)
+                       ignore_new_array_indices: bool = True, exact_count: bool = False):
     print(f'[+] Parsing -> {input_json}')
-    if find_root_key(input_json):
-        total_items = count_items(input_json, root_key)
-    else:
-        print(f'[X] Root Key NOT Found for {input_json}')
+    # Only count the objects up front if an exact progress bar is wanted, otherwise progress follows the file position
+    total_items = count_items(input_json, root_key, is_array=True) if exact_count else None
 
     example_json = {}
 
-    with open(input_json, 'r', encoding='utf-8') as f:
-        parser = ijson.items(f, f"{root_key}.item" if root_key else 'item')
+    with open_json_items(input_json, f"{root_key}.item" if root_key else 'item', total_items) as parser:
         datetime = str(get_datetime())
-        json_output_filename = 'build_example_json__' + root_key + '_' + datetime + ".json"
+        if root_key:
+            json_output_filename = 'build_example_json__' + root_key + '_' + datetime + ".json"
+        else:
+            json_output_filename = 'build_example_json__' + datetime + ".json"
 
-        for obj in tqdm(parser, total=total_items, desc='Processing objects', unit=' objects', ncols=100):
+        for obj in parser:
             example_json = combine_json_objects(example_json, obj, ignore_new_array_indices)
 
     with open(json_output_filename, 'w+', newline='', encoding='utf-8') as json_output:
-        json.dump(example_json, json_output, ensure_ascii=False, indent=2, cls=CustomJSONEncoder)
+        dump_json(example_json, json_output)
 
     return json_output_filename
\ No newline at end of file
@@ -0,0 +1,159 @@
+import hashlib
+import os
+from typing import List, Optional
+
+import orjson
+
+from jsonSerializer import dump_json
+
+# Checkpoints let a long flatten job pick up where a crashed run stopped, and a rerun of a config skip the jobs it
+# already finished. The incremental state of a flatten job lets its next run only flatten what was appended to the
+# input since. All are small JSON files next to the file they are about, replaced in one step when updated.
+
+# seconds between the checkpoints of a flatten job, unless the job sets checkpoint_interval
+CHECKPOINT_INTERVAL = 60
+CHECKPOINT_VERSION = 1
+
+
+def get_checkpoint_path(csv_filename: str) -> str:
+    return csv_filename + '.checkpoint'
+
+
+def get_input_key(input_json: str) -> dict:
+    # a checkpoint only applies to the exact file it was taken of
+    stat = os.stat(input_json)
+    return {'path': os.path.abspath(input_json), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _write_json_file(path: str, obj):
+    # the old file stays in place until the new one is complete, a crash while writing leaves one of the two
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        dump_json(obj, f)
+    os.replace(temp_path, path)
+
+
+def _read_json_file(path: str):
+    try:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, orjson.JSONDecodeError):
+        print(f"[-] {path} can't be read, ignoring it")
+        return None
+
+
+def save_checkpoint(path: str, input_json: str, settings: str, state: dict):
+    """Saves the state of a flatten job over input_json run with settings (see load_checkpoint)."""
+    _write_json_file(path, dict(state, version=CHECKPOINT_VERSION, input=get_input_key(input_json),
+                                settings=settings))
+
+
+def load_checkpoint(path: str, input_json: str, settings: str) -> Optional[dict]:
+    """
+    The state saved at path, or None if there is no checkpoint or it was taken of another input file or with other
+    settings, in which case the job has to start over.
+    """
+    state = _read_json_file(path)
+    if state is None:
+        return None
+    if state.get('version') != CHECKPOINT_VERSION or state.get('input') != get_input_key(input_json) or \
+            state.get('settings') != settings:
+        print(f'[-] {path} was taken of another input file or with other settings, starting from the beginning')
+        return None
+    return state
+
+
+def remove_checkpoint(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def get_incremental_state_path(csv_filename: str) -> str:
+    return csv_filename + '.incremental'
+
+
+# bytes at the start of the input and before the offset read so far that have to stay the same between runs
+INPUT_FINGERPRINT_SIZE = 4096
+
+
+def get_input_fingerprint(input_json: str, offset: int) -> str:
+    # an input that was replaced or rewritten instead of appended to no longer has the same bytes before offset
+    fingerprint = hashlib.sha1()
+    with open(input_json, 'rb') as f:
+        fingerprint.update(f.read(min(offset, INPUT_FINGERPRINT_SIZE)))
+        f.seek(max(0, offset - INPUT_FINGERPRINT_SIZE))
+        fingerprint.update(f.read(offset - f.tell()))
+    return fingerprint.hexdigest()
+
+
+def save_incremental_state(path: str, input_json: str, settings: str, state: dict):
+    """Saves the state of an incremental flatten job that read input_json up to state['offset']."""
+    _write_json_file(path, dict(state, version=CHECKPOINT_VERSION, input=os.path.abspath(input_json),
+                                fingerprint=get_input_fingerprint(input_json, state['offset']), settings=settings))
+
+
+def load_incremental_state(path: str, input_json: str, settings: str) -> Optional[dict]:
+    """
+    The state saved at path, or None if there is none, it was saved for another input file or other settings, or
+    the input was replaced rather than appended to since; the whole input has to be flattened then.
+    """
+    state = _read_json_file(path)
+    if state is None:
+        return None
+    if state.get('version') != CHECKPOINT_VERSION or state.get('input') != os.path.abspath(input_json) or \
+            state.get('settings') != settings:
+        print(f'[-] {path} was saved for another input file or other settings, flattening all of {input_json}')
+        return None
+    if os.path.getsize(input_json) < state['offset'] or \
+            get_input_fingerprint(input_json, state['offset']) != state.get('fingerprint'):
+        print(f'[-] {input_json} was replaced rather than appended to since {path} was saved, flattening all of it')
+        return None
+    return state
+
+
+def get_job_progress_path(config_path: str) -> str:
+    return config_path + '.progress'
+
+
+def _iter_strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _iter_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _iter_strings(item)
+
+
+def get_job_files_key(job: dict, job_vars: dict) -> dict:
+    """
+    The size and modification time of the files a job names (its inputs, search configs, files edited in place) and
+    of the outputs recorded in job_vars, None for the ones that are missing. A completed job is only skipped if these
+    are still the same.
+    """
+    paths = {path for path in _iter_strings(job) if os.path.isfile(path)}
+    paths.update(path for path in [job_vars.get('last_file'), *job_vars.get('output_files', [])] if path)
+    key = {}
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+            key[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            key[os.path.abspath(path)] = None
+    return key
+
+
+def load_job_progress(config_path: str) -> List[dict]:
+    """
+    The jobs of the config that completed in earlier runs, in order, each as {'job': <the job>, 'job_vars': <the job
+    variables after it>, 'files': <get_job_files_key after it>}.
+    """
+    progress = _read_json_file(get_job_progress_path(config_path))
+    return progress.get('completed', []) if isinstance(progress, dict) else []
+
+
+def save_job_progress(config_path: str, completed: List[dict]):
+    _write_json_file(get_job_progress_path(config_path), {'version': CHECKPOINT_VERSION, 'completed': completed})
@@ -0,0 +1,305 @@
+import json
+import os
+import re
+from array import array
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+import ijson
+from tqdm import tqdm
+
+# bytes that change the structure of a JSON document (plus escapes, which matter inside strings)
+_STRUCTURAL = re.compile(rb'[\[\]{}",:\\]')
+_NON_WHITESPACE = re.compile(rb'[^ \t\r\n]')
+_WHITESPACE = b' \t\r\n'
+_CHUNK_SIZE = 1024 * 1024
+_OFFSET_TYPECODE = 'q'  # signed 64 bit offsets
+_OFFSET_SIZE = array(_OFFSET_TYPECODE).itemsize
+
+
+def get_item_prefix(root_key: Optional[str] = None) -> str:
+    # same prefix convention used with ijson by find_root_key / count_items
+    return f"{root_key}.item" if root_key else 'item'
+
+
+def get_index_path(input_json: str, root_key: Optional[str] = None) -> str:
+    return f"{input_json}.{get_item_prefix(root_key)}.offsets"
+
+
+def scan_element_offsets(file_obj, root_key: Optional[str] = None, chunk_size: int = _CHUNK_SIZE):
+    """
+    Yields (start, end) byte offsets of every element of the array found under root_key (or of the top level array
+    when root_key is None), i.e. the objects ijson.items would yield for the "<root_key>.item" / "item" prefix.
+    start is the first byte of the element and end is exclusive.
+    """
+    target_path = root_key.split('.') if root_key else []
+
+    stack = []  # open containers: [is_map, current_key]
+    target_depth = None  # len(stack) while inside the target array
+    in_string = False
+    capture_key = False
+    key_parts = []
+    key_start = 0
+    skip_until = 0
+    expect_key = False
+    pending_start = None  # element start has to be found from here on (after '[' or ',')
+    element_start = None
+    base = 0
+
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+
+        for match in _STRUCTURAL.finditer(chunk):
+            rel = match.start()
+            pos = base + rel
+
+            if pending_start is not None and pending_start <= pos:
+                # first non whitespace byte after '[' or ',' starts the next element ('"', '{', '[' or a scalar)
+                first = _NON_WHITESPACE.search(chunk, max(pending_start - base, 0))
+                if first is not None:
+                    element_start = None if chunk[first.start()] == ord(']') else base + first.start()
+                    pending_start = None
+
+            if pos < skip_until:
+                continue
+            char = chunk[rel]
+
+            if in_string:
+                if char == 0x5c:  # backslash, skip the escaped byte
+                    skip_until = pos + 2
+                elif char == 0x22:  # closing quote
+                    in_string = False
+                    if capture_key:
+                        key_parts.append(chunk[key_start - base:rel])
+                        stack[-1][1] = json.loads(b'"' + b''.join(key_parts) + b'"')
+                        capture_key = False
+                continue
+
+            if char == 0x22:  # opening quote
+                in_string = True
+                if stack and stack[-1][0] and expect_key:
+                    capture_key = True
+                    key_parts = []
+                    key_start = pos + 1
+            elif char == 0x3a:  # ':'
+                expect_key = False
+            elif char == 0x2c:  # ','
+                if stack and stack[-1][0]:
+                    expect_key = True
+                elif len(stack) == target_depth:
+                    if element_start is not None:
+                        yield element_start, _trim_end(chunk, rel, base)
+                    element_start = None
+                    pending_start = pos + 1
+            elif char == 0x7b:  # '{'
+                stack.append([True, None])
+                expect_key = True
+            elif char == 0x5b:  # '['
+                if target_depth is None and all(is_map for is_map, _ in stack) and \
+                        [key for _, key in stack] == target_path:
+                    target_depth = len(stack) + 1
+                    pending_start = pos + 1
+                stack.append([False, None])
+            elif char in (0x7d, 0x5d):  # '}' or ']'
+                if char == 0x5d and len(stack) == target_depth:
+                    if element_start is not None:
+                        yield element_start, _trim_end(chunk, rel, base)
+                    return  # ijson prefixes are unique, nothing else can match after the target array
+                stack.pop()
+                expect_key = False
+
+        if pending_start is not None and pending_start < base + len(chunk):
+            first = _NON_WHITESPACE.search(chunk, max(pending_start - base, 0))
+            if first is not None:
+                element_start = None if chunk[first.start()] == ord(']') else base + first.start()
+                pending_start = None
+        if in_string and capture_key:
+            key_parts.append(chunk[key_start - base:])
+            key_start = base + len(chunk)
+        base += len(chunk)
+
+
+def _trim_end(chunk, rel, base):
+    # exclusive end of an element that is followed by the delimiter at chunk[rel], without trailing whitespace
+    while rel > 0 and chunk[rel - 1] in _WHITESPACE:
+        rel -= 1
+    return base + rel
+
+
+class JsonArraySliceReader:
+    """
+    File-like reader presenting the bytes [start, end) of a file as a JSON array: "[" + bytes + "]".
+    Lets ijson parse a range of elements straight from the original file without copying it.
+    """
+
+    def __init__(self, file_obj, start: int, end: int):
+        self.file_obj = file_obj
+        self.file_obj.seek(start)
+        self.remaining = end - start
+        self.opened = False
+        self.closed = False
+
+    def read(self, size=-1):
+        if size == 0:
+            return b''
+        if not self.opened:
+            self.opened = True
+            return b'['
+        if self.remaining > 0:
+            if size is None or size < 0 or size > self.remaining:
+                size = self.remaining
+            data = self.file_obj.read(size)
+            if data:
+                self.remaining -= len(data)
+                return data
+            self.remaining = 0
+        if not self.closed:
+            self.closed = True
+            return b']'
+        return b''
+
+
+class JsonOffsetIndex:
+    """
+    Sidecar index holding the byte offsets of every element of a large JSON array.
+
+    File layout: one JSON header line (path, size, mtime, item prefix, count) followed by the start offsets and then
+    the end offsets as native 64 bit integers, so the count and any single object can be read without loading
+    the whole index.
+    """
+
+    def __init__(self, index_path: str, header: dict, data_offset: int):
+        self.index_path = index_path
+        self.header = header
+        self.data_offset = data_offset
+        self.input_json = header['path']
+        self.count = header['count']
+
+    def _read_offset(self, f, position):
+        f.seek(self.data_offset + position * _OFFSET_SIZE)
+        offsets = array(_OFFSET_TYPECODE)
+        offsets.frombytes(f.read(_OFFSET_SIZE))
+        return offsets[0]
+
+    def span(self, n: int) -> Tuple[int, int]:
+        if not 0 <= n < self.count:
+            raise IndexError(f"Object {n} is out of range, the index holds {self.count} objects")
+        with open(self.index_path, 'rb') as f:
+            return self._read_offset(f, n), self._read_offset(f, self.count + n)
+
+    def spans(self, start: int = 0, end: Optional[int] = None):
+        end = self.count if end is None else min(end, self.count)
+        start = max(start, 0)
+        if start >= end:
+            return array(_OFFSET_TYPECODE), array(_OFFSET_TYPECODE)
+        starts, ends = array(_OFFSET_TYPECODE), array(_OFFSET_TYPECODE)
+        with open(self.index_path, 'rb') as f:
+            f.seek(self.data_offset + start * _OFFSET_SIZE)
+            starts.frombytes(f.read((end - start) * _OFFSET_SIZE))
+            f.seek(self.data_offset + (self.count + start) * _OFFSET_SIZE)
+            ends.frombytes(f.read((end - start) * _OFFSET_SIZE))
+        return starts, ends
+
+    def shard_ranges(self, num_shards: int):
+        """
+        Splits the objects into at most num_shards contiguous runs and returns the byte range (start, end) of each.
+        """
+        num_shards = max(1, min(num_shards, self.count))
+        ranges = []
+        with open(self.index_path, 'rb') as f:
+            for shard in range(num_shards):
+                first = shard * self.count // num_shards
+                last = (shard + 1) * self.count // num_shards - 1
+                if last >= first:
+                    ranges.append((self._read_offset(f, first), self._read_offset(f, self.count + last)))
+        return ranges
+
+    def read_object(self, n: int):
+        start, end = self.span(n)
+        with open(self.input_json, 'rb') as f:
+            return next(ijson.items(JsonArraySliceReader(f, start, end), 'item'))
+
+    @contextmanager
+    def open_items(self, start: int = 0, end: Optional[int] = None, desc: str = 'Processing objects'):
+        """
+        Yields an iterator over the objects [start, end) parsed straight from their byte range in the input.
+        """
+        starts, ends = self.spans(start, end)
+        with open(self.input_json, 'rb') as f:
+            items = ijson.items(JsonArraySliceReader(f, starts[0], ends[-1]), 'item') if starts else iter(())
+            yield tqdm(items, total=len(starts), desc=desc, unit=' objects', ncols=100)
+
+
+def _file_key(input_json: str) -> dict:
+    stat = os.stat(input_json)
+    return {'path': os.path.abspath(input_json), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def build_json_offset_index(input_json: str, root_key: Optional[str] = None) -> str:
+    from utils import get_input_compression  # utils imports this module
+
+    if get_input_compression(input_json) is not None:
+        raise ValueError(f"{input_json} is compressed, offsets into it can't be read directly; decompress it to "
+                         f"index it")
+    print(f'[+] Indexing -> {input_json} ({get_item_prefix(root_key)})')
+    starts, ends = array(_OFFSET_TYPECODE), array(_OFFSET_TYPECODE)
+
+    file_key = _file_key(input_json)
+    with open(input_json, 'rb') as f, \
+            tqdm(total=file_key['size'], desc='Indexing objects', unit='B', unit_scale=True, unit_divisor=1024,
+                 ncols=100) as pbar:
+        for start, end in scan_element_offsets(f, root_key):
+            starts.append(start)
+            ends.append(end)
+            pbar.update(end - pbar.n)
+        pbar.update(file_key['size'] - pbar.n)
+
+    header = dict(file_key, item_prefix=get_item_prefix(root_key), count=len(starts))
+    index_path = get_index_path(input_json, root_key)
+    with open(index_path, 'wb') as index_file:
+        index_file.write(json.dumps(header).encode('utf-8') + b'\n')
+        starts.tofile(index_file)
+        ends.tofile(index_file)
+
+    print(f'[+] Indexed {len(starts)} objects -> {index_path}')
+    return index_path
+
+
+def load_json_offset_index(input_json: str, root_key: Optional[str] = None) -> Optional[JsonOffsetIndex]:
+    """
+    Returns the offset index of input_json, or None if there is none or the file changed since it was built.
+    """
+    index_path = get_index_path(input_json, root_key)
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with open(index_path, 'rb') as index_file:
+            header_line = index_file.readline()
+            header = json.loads(header_line)
+    except (OSError, ValueError):
+        return None
+
+    file_key = _file_key(input_json)
+    if any(header.get(key) != value for key, value in file_key.items()) or \
+            header.get('item_prefix') != get_item_prefix(root_key):
+        return None
+    return JsonOffsetIndex(index_path, header, len(header_line))
+
+
+def get_json_object(input_json: str, n: int, root_key: Optional[str] = None):
+    """
+    Returns object n of the array under root_key. Uses the offset index when there is one, otherwise parses up to it.
+    """
+    from utils import open_input_file  # utils imports this module
+
+    index = load_json_offset_index(input_json, root_key)
+    if index is not None:
+        return index.read_object(n)
+
+    with open_input_file(input_json) as f:
+        for idx, obj in enumerate(ijson.items(f, get_item_prefix(root_key))):
+            if idx == n:
+                return obj
+    raise IndexError(f"Object {n} is out of range for {input_json}")
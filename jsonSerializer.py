@@ -0,0 +1,59 @@
+import io
+import json
+from decimal import Decimal
+
+import orjson
+
+# One serializer for everything the tools write as JSON: the values flatten stringifies into CSV cells and the
+# documents written by the JSON jobs. orjson is several times faster than the json module; the json module is
+# only used for what orjson refuses, like ints wider than 64 bits, and writes it with the same layout.
+
+# int keys and numpy values (from the CSV stats) are written like the json module would, datetimes go through
+# default=str as they did with json.dumps(default=str)
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def _default(obj):
+    # ijson returns numbers with a fraction as Decimal, written as numbers like CustomJSONEncoder did as long as a
+    # float holds them exactly, the ones with more digits than a float keeps are written as they were in the input
+    if isinstance(obj, Decimal):
+        number = float(obj)
+        if obj.is_finite() and Decimal(repr(number)) == obj:
+            return number
+    return str(obj)
+
+
+def dumps_json_bytes(obj, indent: bool = False) -> bytes:
+    """
+    UTF-8 encoded JSON of obj, compact or indented by 2 spaces. Non-ASCII characters are written as they are and
+    values JSON has no type for become their str().
+    """
+    try:
+        return orjson.dumps(obj, default=_default,
+                            option=(_ORJSON_OPTIONS | orjson.OPT_INDENT_2) if indent else _ORJSON_OPTIONS)
+    except orjson.JSONEncodeError:
+        return json.dumps(obj, default=_default, ensure_ascii=False, indent=2 if indent else None,
+                          separators=(',', ': ') if indent else (',', ':')).encode('utf-8')
+
+
+def dumps_json(obj, indent: bool = False) -> str:
+    """Same as dumps_json_bytes, as a str."""
+    return dumps_json_bytes(obj, indent).decode('utf-8')
+
+
+def dumps_json_spaced(obj) -> str:
+    """
+    Same as dumps_json, with a space after the , and : between items like json.dumps writes. flatten stringifies
+    arrays and objects into cells this way, as it always has; orjson has no such layout, this goes through the json
+    module.
+    """
+    return json.dumps(obj, default=_default, ensure_ascii=False)
+
+
+def dump_json(obj, file_obj, indent: bool = True):
+    """Writes obj to a file opened in text (utf-8) or binary mode, indented by default like the JSON jobs write."""
+    data = dumps_json_bytes(obj, indent)
+    if isinstance(file_obj, io.TextIOBase):
+        file_obj.write(data.decode('utf-8'))
+    else:
+        file_obj.write(data)
@@ -1,16 +1,22 @@
 import csv
 
-from searchAndFlatten import search_and_flatten_to_csv, get_flattened_csv_headers_from_json
+from searchAndFlatten import search_and_flatten_to_csvs, get_flattened_csv_headers_from_json
 from buildJsonExample import build_example_json
 from utils import trim_json, bulk_rename_csv_headers, reformat_json, truncate_json, collapse_json, \
     filter_rows_by_priority, unique_values_with_counts_chunked, generate_column_analytics, \
     join_large_csvs, extract_business_units, remap_values_in_csv, rename_csv_file, find_ip_keys_in_json, \
     array_to_csv, extract_first_value_from_lists_in_csv, select_columns_from_csv, fill_empty_values_in_csv, \
     remove_rows_with_empty_values, format_datetime_columns_in_csv, transform_columns_in_csv, \
-    bulk_value_search, generate_pivot_table, process_csv_remove_parentheses, csv_analytics
+    bulk_value_search, generate_pivot_table, process_csv_remove_parentheses, csv_analytics, \
+    get_key_match_cache_stats
+from jsonIndex import build_json_offset_index, get_json_object
+from jsonSerializer import dump_json, dumps_json
+from checkpoint import load_job_progress, save_job_progress, get_job_files_key
 
 import argparse
+import copy
 import json
+import multiprocessing
 from json.decoder import JSONDecodeError
 from colorama import Fore, Style, init
 
@@ -38,6 +44,9 @@ def main():
     parser = argparse.ArgumentParser(description='Process config file for jobs.')
     parser.add_argument('-c', '--config', metavar='config_file', default='config.json',
                         help='Path to the config file (default: config.json)')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='Record the jobs that complete, skip the ones that completed in the last resumed run '
+                             'if their files are unchanged, and resume checkpointed flatten jobs')
 
     args = parser.parse_args()
 
@@ -55,11 +64,26 @@ def main():
         'output_files': []
     }
 
+    # with resume the jobs completed so far are recorded next to the config, a resumed run skips the ones it still
+    # starts with as long as the files they read and wrote haven't changed since
+    resume = args.resume or config.get("resume", False)
+    completed_jobs = load_job_progress(args.config) if resume else []
+
     total_jobs = len(jobs)
     for job_index, job in enumerate(jobs):
         job_name = job.get("name")
 
+        if job_index < len(completed_jobs) and completed_jobs[job_index]['job'] == job and \
+                completed_jobs[job_index].get('files') == get_job_files_key(job, completed_jobs[job_index]['job_vars']):
+            job_vars = copy.deepcopy(completed_jobs[job_index]['job_vars'])
+            print(f"Job {job_index + 1}/{total_jobs} -[{job_name}] already completed, skipping.  "
+                  f"Type ::{job.get('type')}::")
+            continue
+        # a job that changed, didn't complete or whose files changed runs again, and so does everything after it
+        del completed_jobs[job_index:]
+
         job_matched = False
+        cache_hits_before, cache_misses_before = get_key_match_cache_stats()
 
         # search and flatten to csv job
         if job.get("type") == "search_and_flatten_csv":
@@ -77,6 +101,7 @@ def main():
                     # print the error message in red
                     print("\033[91mYour searches.json file is not formatted correctly or messed up:", e, "\033[0m")
 
+            searches = []
             for search_index, (search_name, file_name) in enumerate(search_configs.items()):
                 current_config = all_search_configs.get(search_name)
                 if not current_config:
@@ -106,13 +131,38 @@ def main():
                     # csv.QUOTE_NONNUMERIC,
                     # csv.QUOTE_NONE
                     "escapechar": current_config.get("escapechar", None),  # '\\' or None
-                    "remove_quotes": current_config.get("remove_quotes", True)
+                    "remove_quotes": current_config.get("remove_quotes", True),
+                    "header_mode": job.get("header_mode", "deferred"),  # deferred, rewrite
+                    "exact_count": job.get("exact_count", False),  # count objects first for an exact progress bar
+                    "workers": job.get("workers", 1),  # > 1 flattens shards of the input in worker processes
+                    "preserve_order": job.get("preserve_order", True),  # keep rows in input order with workers
+                    "parse_mode": job.get("parse_mode", "items"),  # items, events (only build what can match)
+                    "max_rows_per_object": job.get("max_rows_per_object", None),  # cap on rows one object explodes into
+                    "max_object_bytes": job.get("max_object_bytes", None),  # cap on the size of one object's rows
+                    "table_files": [],  # filled with the other files written: child CSVs of array_handling
+                    # "normalize" and the further parts of a split output
+                    "output_format": job.get("output_format", "normal"),  # normal, datetime, parquet
+                    "batch_rows": job.get("batch_rows", 1000),  # rows written to the CSV together
+                    "batch_bytes": job.get("batch_bytes", None),  # or fewer rows once a batch reaches this size
+                    "write_buffer_size": job.get("write_buffer_size", None),  # bytes buffered by the output file
+                    "pipeline": job.get("pipeline", False),  # read ahead and write rows on background threads
+                    "output_compression": job.get("output_compression", None),  # None, gzip, zstd
+                    "max_rows_per_file": job.get("max_rows_per_file", None),  # roll over into numbered part files
+                    "max_bytes_per_file": job.get("max_bytes_per_file", None),  # or once a part reaches this size
+                    "checkpoint_interval": job.get("checkpoint_interval", None),  # seconds between checkpoints
+                    "resume": job.get("resume", resume),  # carry on from the last checkpoint
+                    "incremental": job.get("incremental", False)  # only flatten lines appended since the last run
                 }
                 print(f'{job_index + 1}.{search_index + 1}) SearchAndFlattenCSV, name:"{search_name}", '
                       f'#ofsearches:{len(search_configs)}')
-                output_csv_filename = search_and_flatten_to_csv(**options)
+                searches.append(options)
+
+            # searches of the same JSON file share one parse of it, "parallel" > 1 runs different files side by side
+            output_csv_filenames = search_and_flatten_to_csvs(searches, parallel=job.get("parallel", 1))
+            for options, output_csv_filename in zip(searches, output_csv_filenames):
                 job_vars['last_file'] = output_csv_filename
                 job_vars['output_files'].append(output_csv_filename)
+                job_vars['output_files'].extend(options["table_files"])
 
         # bulk rename csv columns job
         if job.get("type") == "rename_columns":
@@ -134,7 +184,8 @@ def main():
 
             input_json = job.get("input_json", None)
             print(f'[+] Reformatting JSON - {input_json}')
-            output_json = reformat_json(input_json=input_json)
+            exact_count = job.get("exact_count", False)
+            output_json = reformat_json(input_json=input_json, exact_count=exact_count)
             print(f'[+] "reformat_json", output: {output_json}')
 
         # download JSON from API TODO NOT STARTED YET
@@ -155,8 +206,10 @@ def main():
             root_key = job.get("root_key")
             input_json = job.get("input_json")
             ignore_new_array_indices = job.get("ignore_new_array_indices")
+            exact_count = job.get("exact_count", False)
             json_output = build_example_json(root_key=root_key, input_json=input_json,
-                                             ignore_new_array_indices=ignore_new_array_indices)
+                                             ignore_new_array_indices=ignore_new_array_indices,
+                                             exact_count=exact_count)
             print(f'[+] "build_json_example", output: {json_output}')
 
         # TODO not sure if I want this to be an option
@@ -176,9 +229,36 @@ def main():
             range_str = job.get("range")
             input_json = job.get("input_json")
             root_key = job.get("root_key")
-            output = trim_json(input_json=input_json, root_key=root_key, range_str=range_str)
+            exact_count = job.get("exact_count", False)
+            output = trim_json(input_json=input_json, root_key=root_key, range_str=range_str, exact_count=exact_count)
             print(f'[+] "trim_json", output: {output}')
 
+        if job.get("type") == "index_json":
+            print_job_start(job_index, total_jobs, job_name, job)
+            job_matched = True
+
+            input_json = job.get("input_json")
+            root_key = job.get("root_key")
+            output = build_json_offset_index(input_json=input_json, root_key=root_key)
+            print(f'[+] "index_json", output: {output}')
+
+        if job.get("type") == "get_json_object":
+            print_job_start(job_index, total_jobs, job_name, job)
+            job_matched = True
+
+            input_json = job.get("input_json")
+            root_key = job.get("root_key")
+            object_index = job.get("index", 0)
+            output_json = job.get("output_json")
+            obj = get_json_object(input_json=input_json, n=object_index, root_key=root_key)
+            if output_json:
+                with open(output_json, 'w', encoding='utf-8') as f:
+                    dump_json(obj, f)
+                output = output_json
+            else:
+                output = dumps_json(obj, indent=True)
+            print(f'[+] "get_json_object", output: {output}')
+
         if job.get("type") == "truncate_json":
             print_job_start(job_index, total_jobs, job_name, job)
             job_matched = True
@@ -186,7 +266,8 @@ def main():
             depth = job.get("depth", 1)
             input_json = job.get("input_json")
             root_key = job.get("root_key")
-            output = truncate_json(input_json=input_json, root_key=root_key, depth=depth)
+            exact_count = job.get("exact_count", False)
+            output = truncate_json(input_json=input_json, root_key=root_key, depth=depth, exact_count=exact_count)
             print(f'[+] "truncate_json", output: {output}')
 
         if job.get("type") == "collapse_json":
@@ -196,7 +277,8 @@ def main():
             depth = job.get("depth", 1)
             input_json = job.get("input_json")
             root_key = job.get("root_key")
-            output = collapse_json(input_json=input_json, root_key=root_key, depth=depth)
+            exact_count = job.get("exact_count", False)
+            output = collapse_json(input_json=input_json, root_key=root_key, depth=depth, exact_count=exact_count)
             print(f'[+] "collapse_json", output: {output}')
 
         if job.get("type") == "get_flattened_headers":
@@ -208,10 +290,12 @@ def main():
             num_test_rows = job.get("num_test_rows", None)
             separator = job.get("separator", ".")
             mode = job.get("mode", "normal")
+            exact_count = job.get("exact_count", False)
             # TODO delimiter = job.get("delimiter")
 
             output = get_flattened_csv_headers_from_json(input_json=input_json, root_key=root_key, mode=mode,
-                                                         num_test_rows=num_test_rows, separator=separator)
+                                                         num_test_rows=num_test_rows, separator=separator,
+                                                         exact_count=exact_count)
             print(f'[+] "get_flattened_headers", output: {output}')
 
         if job.get("type") == "get_unique_values":
@@ -265,7 +349,10 @@ def main():
                                              filter_config=filter_config,
                                              drop_score=drop_score,
                                              score_breakdown=score_breakdown,
-                                             drop_below=drop_below)
+                                             drop_below=drop_below,
+                                             output_compression=job.get("output_compression"),
+                                             max_rows_per_file=job.get("max_rows_per_file"),
+                                             max_bytes_per_file=job.get("max_bytes_per_file"))
             print(f'[+] "custom_filter", output: {output}')
 
         if job.get("type") == "join_csvs":
@@ -355,7 +442,10 @@ def main():
             input_csv = job.get("input_csv")
             columns = job.get("columns")
             output = select_columns_from_csv(csv_filepath=input_csv,
-                                             column_names=columns)
+                                             column_names=columns,
+                                             output_compression=job.get("output_compression"),
+                                             max_rows_per_file=job.get("max_rows_per_file"),
+                                             max_bytes_per_file=job.get("max_bytes_per_file"))
             print(f'[+] "select_columns_from_csv", output: {output}')
 
         if job.get("type") == "fill_empty_values_in_csv":
@@ -365,7 +455,10 @@ def main():
             input_csv = job.get("input_csv")
             fill_values_dict = job.get("fill_values_dict")
             output = fill_empty_values_in_csv(csv_filepath=input_csv,
-                                              fill_values_dict=fill_values_dict)
+                                              fill_values_dict=fill_values_dict,
+                                              output_compression=job.get("output_compression"),
+                                              max_rows_per_file=job.get("max_rows_per_file"),
+                                              max_bytes_per_file=job.get("max_bytes_per_file"))
             print(f'[+] "fill_empty_values_in_csv", output: {output}')
 
         if job.get("type") == "remove_rows_with_empty_values":
@@ -375,7 +468,10 @@ def main():
             input_csv = job.get("input_csv")
             columns = job.get("columns")
             output = remove_rows_with_empty_values(csv_filepath=input_csv,
-                                                   columns_to_check=columns)
+                                                   columns_to_check=columns,
+                                                   output_compression=job.get("output_compression"),
+                                                   max_rows_per_file=job.get("max_rows_per_file"),
+                                                   max_bytes_per_file=job.get("max_bytes_per_file"))
             print(f'[+] "remove_rows_with_empty_values", output: {output}')
 
         if job.get("type") == "format_datetime_columns_in_csv":
@@ -385,7 +481,10 @@ def main():
             input_csv = job.get("input_csv")
             columns = job.get("columns")
             output = format_datetime_columns_in_csv(csv_filepath=input_csv,
-                                                    datetime_columns=columns)
+                                                    datetime_columns=columns,
+                                                    output_compression=job.get("output_compression"),
+                                                    max_rows_per_file=job.get("max_rows_per_file"),
+                                                    max_bytes_per_file=job.get("max_bytes_per_file"))
             print(f'[+] "format_datetime_columns_in_csv", output: {output}')
 
         if job.get("type") == "transform_columns_in_csv":
@@ -394,8 +493,13 @@ def main():
 
             input_csv = job.get("input_csv")
             transformations = job.get("transformations")
+            header_mode = job.get("header_mode", "deferred")
             output = transform_columns_in_csv(input_csv=input_csv,
-                                              transformations_dict=transformations)
+                                              transformations_dict=transformations,
+                                              header_mode=header_mode,
+                                              output_compression=job.get("output_compression"),
+                                              max_rows_per_file=job.get("max_rows_per_file"),
+                                              max_bytes_per_file=job.get("max_bytes_per_file"))
             print(f'[+] "transform_columns_in_csv", output: {output}')
 
         if job.get("type") == "bulk_value_search":
@@ -450,8 +554,21 @@ def main():
                 f"{Fore.YELLOW}[-] Warning: The job type '{job.get('type')}' is not recognized. Skipping this job."
                 f"{Style.RESET_ALL}")
 
+        # fuzzy key matching is cached across objects, show how well that worked for this job
+        cache_hits, cache_misses = get_key_match_cache_stats()
+        if cache_hits - cache_hits_before or cache_misses - cache_misses_before:
+            print(f'[+] Key match cache: {cache_hits - cache_hits_before} hits, '
+                  f'{cache_misses - cache_misses_before} misses')
+
+        if resume:
+            completed_jobs.append({'job': job, 'job_vars': copy.deepcopy(job_vars),
+                                   'files': get_job_files_key(job, job_vars)})
+            save_job_progress(args.config, completed_jobs)
+
         print(f"Job {job_index + 1}/{total_jobs} -[{job_name}] completed.  Type ::{job.get('type')}::\n")
 
 
 if __name__ == "__main__":
+    # needed for the worker processes of search_and_flatten_to_csv in frozen (pyinstaller) builds
+    multiprocessing.freeze_support()
     main()
@@ -3,56 +3,217 @@ import json
 from tqdm import tqdm
 import pandas as pd
 from typing import Any, Dict, List, Union, Optional
-from jaccard_index.jaccard import jaccard_index
-from utils import count_items, get_datetime, find_root_key, DynamicDictWriter, dot_notation_match, \
+from utils import count_items, get_datetime, find_root_key, get_dynamic_dict_writer, dot_notation_match, \
     replace_index_with_brackets, combine_matching_pairs, escape_csv_string, sanitize_key_name, \
-    sanitize_top_level_keys, DynamicHeaderWriter, create_temp_array_wrapped_json
+    sanitize_top_level_keys, DynamicHeaderWriter, open_json_items, \
+    is_key_match, get_key_match_cache_stats, add_key_match_cache_stats, DeferredHeaderDictWriter, \
+    iter_pickled_batches, is_json_lines, iter_json_lines_items, get_json_lines_shard_ranges, ParquetDictWriter, \
+    ThreadedRowWriter, get_csv_string_escaper, get_input_compression, strip_compression_ext, CsvOutputFile, \
+    AppendingDictWriter, get_json_lines_end
+from jsonIndex import load_json_offset_index, build_json_offset_index, JsonArraySliceReader
+from jsonSerializer import dumps_json, dumps_json_spaced
+from checkpoint import CHECKPOINT_INTERVAL, get_checkpoint_path, save_checkpoint, load_checkpoint, remove_checkpoint, \
+    get_incremental_state_path, save_incremental_state, load_incremental_state
 import csv
 from colorama import Fore, Style, init
 import os
+import io
+import re
+import tempfile
+import time
+import multiprocessing
+from contextlib import ExitStack, redirect_stdout
 from collections import deque
-import orjson
+from functools import lru_cache, partial
+from itertools import chain, count
+from decimal import Decimal
+
+# more shards than workers keeps every worker busy when some parts of the input are slower to flatten than others
+SHARDS_PER_WORKER = 4
+
+# buffer of the CSV output files, so the batched rows reach the disk in few large writes
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+# instructions of the flatten engine, kept on an explicit stack instead of recursing so deep documents can't hit
+# the recursion limit
+_VALUE, _EXPLODE, _ASSIGN, _NORMALIZE = range(4)
+FLATTEN_KEY_CACHE_SIZE = 65536
+
+# columns linking the rows of array_handling='normalize' child tables to the rows they came from
+NORMALIZED_ID_KEY = '_jsonaut_id'
+NORMALIZED_PARENT_ID_KEY = '_jsonaut_parent_id'
+
+
+class NormalizedRow(dict):
+    """A row of a child table, table being the path of the normalized array the row was flattened from."""
+    __slots__ = ('table',)
+
+    def __init__(self, table, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.table = table
+
+    def copy(self):
+        return NormalizedRow(self.table, self)
+
+
+@lru_cache(maxsize=FLATTEN_KEY_CACHE_SIZE)
+def _child_key(prefix, key, separator, line_break_handling, quote_handling):
+    # the sanitized column name of key below prefix, worked out once per job instead of once per object
+    return sanitize_key_name(f"{prefix}{separator}{key}", line_break_handling, quote_handling) \
+        if prefix else sanitize_key_name(key, line_break_handling, quote_handling)
+
+
+def _row_size(row):
+    # rough size of a row as written out, used for the per object memory ceiling
+    return sum(len(key) + len(str(value)) for key, value in row.items())
+
+
+def _iter_flatten_stack(data, visit, max_rows=None, max_bytes=None, row_ids=None):
+    """
+    Lazily flattens data into rows. visit(value, prefix, rows, stack) either writes value into the rows or pushes
+    instructions for its children onto the stack.
+
+    Exploded arrays don't build the cartesian product: each row is finished and yielded before the next value of an
+    array is flattened, so only the values still to come are held in memory. The rows of one object stop at max_rows
+    or once they add up to about max_bytes, and the overflow is logged instead of exhausting memory.
+
+    Normalized arrays are flattened after the rows of the object they are in, every value into NormalizedRows of
+    their own table. With row_ids every row gets an id from it, and child rows the id of their parent.
+    """
+    # (table, value, prefix, parent id) of the objects still to flatten
+    objects = deque([(None, data, '', None)])
+    while objects:
+        table, value, prefix, parent_id = objects.popleft()
+        row = {} if table is None else NormalizedRow(table)
+        object_id = None
+        if row_ids is not None:
+            object_id = next(row_ids)
+            row[NORMALIZED_ID_KEY] = object_id
+            if parent_id is not None:
+                row[NORMALIZED_PARENT_ID_KEY] = parent_id
+        yield from _iter_object_rows(row, value, prefix, visit, max_rows, max_bytes, objects, object_id)
+
+
+def _iter_object_rows(row, data, prefix, visit, max_rows, max_bytes, objects, object_id):
+    # flattens one object (or one value of a normalized array) into rows, queueing its normalized arrays on objects
+    # the pending instructions are a linked list of (instruction, rest) so every exploded value can carry on with the
+    # same instructions without copying them
+    branches = [(row, ((_VALUE, data, prefix), None), None, 0, None)]
+    normalized = set()
+    rows_yielded = 0
+    bytes_yielded = 0
+    while branches:
+        # an explode still to finish: its row as it was before the explode, the instructions after it, and the next
+        # of its values to flatten
+        base_row, pending, values, idx, prefix = branches.pop()
+        if values is None:
+            row = base_row
+        else:
+            if idx + 1 < len(values):
+                branches.append((base_row, pending, values, idx + 1, prefix))
+                row = base_row.copy()
+            else:  # the last value can have the original row
+                row = base_row
+            pending = ((_VALUE, values[idx], prefix), pending)
+        rows = [row]
+        while pending is not None:
+            instruction, pending = pending
+            op = instruction[0]
+            if op == _VALUE:
+                stack = []
+                visit(instruction[1], instruction[2], rows, stack)
+                for pushed in stack:
+                    pending = (pushed, pending)
+            elif op == _EXPLODE:
+                _, explode_values, explode_prefix = instruction
+                branches.append((row, pending, explode_values, 0, explode_prefix))
+                break
+            elif op == _NORMALIZE:
+                # every exploded row reaches the same array, its values only go to the child table once
+                _, normalize_values, normalize_prefix = instruction
+                if id(normalize_values) not in normalized:
+                    normalized.add(id(normalize_values))
+                    objects.extend((normalize_prefix, value, normalize_prefix, object_id)
+                                   for value in normalize_values)
+            else:  # _ASSIGN, a value written once everything pushed above it was flattened
+                _, assign_prefix, value = instruction
+                row[assign_prefix] = value
+        else:
+            yield row
+            rows_yielded += 1
+            if max_bytes is not None:
+                bytes_yielded += _row_size(row)
+            if (max_rows is not None and rows_yielded >= max_rows) or \
+                    (max_bytes is not None and bytes_yielded >= max_bytes):
+                if branches:
+                    size = f' ({bytes_yielded} bytes)' if max_bytes is not None else ''
+                    print(f'[-] Object explodes into more than {rows_yielded} rows{size}, '
+                          f'skipping the rest of its rows')
+                return
+
+
+def _iter_flatten_items(data, visit, max_rows=None, max_bytes=None, row_ids=None):
+    # a list is flattened object by object, each with its own row cap
+    if isinstance(data, list):
+        for item in data:
+            yield from _iter_flatten_stack(item, visit, max_rows, max_bytes, row_ids)
+    else:
+        yield from _iter_flatten_stack(data, visit, max_rows, max_bytes, row_ids)
+
+
+def is_normalizing(search_config, array_handling):
+    # whether any array of the search is normalized into a child table
+    return array_handling == 'normalize' or (isinstance(search_config, dict) and any(
+        isinstance(config, dict) and config.get('array_handling') == 'normalize' for config in search_config.values()))
+
+
+def _push_children(stack, children):
+    # children are (value, prefix) pairs, pushed in reverse so they come off the stack in order
+    for value, prefix in reversed(children):
+        stack.append((_VALUE, value, prefix))
+
+
+def _push_explode(stack, values, prefix):
+    # one row per value, each carrying on with the rest of the object
+    stack.append((_EXPLODE, values, prefix))
+
+
+def _push_normalize(stack, values, prefix):
+    # the values go to a child table named after prefix instead of into the row
+    stack.append((_NORMALIZE, values, prefix))
 
 
 # used to flatten objects using the array and object handling parameters, along with a separator for nested stuff
 def flatten(data, array_handling='stringify', object_handling='recurse', separator='.', line_break_handling='escape',
             quote_handling='escape', max_string_length=32759, long_string_handling='truncate', quote_values=False,
-            remove_quotes=False):
-    def _flatten_helper(sub_data, prefix='', explode_buffer=None):
-        if explode_buffer is None:
-            explode_buffer = [{}]
+            remove_quotes=False, lazy=False, max_rows=None, max_bytes=None, row_ids=None):
+    # the line break and quote escaping of the values, chosen once for the options of the job
+    escape_value = get_csv_string_escaper(line_break_handling, quote_handling, quote_values)
 
+    def _visit(sub_data, prefix, explode_buffer, stack):
         if isinstance(sub_data, dict):
             if object_handling == 'stringify' and prefix:
+                value = escape_value(dumps_json_spaced(sub_data))
                 for item in explode_buffer:
-                    item[prefix] = escape_csv_string(json.dumps(sub_data, default=str), line_break_handling,
-                                                     quote_handling, quote_values)
+                    item[prefix] = value
             else:  # object_handling == 'recurse'
-                for key, value in sub_data.items():
-                    new_key = sanitize_key_name(f"{prefix}{separator}{key}", line_break_handling, quote_handling) \
-                        if prefix else sanitize_key_name(key, line_break_handling, quote_handling)
-                    explode_buffer = _flatten_helper(value, new_key, explode_buffer)
+                _push_children(stack, [(value, _child_key(prefix, key, separator, line_break_handling, quote_handling))
+                                       for key, value in sub_data.items()])
         # object handling == 'explode'
         elif isinstance(sub_data, list) and array_handling == 'explode':
-            if not sub_data:  # Check if the array is empty
-                for item in explode_buffer:
-                    break  # ignore empty arrays
-            else:
-                new_buffer = []
-                for value in sub_data:
-                    new_explode_buffer = [item.copy() for item in explode_buffer]
-                    new_explode_buffer = _flatten_helper(value, prefix, new_explode_buffer)
-                    new_buffer.extend(new_explode_buffer)
-                explode_buffer = new_buffer
+            if sub_data:  # ignore empty arrays
+                _push_explode(stack, sub_data, prefix)
+        # array handling == 'normalize'
+        elif isinstance(sub_data, list) and array_handling == 'normalize':
+            if sub_data:
+                _push_normalize(stack, sub_data, prefix)
         # object handling == 'horizontal'
         elif isinstance(sub_data, list) and array_handling == 'horizontal':
-            for idx, value in enumerate(sub_data):
-                new_key = f"{prefix}[{idx}]"
-                explode_buffer = _flatten_helper(value, new_key, explode_buffer)
+            _push_children(stack, [(value, f"{prefix}[{idx}]") for idx, value in enumerate(sub_data)])
         else:  # object handling == 'stringify'
             if array_handling == 'stringify' and isinstance(sub_data, list):
-                sub_data = escape_csv_string(json.dumps(sub_data, default=str), line_break_handling,
-                                             quote_handling, quote_values)
+                sub_data = escape_value(dumps_json_spaced(sub_data))
                 if remove_quotes and sub_data.startswith('"') and sub_data.endswith('"'):
                     sub_data = sub_data[1:-1]
                 if len(sub_data) > max_string_length and long_string_handling == 'truncate':
@@ -61,23 +222,17 @@ def flatten(data, array_handling='stringify', object_handling='recurse', separat
             if max_string_length is not None and len(str(sub_data)) > max_string_length:
                 if long_string_handling == 'truncate':
                     sub_data = str(sub_data)[:max_string_length]
-                elif long_string_handling == 'horizontal':
-                    sub_data = str(sub_data)
-                    sub_data_parts = [sub_data[i:i + max_string_length] for i in
-                                      range(0, len(sub_data), max_string_length)]
-                    for idx, value in enumerate(sub_data_parts):
-                        new_key = f"{prefix}[{idx}]"
-                        explode_buffer = _flatten_helper(value, new_key, explode_buffer)
-                elif long_string_handling == 'explode':
+                elif long_string_handling in ('horizontal', 'explode'):
+                    # the parts get flattened first, then the whole string is written over them
                     sub_data = str(sub_data)
                     sub_data_parts = [sub_data[i:i + max_string_length] for i in
                                       range(0, len(sub_data), max_string_length)]
-                    new_buffer = []
-                    for value in sub_data_parts:
-                        new_explode_buffer = [item.copy() for item in explode_buffer]
-                        new_explode_buffer = _flatten_helper(value, prefix, new_explode_buffer)
-                        new_buffer.extend(new_explode_buffer)
-                    explode_buffer = new_buffer
+                    stack.append((_ASSIGN, prefix, sub_data))
+                    if long_string_handling == 'horizontal':
+                        _push_children(stack, [(value, f"{prefix}[{idx}]") for idx, value in enumerate(sub_data_parts)])
+                    else:
+                        _push_explode(stack, sub_data_parts, prefix)
+                    return explode_buffer
 
             for item in explode_buffer:
                 item[prefix] = sub_data
@@ -86,16 +241,14 @@ def flatten(data, array_handling='stringify', object_handling='recurse', separat
 
     data = sanitize_top_level_keys(data, line_break_handling, quote_handling)
 
-    if isinstance(data, list):  # input is a list of objects
-        result = []
-        for item in data:
-            flattened_item = _flatten_helper(item)
-            if flattened_item:
-                result.extend(flattened_item)
-    else:  # input is a single object
-        result = _flatten_helper(data)
-
-    return result
+    # normalized arrays need ids to link their child rows back to the parent rows, numbered per call unless the
+    # caller numbers a whole job
+    if array_handling != 'normalize':
+        row_ids = None
+    elif row_ids is None:
+        row_ids = count(1)
+    rows = _iter_flatten_items(data, _visit, max_rows, max_bytes, row_ids)
+    return rows if lazy else list(rows)
 
 
 def granular_flatten_slow(data, search_config, search_key_match, separator='.', _array_handling='stringify',
@@ -273,94 +426,425 @@ def granular_flatten_still_slow(data, search_config, search_key_match, separator
 def granular_flatten(data, search_config, search_key_match, separator='.', _array_handling='stringify',
                      _object_handling='recurse', line_break_handling='escape', quote_handling='escape',
                      max_string_length=32759, long_string_handling='truncate', quote_values=False,
-                     remove_quotes=False):
+                     remove_quotes=False, lazy=False, max_rows=None, max_bytes=None, row_ids=None):
 
     # TODO might need to use different approaches instead of the below functions
-    json_dumps = orjson.dumps
-    escape_csv_string_fn = escape_csv_string
-
-    def _flatten_helper(sub_data, prefix='', explode_buffer=None):
-        if explode_buffer is None:
-            explode_buffer = deque([{}])
+    # the line break and quote escaping of the values, chosen once for the options of the job
+    escape_value = get_csv_string_escaper(line_break_handling, quote_handling, quote_values)
 
+    def _visit(sub_data, prefix, explode_buffer, stack):
         current_config = search_config.get(search_key_match.get(prefix, ''), {})
         object_handling = current_config.get('object_handling', _object_handling)
         array_handling = current_config.get('array_handling', _array_handling)
 
         if isinstance(sub_data, dict):
             if object_handling == 'stringify' and prefix:
+                value = escape_value(dumps_json(sub_data))
                 for item in explode_buffer:
-                    item[prefix] = escape_csv_string_fn(json_dumps(sub_data, default=str).decode('utf-8'), line_break_handling,
-                                                        quote_handling, quote_values)
+                    item[prefix] = value
             else:  # object_handling == 'recurse'
-                for key, value in sub_data.items():
-                    new_key = sanitize_key_name(f"{prefix}{separator}{key}", line_break_handling, quote_handling) \
-                        if prefix else sanitize_key_name(key, line_break_handling, quote_handling)
-                    explode_buffer = _flatten_helper(value, new_key, explode_buffer)
+                _push_children(stack, [(value, _child_key(prefix, key, separator, line_break_handling, quote_handling))
+                                       for key, value in sub_data.items()])
         elif isinstance(sub_data, list) and array_handling == 'explode':
-            if not sub_data:  # Check if the array is empty
-                pass  # ignore empty arrays or leave as blank
-            else:
-                new_buffer = deque()
-                for value in sub_data:
-                    new_explode_buffer = deque(item.copy() for item in explode_buffer)
-                    new_explode_buffer = _flatten_helper(value, prefix, new_explode_buffer)
-                    new_buffer.extend(new_explode_buffer)
-                explode_buffer = new_buffer
+            if sub_data:  # ignore empty arrays or leave as blank
+                _push_explode(stack, sub_data, prefix)
+        elif isinstance(sub_data, list) and array_handling == 'normalize':
+            if sub_data:
+                _push_normalize(stack, sub_data, prefix)
         elif isinstance(sub_data, list) and array_handling == 'horizontal':
-            for idx, value in enumerate(sub_data):
-                new_key = f"{prefix}[{idx}]"
-                explode_buffer = _flatten_helper(value, new_key, explode_buffer)
+            _push_children(stack, [(value, f"{prefix}[{idx}]") for idx, value in enumerate(sub_data)])
         else:  # array_handling == 'stringify'
-            serialized_sub_data = json_dumps(sub_data, default=str)
-            if remove_quotes:
-                if isinstance(serialized_sub_data, bytes):
-                    serialized_sub_data = serialized_sub_data.decode('utf-8')
-                if serialized_sub_data.startswith('"') and serialized_sub_data.endswith('"'):
-                    serialized_sub_data = serialized_sub_data[1:-1]
+            # Decimals are written with the digits they had in the input, a float would round them
+            serialized_sub_data = str(sub_data) if isinstance(sub_data, Decimal) else dumps_json(sub_data)
+            if remove_quotes and serialized_sub_data.startswith('"') and serialized_sub_data.endswith('"'):
+                serialized_sub_data = serialized_sub_data[1:-1]
+            value = escape_value(serialized_sub_data)
             for item in explode_buffer:
-                item[prefix] = escape_csv_string_fn(serialized_sub_data, line_break_handling,
-                                                    quote_handling, quote_values)
+                item[prefix] = value
             if max_string_length is not None and len(serialized_sub_data) > max_string_length:
-                if long_string_handling == 'truncate':
-                    item[prefix] = serialized_sub_data[:max_string_length]
+                # a string that only outgrows the limit once escaped would split back into itself forever, so it's
+                # truncated instead
+                if long_string_handling == 'truncate' or \
+                        (isinstance(sub_data, str) and len(sub_data) <= max_string_length):
+                    for item in explode_buffer:
+                        item[prefix] = serialized_sub_data[:max_string_length]
                 elif long_string_handling == 'horizontal':
                     sub_data = str(sub_data)
                     sub_data_parts = [sub_data[i:i + max_string_length] for i in
                                       range(0, len(sub_data), max_string_length)]
-                    for idx, value in enumerate(sub_data_parts):
-                        new_key = f"{prefix}[{idx}]"
-                        explode_buffer = _flatten_helper(value, new_key, explode_buffer)
+                    _push_children(stack, [(value, f"{prefix}[{idx}]") for idx, value in enumerate(sub_data_parts)])
                 elif long_string_handling == 'explode':
                     sub_data_parts = [serialized_sub_data[i:i + max_string_length] for i in
                                       range(0, len(serialized_sub_data), max_string_length)]
-                    new_buffer = deque()
-                    for value in sub_data_parts:
-                        new_explode_buffer = deque(item.copy() for item in explode_buffer)
-                        new_explode_buffer = _flatten_helper(value, prefix, new_explode_buffer)
-                        new_buffer.extend(new_explode_buffer)
-                    explode_buffer = new_buffer
+                    _push_explode(stack, sub_data_parts, prefix)
 
         return explode_buffer
 
     data = sanitize_top_level_keys(data, line_break_handling, quote_handling)
 
-    if isinstance(data, list):  # input is a list of objects
-        result = deque()
-        for item in data:
-            flattened_item = _flatten_helper(item)
-            if flattened_item:
-                result.extend(flattened_item)
-    else:  # input is a single object
-        result = _flatten_helper(data)
-    return list(result)
+    # normalized arrays need ids to link their child rows back to the parent rows, numbered per call unless the
+    # caller numbers a whole job
+    if not is_normalizing(search_config, _array_handling):
+        row_ids = None
+    elif row_ids is None:
+        row_ids = count(1)
+    rows = _iter_flatten_items(data, _visit, max_rows, max_bytes, row_ids)
+    return rows if lazy else list(rows)
+
+
+@lru_cache(maxsize=65536)
+def _bigrams(s):
+    # the 2-grams jaccard_index compares (pairs with a space are left out)
+    return frozenset(s[i:i + 2] for i in range(len(s) - 1) if ' ' not in s[i:i + 2])
+
+
+def _parse_search_key_segment(segment):
+    # pre-parses one part of a dot notation search key the way dot_notation_match reads it: '[]' matches any list
+    # index, 'field[a-b]' matches 'field[i]' for a <= i <= b, anything else has to be equal.
+    # Returns None for a range that can never match
+    if segment == '[]':
+        return ('index', None, None)
+    if '[' in segment and ']' in segment:
+        try:
+            field, indices = segment.split('[')
+            start, end = indices[:-1].split('-')
+        except ValueError:
+            raise ValueError(f"Malformed range '{segment}' in search key, expected 'field[start-end]' or '[]'")
+        if not (start.isdigit() and end.isdigit()):
+            return None
+        return ('range', field, (int(start), int(end)))
+    return ('exact', segment, None)
+
+
+class _SearchTrieNode:
+    __slots__ = ('exact', 'patterns', 'terminals', 'reachable')
+
+    def __init__(self):
+        self.exact = {}  # path part -> node
+        self.patterns = []  # (kind, field, range, node) for '[]' and 'field[a-b]' parts
+        self.terminals = set()  # search keys whose whole path ends here
+        self.reachable = set()  # search keys whose path ends somewhere below this node
+
+    def step(self, segment):
+        nodes = []
+        child = self.exact.get(segment)
+        if child is not None:
+            nodes.append(child)
+        for kind, field, index_range, child in self.patterns:
+            if kind == 'index':
+                if segment.isdigit():
+                    nodes.append(child)
+            elif segment.startswith(field + '[') and segment.endswith(']'):
+                index_str = segment[len(field) + 1:-1]
+                if index_str.isdigit() and index_range[0] <= int(index_str) <= index_range[1]:
+                    nodes.append(child)
+        return nodes
+
+
+class SearchMatcher:
+    """
+    A search config compiled once per job so find_keys can match every search key in a single traversal of each
+    object, with the same results as running process_dict once per search key.
+
+    Dot notation paths (with '[]' and '[a-b]' parts parsed up front) live in a trie that is followed along the
+    object, so subtrees no path can reach are only entered for keys matched by name. Name matches with a
+    similarity threshold of 1.0 are dict lookups, lower thresholds go through the shared is_key_match cache.
+    """
+
+    def __init__(self, search_configs):
+        self.search_keys = list(search_configs)
+        self.root = _SearchTrieNode()
+        self.named_keys = {}  # key name -> search keys it matches exactly
+        self.bigram_keys = {}  # 2-grams -> search keys (jaccard_index is 1.0 for the same 2-grams)
+        self.fuzzy_keys = []  # (search key, threshold) for thresholds below 1.0
+        self.name_search_keys = set()  # search keys that can match at any depth by name
+
+        for search_key, config in search_configs.items():
+            self._add_path(search_key)
+            if config.get('allow_dot_notation', False):
+                continue
+            threshold = config.get('similarity_threshold', 1.0)
+            if threshold < 1.0:
+                self.fuzzy_keys.append((search_key, threshold))
+            elif threshold == 1.0:
+                self.named_keys.setdefault(search_key, set()).add(search_key)
+                if _bigrams(search_key):
+                    self.bigram_keys.setdefault(_bigrams(search_key), set()).add(search_key)
+            else:
+                continue
+            self.name_search_keys.add(search_key)
+
+        self.all_search_keys = frozenset(self.search_keys)
+        self._set_reachable(self.root)
+
+    def _add_path(self, search_key):
+        parts = [_parse_search_key_segment(segment) for segment in search_key.split('.')]
+        paths = []
+        if None not in parts:
+            paths.append(parts)
+        if any(part is None or part[0] != 'exact' for part in parts):
+            # dot_notation_match also takes a path that is literally equal to the search key
+            paths.append([('exact', segment, None) for segment in search_key.split('.')])
+
+        for path in paths:
+            node = self.root
+            for kind, field, index_range in path:
+                if kind == 'exact':
+                    node = node.exact.setdefault(field, _SearchTrieNode())
+                    continue
+                for pattern_kind, pattern_field, pattern_range, child in node.patterns:
+                    if (pattern_kind, pattern_field, pattern_range) == (kind, field, index_range):
+                        node = child
+                        break
+                else:
+                    child = _SearchTrieNode()
+                    node.patterns.append((kind, field, index_range, child))
+                    node = child
+            node.terminals.add(search_key)
+
+    def _set_reachable(self, node):
+        for child in list(node.exact.values()) + [pattern[-1] for pattern in node.patterns]:
+            self._set_reachable(child)
+            node.reachable |= child.terminals | child.reachable
+
+    def _advance(self, nodes, key):
+        for segment in key.split('.') if '.' in key else (key,):
+            next_nodes = []
+            for node in nodes:
+                next_nodes.extend(node.step(segment))
+            if not next_nodes:
+                return ()
+            nodes = next_nodes
+        return nodes
+
+    def _searching_below(self, nodes, search_keys):
+        # search keys that could still match somewhere below the current position
+        if not nodes:
+            return search_keys & self.name_search_keys
+        reachable = set(self.name_search_keys)
+        for node in nodes:
+            reachable |= node.reachable
+        return search_keys & reachable
+
+    def _match_key(self, key, nodes, search_keys):
+        matched = set()
+        for node in nodes:
+            matched |= node.terminals
+        matched |= self.named_keys.get(key, matched)
+        key_bigrams = _bigrams(key)
+        if key_bigrams:
+            matched |= self.bigram_keys.get(key_bigrams, matched)
+        for search_key, threshold in self.fuzzy_keys:
+            if search_key not in matched and search_key in search_keys and is_key_match(search_key, key, threshold):
+                matched.add(search_key)
+        return matched & search_keys
+
+    def _match_dict(self, dct, path, nodes, search_keys, is_list_child):
+        results = {}  # search key -> (found, matches)
+        found_here = set()
+        for key, value in dct.items():
+            new_path = f"{path}.{key}" if path else key
+            key_nodes = self._advance(nodes, key) if nodes else ()
+
+            for search_key in self._match_key(key, key_nodes, search_keys):
+                found_here.add(search_key)
+                found, matches = results.setdefault(search_key, ({}, {}))
+                if is_list_child:
+                    new_path_list_child = replace_index_with_brackets(new_path)
+                    found[new_path_list_child] = value
+                    matches[new_path_list_child] = new_path
+                else:
+                    found[new_path] = value
+                    matches[search_key] = new_path
+
+            # like process_dict, a search key isn't looked for inside the rest of a dict once it was found in it
+            if isinstance(value, dict) or isinstance(value, list):
+                still_searching = self._searching_below(key_nodes, search_keys - found_here)
+                if not still_searching:
+                    continue
+                if isinstance(value, dict):
+                    sub_results = self._match_dict(value, new_path, key_nodes, still_searching, False)
+                else:
+                    sub_results = self._match_list(value, new_path, key_nodes, still_searching)
+                for search_key, (sub_found, sub_matches) in sub_results.items():
+                    found, matches = results.setdefault(search_key, ({}, {}))
+                    found.update(sub_found)
+                    matches.update(sub_matches)
+        return results
+
+    def _match_list(self, lst, path, nodes, search_keys):
+        results = {}
+        for index, value in enumerate(lst):
+            if not (isinstance(value, dict) or isinstance(value, list)):
+                continue
+            index_nodes = self._advance(nodes, str(index)) if nodes else ()
+            still_searching = self._searching_below(index_nodes, search_keys)
+            if not still_searching:
+                continue
+            new_path = f"{path}.{index}"
+            if isinstance(value, dict):
+                sub_results = self._match_dict(value, new_path, index_nodes, still_searching, True)
+                for search_key, (sub_found, sub_matches) in sub_results.items():
+                    if sub_found:
+                        found, matches = results.get(search_key, ({}, {}))
+                        matches.update(sub_matches)
+                        results[search_key] = (combine_matching_pairs(found, sub_found), matches)
+            else:
+                sub_results = self._match_list(value, new_path, index_nodes, still_searching)
+                for search_key, (sub_found, sub_matches) in sub_results.items():
+                    found, matches = results.setdefault(search_key, ({}, {}))
+                    found.update(sub_found)
+                    matches.update(sub_matches)
+        return results
+
+    def build_pruned(self, events, event, value, nodes=None, search_keys=None):
+        """
+        Builds the value that starts with (event, value) from ijson.basic_parse events, keeping only what find_keys
+        can match: subtrees of matching keys are built whole, while scalars of other keys and subtrees no search
+        key can reach are skipped without being built (in lists they become None so the indexes stay the same).
+        find_keys gives the same result on the pruned object as on the full one.
+        """
+        if nodes is None:
+            nodes, search_keys = (self.root,), self.all_search_keys
+        if event == 'start_map':
+            obj = {}
+            for event, key in events:
+                if event == 'end_map':
+                    return obj
+                key_nodes = self._advance(nodes, key) if nodes else ()
+                value_event, value = next(events)
+                if self._match_key(key, key_nodes, search_keys):
+                    obj[key] = build_json_value(events, value_event, value)
+                    continue
+                if value_event != 'start_map' and value_event != 'start_array':
+                    continue  # nothing below a scalar to search
+                still_searching = self._searching_below(key_nodes, search_keys)
+                if still_searching:
+                    obj[key] = self.build_pruned(events, value_event, value, key_nodes, still_searching)
+                else:
+                    skip_json_value(events, value_event)
+        elif event == 'start_array':
+            arr = []
+            for event, value in events:
+                if event == 'end_array':
+                    return arr
+                if event != 'start_map' and event != 'start_array':
+                    arr.append(None)  # find_keys only looks inside the dicts and lists of a list
+                    continue
+                index_nodes = self._advance(nodes, str(len(arr))) if nodes else ()
+                still_searching = self._searching_below(index_nodes, search_keys)
+                if still_searching:
+                    arr.append(self.build_pruned(events, event, value, index_nodes, still_searching))
+                else:
+                    skip_json_value(events, event)
+                    arr.append(None)
+        return value
+
+    def find_keys(self, item):
+        results = self._match_dict(item, '', (self.root,), self.all_search_keys, False)
+        result = {}
+        matches = {}
+        for search_key in self.search_keys:
+            if search_key in results:
+                found, key_matches = results[search_key]
+                result.update(found)
+                matches.update(key_matches)
+        return result, matches
+
+
+def compile_search_config(search_config, allow_dot_notation=False, separator='.'):
+    """
+    Compiles a list or granular (dict) search_config into a SearchMatcher, once per job.
+    Returns None for the wildcard and for separators other than '.', which dot notation paths can't be split on.
+    """
+    if separator != '.':
+        return None
+    if isinstance(search_config, dict):
+        return SearchMatcher(search_config)
+    if isinstance(search_config, list):
+        return SearchMatcher({key: {"allow_dot_notation": allow_dot_notation, "similarity_threshold": 1.0}
+                              for key in search_config})
+    return None
+
+
+def build_json_value(events, event, value):
+    # builds the whole value that starts with (event, value) from ijson.basic_parse events, same as ijson.items
+    if event == 'start_map':
+        obj = {}
+        for event, key in events:
+            if event == 'end_map':
+                return obj
+            obj[key] = build_json_value(events, *next(events))
+    elif event == 'start_array':
+        arr = []
+        for event, value in events:
+            if event == 'end_array':
+                return arr
+            arr.append(build_json_value(events, event, value))
+    return value
+
+
+def skip_json_value(events, event):
+    # consumes the rest of the value that starts with event without building anything
+    if event != 'start_map' and event != 'start_array':
+        return
+    depth = 1
+    for event, _ in events:
+        if event == 'start_map' or event == 'start_array':
+            depth += 1
+        elif event == 'end_map' or event == 'end_array':
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def _iter_items_at(events, event, path, matcher):
+    if not path:
+        if event != 'start_array':
+            skip_json_value(events, event)
+            return
+        for event, value in events:
+            if event == 'end_array':
+                return
+            yield matcher.build_pruned(events, event, value)
+    else:
+        if event != 'start_map':
+            skip_json_value(events, event)
+            return
+        for event, key in events:
+            if event == 'end_map':
+                return
+            value_event, _ = next(events)
+            if key == path[0]:
+                yield from _iter_items_at(events, value_event, path[1:], matcher)
+            else:
+                skip_json_value(events, value_event)
+
+
+def iter_pruned_json_items(file_obj, item_prefix, matcher):
+    """
+    Yields the objects under item_prefix like ijson.items, but driven by ijson.basic_parse events so only the parts
+    of each object the compiled search can match get built (see SearchMatcher.build_pruned).
+    """
+    events = ijson.basic_parse(file_obj)
+    if not item_prefix:  # the root value itself, like ijson.items(file_obj, '')
+        for event, value in events:
+            yield matcher.build_pruned(events, event, value)
+        return
+    path = item_prefix.split('.')[:-1]
+    for event, _ in events:
+        yield from _iter_items_at(events, event, path, matcher)
 
 
 def search_and_flatten(input_obj, search_config='*', similarity_threshold=1.0, array_handling='stringify',
                        object_handling='stringify', allow_dot_notation=False, separator=".", verbose=False,
                        max_string_length=32750, long_string_handling='truncate', quote_handling='double',
-                       quote_values=False, remove_quotes=False):
+                       quote_values=False, remove_quotes=False, compiled_search=None, lazy=False,
+                       max_rows_per_object=None, max_object_bytes=None, row_ids=None):
     def find_keys(item, search_configs, allow_dot=False, sim_thresh=1.0):
+        if compiled_search is not None and isinstance(item, dict):
+            return compiled_search.find_keys(item)
+
         def process_dict(dct, search_key, path='', allow_dot=False, sim_thresh=1.0, is_list_child=False):
             found = {}
             matches = {}
@@ -378,7 +862,7 @@ def search_and_flatten(input_obj, search_config='*', similarity_threshold=1.0, a
                             found[new_path] = value
                             matches[search_key] = new_path  # TODO FIX
                 else:
-                    if jaccard_index(search_key, key) >= sim_thresh or (allow_dot and new_path == search_key) or \
+                    if is_key_match(search_key, key, sim_thresh) or (allow_dot and new_path == search_key) or \
                             (dot_notation_match(search_key, new_path)):
                         was_found = True
                         if is_list_child:
@@ -458,6 +942,8 @@ def search_and_flatten(input_obj, search_config='*', similarity_threshold=1.0, a
             if verbose:
                 print(f'\n\nRUNNING - granular keys with list of objects')
             result = []
+            # lazy rows are chained together instead of collected
+            add_rows = result.append if lazy else result.extend
             for temp_object in input_obj:
                 found = find_keys(temp_object, search_config,
                                   allow_dot=search_config.get('allow_dot_notation', allow_dot_notation),
@@ -474,9 +960,11 @@ def search_and_flatten(input_obj, search_config='*', similarity_threshold=1.0, a
                                              long_string_handling=long_string_handling,
                                              quote_handling=quote_handling,
                                              quote_values=quote_values,
-                                             remove_quotes=remove_quotes)
-                result.extend(flattened)
-            return result
+                                             remove_quotes=remove_quotes,
+                                             lazy=lazy, max_rows=max_rows_per_object, max_bytes=max_object_bytes,
+                                             row_ids=row_ids)
+                add_rows(flattened)
+            return chain.from_iterable(result) if lazy else result
 
         # granular keys with one object
         elif isinstance(input_obj, dict):
@@ -499,7 +987,9 @@ def search_and_flatten(input_obj, search_config='*', similarity_threshold=1.0, a
                                     long_string_handling=long_string_handling,
                                     quote_handling=quote_handling,
                                     quote_values=quote_values,
-                                    remove_quotes=remove_quotes)
+                                    remove_quotes=remove_quotes,
+                                    lazy=lazy, max_rows=max_rows_per_object, max_bytes=max_object_bytes,
+                                    row_ids=row_ids)
 
     # list search config
     elif isinstance(search_config, list):
@@ -508,6 +998,8 @@ def search_and_flatten(input_obj, search_config='*', similarity_threshold=1.0, a
             if verbose:
                 print(f'RUNNING - list of keys with list of objects')
             result = []
+            # lazy rows are chained together instead of collected
+            add_rows = result.append if lazy else result.extend
             for temp_object in input_obj:
                 search_keys = search_config
                 found_object = find_keys(temp_object, search_keys, allow_dot=allow_dot_notation)[0]
@@ -520,9 +1012,11 @@ def search_and_flatten(input_obj, search_config='*', similarity_threshold=1.0, a
                                     long_string_handling=long_string_handling,
                                     quote_handling=quote_handling,
                                     quote_values=quote_values,
-                                    remove_quotes=remove_quotes)
-                result.extend(flattened)
-            return result
+                                    remove_quotes=remove_quotes,
+                                    lazy=lazy, max_rows=max_rows_per_object, max_bytes=max_object_bytes,
+                                    row_ids=row_ids)
+                add_rows(flattened)
+            return chain.from_iterable(result) if lazy else result
 
         # list of keys with one object
         elif isinstance(input_obj, dict):
@@ -535,7 +1029,9 @@ def search_and_flatten(input_obj, search_config='*', similarity_threshold=1.0, a
                                 long_string_handling=long_string_handling,
                                 quote_handling=quote_handling,
                                 quote_values=quote_values,
-                                remove_quotes=remove_quotes)
+                                remove_quotes=remove_quotes,
+                                lazy=lazy, max_rows=max_rows_per_object, max_bytes=max_object_bytes,
+                                row_ids=row_ids)
             if verbose:
                 print(f'RESULTS: {flattened}')
             return flattened
@@ -548,19 +1044,60 @@ def search_and_flatten(input_obj, search_config='*', similarity_threshold=1.0, a
                        long_string_handling=long_string_handling,
                        quote_handling=quote_handling,
                        quote_values=quote_values,
-                       remove_quotes=remove_quotes)
-
-
-def search_and_flatten_to_csv(*, input_json: Union[str, Dict], root_key: Optional[str] = None,
-                              search_config: Union[str, Dict] = '*', delimiter: str = ",",
-                              similarity_threshold: float = 1.0, array_handling: str = 'stringify',
-                              object_handling: str = 'stringify', allow_dot_notation: bool = False,
-                              options: Optional[Dict] = None, search_name: str, verbose: bool = False,
-                              separator: str = ".", mode: str = 'normal', num_test_rows: int = None,
-                              max_string_length: int = 32750, long_string_handling: str = 'truncate',
-                              output_format: str = 'normal', quote_handling: str = 'escape',
-                              quote_values: bool = False, quoting=csv.QUOTE_NONE, escapechar: str = '\\',
-                              remove_quotes: bool = True):
+                       remove_quotes=remove_quotes,
+                       lazy=lazy, max_rows=max_rows_per_object, max_bytes=max_object_bytes,
+                       row_ids=row_ids)
+
+
+def get_search_csv_filename(input_json: str, search_name: str, root_key: Optional[str], output_format: str) -> str:
+    """The file a search writes: flattened__<input file>.csv, or named after the search for 'datetime' output."""
+    if output_format == 'datetime':
+        datetime = str(get_datetime())
+        if root_key:
+            return 'flattened__' + search_name + '__' + root_key + '_' + datetime + ".csv"
+        return 'flattened__' + search_name + '__' + datetime + ".csv"
+    input_json_basename = os.path.basename(strip_compression_ext(input_json))
+    filename_without_ext = os.path.splitext(input_json_basename)[0]
+    # 'parquet' writes the same rows as typed columns, read back by the CSV jobs with read_csv_or_parquet
+    if output_format == 'parquet':
+        return f'flattened__{filename_without_ext}.parquet'
+    return f'flattened__{filename_without_ext}.csv'
+
+
+def _get_unused_csv_filename(csv_filename: str, search_name: str, used_filenames: set) -> str:
+    # every search of a file would write flattened__<file>.csv, the later ones get their search name added, and a
+    # number if that is taken too (inputs of the same name in different folders)
+    base, ext = os.path.splitext(csv_filename)
+    candidates = chain([csv_filename, f'{base}__{search_name}{ext}'],
+                       (f'{base}__{search_name}_{number}{ext}' for number in count(2)))
+    csv_filename = next(candidate for candidate in candidates if candidate not in used_filenames)
+    used_filenames.add(csv_filename)
+    return csv_filename
+
+
+def open_csv_search(*, input_json: Union[str, Dict], root_key: Optional[str] = None,
+                     search_config: Union[str, Dict] = '*', delimiter: str = ",",
+                     similarity_threshold: float = 1.0, array_handling: str = 'stringify',
+                     object_handling: str = 'stringify', allow_dot_notation: bool = False,
+                     options: Optional[Dict] = None, search_name: str, verbose: bool = False,
+                     separator: str = ".", mode: str = 'normal', num_test_rows: int = None,
+                     max_string_length: int = 32750, long_string_handling: str = 'truncate',
+                     output_format: str = 'normal', quote_handling: str = 'escape',
+                     quote_values: bool = False, quoting=csv.QUOTE_NONE, escapechar: str = '\\',
+                     remove_quotes: bool = True, header_mode: str = 'deferred', exact_count: bool = False,
+                     workers: int = 1, preserve_order: bool = True, parse_mode: str = 'items',
+                     max_rows_per_object: Optional[int] = None, max_object_bytes: Optional[int] = None,
+                     table_files: Optional[List[str]] = None, batch_rows: int = 1000,
+                     batch_bytes: Optional[int] = None, write_buffer_size: Optional[int] = None,
+                     pipeline: bool = False, output_compression: Optional[str] = None,
+                     max_rows_per_file: Optional[int] = None, max_bytes_per_file: Optional[int] = None,
+                     checkpoint_interval: Optional[float] = None, resume: bool = False, incremental: bool = False,
+                     csv_filename: Optional[str] = None):
+    """
+    Works out what a search_and_flatten_to_csv search reads and where its rows go, and returns it as a CsvSearch.
+    Nothing is written until the search is opened. The output is named after the input or the search (see
+    get_search_csv_filename) unless csv_filename is given.
+    """
     if options:
         input_json = options.get('input_json', input_json)
         root_key = options.get('root_key', root_key)
@@ -579,22 +1116,45 @@ def search_and_flatten_to_csv(*, input_json: Union[str, Dict], root_key: Optiona
         quoting = options.get('quoting', quoting)
         escapechar = options.get('escapechar', escapechar)
         remove_quotes = options.get('remove_quotes', remove_quotes)
+        header_mode = options.get('header_mode', header_mode)
+        exact_count = options.get('exact_count', exact_count)
+        workers = options.get('workers', workers)
+        preserve_order = options.get('preserve_order', preserve_order)
+        parse_mode = options.get('parse_mode', parse_mode)
+        max_rows_per_object = options.get('max_rows_per_object', max_rows_per_object)
+        max_object_bytes = options.get('max_object_bytes', max_object_bytes)
+        table_files = options.get('table_files', table_files)
+        batch_rows = options.get('batch_rows', batch_rows)
+        batch_bytes = options.get('batch_bytes', batch_bytes)
+        write_buffer_size = options.get('write_buffer_size', write_buffer_size)
+        pipeline = options.get('pipeline', pipeline)
+        output_compression = options.get('output_compression', output_compression)
+        max_rows_per_file = options.get('max_rows_per_file', max_rows_per_file)
+        max_bytes_per_file = options.get('max_bytes_per_file', max_bytes_per_file)
+        checkpoint_interval = options.get('checkpoint_interval', checkpoint_interval)
+        resume = options.get('resume', resume)
+        incremental = options.get('incremental', incremental)
+        csv_filename = options.get('csv_filename', csv_filename)
 
     if mode == 'test' and num_test_rows is None:
         raise ValueError("num_test_rows must be provided when mode is 'test'")
     elif mode == 'test' and num_test_rows:
         print(f'[+] Test mode selected with {num_test_rows} rows')
 
-    # Get the total number objects in the input json file (no matter how large)
     print(f'[+] Parsing -> {input_json}')
 
     is_array, found_root_key = find_root_key(input_json, root_key)
     if found_root_key:
         root_key = found_root_key
-    if mode == 'test':
-        total_items = count_items(input_json, root_key, is_array, num_test_rows)
-    else:
-        total_items = count_items(input_json, root_key, is_array)
+
+    # Only count the objects in the input json file up front (a full extra parse) if an exact progress bar is wanted,
+    # otherwise progress follows the byte position in the file
+    total_items = None
+    if exact_count:
+        if mode == 'test':
+            total_items = count_items(input_json, root_key, is_array, num_test_rows)
+        else:
+            total_items = count_items(input_json, root_key, is_array)
 
     if root_key:
         file_to_use = input_json
@@ -602,101 +1162,669 @@ def search_and_flatten_to_csv(*, input_json: Union[str, Dict], root_key: Optiona
     elif is_array:
         file_to_use = input_json
         item_prefix = 'item'
-    else:  # TODO fix this case to work
-        # If the input JSON is a singular object, create a temporary JSON file with the input wrapped in an array
-        temp_input_json = create_temp_array_wrapped_json(input_json)
-        print(f'FILE TO USE: {temp_input_json}')
-        file_to_use = temp_input_json
+    else:
+        # a single object document is its own only object, the empty prefix makes the parser yield the root itself
+        file_to_use = input_json
         total_items = 1
-        item_prefix = 'item.item'
-
-    with open(file_to_use, 'r', encoding='utf-8') as f:
-
-        datetime = str(get_datetime())
-        if output_format == 'datetime':
-            if root_key:
-                csv_filename = 'flattened__' + search_name + '__' + root_key + '_' + datetime + ".csv"
+        item_prefix = ''
+
+    # Split the objects into byte range shards for the worker processes. JSON Lines can be cut at any line break,
+    # for JSON arrays the offset index knows where each object starts and ends.
+    # Test mode stops after a number of rows, so it always runs in this process.
+    shards = None
+    json_lines = is_json_lines(input_json)
+
+    # incremental runs only flatten the lines appended to a JSON Lines file since the last run and add their rows to
+    # the end of the CSV it wrote, see CsvSearch
+    if incremental and (not json_lines or get_input_compression(input_json) is not None):
+        print('[-] Only plain JSON Lines files can be flattened incrementally, ignoring incremental')
+        incremental = False
+    elif incremental and (output_format == 'parquet' or mode == 'test'):
+        print('[-] Parquet output and test mode runs are flattened in full, ignoring incremental')
+        incremental = False
+    elif incremental and output_format == 'datetime':
+        # the state of the last run sits next to its output, and every run writes to a new file
+        print('[-] output_format "datetime" writes a new file every run, there is none to append to, ignoring '
+              'incremental')
+        incremental = False
+    if incremental and workers and workers > 1:
+        print('[-] Incremental runs read the new lines in one process, ignoring workers')
+        workers = 1
+    if incremental and (checkpoint_interval or resume):
+        print('[-] Incremental runs are not checkpointed, ignoring checkpoint_interval and resume')
+        checkpoint_interval, resume = None, False
+    if incremental and (output_compression or max_rows_per_file or max_bytes_per_file):
+        print('[-] Incremental runs append to one plain CSV, ignoring output_compression, max_rows_per_file and '
+              'max_bytes_per_file')
+        output_compression = max_rows_per_file = max_bytes_per_file = None
+
+    # array_handling='normalize' writes a child CSV per normalized array next to the main output
+    normalizing = is_normalizing(search_config, search_config.get('array_handling', array_handling)
+                                 if isinstance(search_config, dict) else array_handling)
+    if workers and workers > 1 and normalizing:
+        print('[-] Normalized arrays are written by a single process, ignoring workers')
+    elif workers and workers > 1 and get_input_compression(input_json) is not None:
+        print('[-] Compressed input can only be read from the start, ignoring workers')
+    elif workers and workers > 1 and mode != 'test' and (root_key or is_array):
+        if json_lines:
+            shards = get_json_lines_shard_ranges(input_json, workers * SHARDS_PER_WORKER)
+            print(f'[+] Flattening {input_json} in {len(shards)} shards with {workers} workers')
+        else:
+            index = load_json_offset_index(input_json, root_key)
+            if index is None:
+                build_json_offset_index(input_json, root_key)
+                index = load_json_offset_index(input_json, root_key)
+            shards = index.shard_ranges(workers * SHARDS_PER_WORKER)
+            print(f'[+] Flattening {index.count} objects in {len(shards)} shards with {workers} workers')
+    if shards and pipeline:
+        print('[-] The shards are read and flattened by the worker processes, ignoring pipeline')
+        pipeline = False
+
+    # a checkpoint every checkpoint_interval seconds lets a rerun with resume continue after the last one
+    if (checkpoint_interval or resume) and mode == 'test':
+        print('[-] Test mode runs are not checkpointed, ignoring checkpoint_interval and resume')
+        checkpoint_interval, resume = None, False
+    elif (checkpoint_interval or resume) and output_format == 'datetime':
+        # the checkpoint sits next to the output, which gets a new name every run
+        print('[-] output_format "datetime" names the output after the time of the run, a rerun could never find '
+              'its checkpoint, ignoring checkpoint_interval and resume')
+        checkpoint_interval, resume = None, False
+    elif resume and not checkpoint_interval:
+        checkpoint_interval = CHECKPOINT_INTERVAL
+
+    # the search keys are compiled once for the whole job instead of being re-parsed for every object
+    compiled_search = compile_search_config(search_config, allow_dot_notation, separator)
+
+    # 'events' builds each object from parser events, keeping only the parts the search can match
+    items_parser = None
+    if parse_mode == 'events':
+        if compiled_search is None or json_lines:
+            print('[-] parse_mode "events" needs a list or granular search config and JSON input, '
+                  'parsing whole objects instead')
+        else:
+            items_parser = partial(iter_pruned_json_items, matcher=compiled_search)
+    elif parse_mode != 'items':
+        raise ValueError(f"Unknown parse_mode '{parse_mode}', expected 'items' or 'events'")
+
+    flatten_kwargs = dict(search_config=search_config,
+                          similarity_threshold=similarity_threshold,
+                          array_handling=array_handling,
+                          object_handling=object_handling,
+                          allow_dot_notation=allow_dot_notation,
+                          separator=separator,
+                          verbose=verbose,
+                          max_string_length=max_string_length,
+                          long_string_handling=long_string_handling,
+                          quote_handling=quote_handling,
+                          quote_values=quote_values,
+                          remove_quotes=remove_quotes,
+                          compiled_search=compiled_search,
+                          # rows go straight to the writer as they are flattened instead of being collected per object
+                          lazy=True,
+                          max_rows_per_object=max_rows_per_object,
+                          max_object_bytes=max_object_bytes,
+                          # one numbering for the whole job, so the ids linking child rows to parents stay unique
+                          row_ids=count(1))
+
+    if csv_filename is None:
+        csv_filename = get_search_csv_filename(input_json, search_name, root_key, output_format)
+
+    # wildcard searches find their columns while flattening, the spilled rows get the full header once at the end
+    if search_config == '*' and header_mode != 'deferred':
+        print('[-] search_config "*" discovers its columns in the one flatten pass, using header_mode "deferred"')
+        header_mode = 'deferred'
+
+    # gzip/zstd output and rolling over into part files, only for CSV that is written front to back
+    if (output_compression or max_rows_per_file or max_bytes_per_file) and output_format == 'parquet':
+        print('[-] Parquet output is compressed by its writer and kept in one file, ignoring output_compression, '
+              'max_rows_per_file and max_bytes_per_file')
+        output_compression = max_rows_per_file = max_bytes_per_file = None
+    elif (output_compression or max_rows_per_file or max_bytes_per_file) and header_mode != 'deferred':
+        print('[-] Compressed or split output writes the header once, using header_mode "deferred"')
+        header_mode = 'deferred'
+
+    return CsvSearch(search_name=search_name, input_json=input_json, file_to_use=file_to_use,
+                     item_prefix=item_prefix, total_items=total_items, json_lines=json_lines, shards=shards,
+                     workers=workers, preserve_order=preserve_order, items_parser=items_parser,
+                     flatten_kwargs=flatten_kwargs, csv_filename=csv_filename, header_mode=header_mode,
+                     writer_kwargs=dict(delimiter=delimiter, dialect='excel', quoting=quoting, escapechar=escapechar,
+                                        batch_rows=batch_rows, batch_bytes=batch_bytes),
+                     mode=mode, num_test_rows=num_test_rows, verbose=verbose, table_files=table_files,
+                     parquet=output_format == 'parquet', write_buffer_size=write_buffer_size or WRITE_BUFFER_SIZE,
+                     pipeline=pipeline, output_compression=output_compression, max_rows_per_file=max_rows_per_file,
+                     max_bytes_per_file=max_bytes_per_file, checkpoint_interval=checkpoint_interval, resume=resume,
+                     incremental=incremental)
+
+
+class CsvSearch:
+    """
+    A search opened by open_csv_search: the objects it reads and the CSV files it writes them to. write_object
+    flattens one object into the files, so searches over the same objects can share one parse of the input.
+
+    Once closed, csv_filename is the file actually written (with the extension of output_compression, or the first
+    part of a split output) and table_files has the other files the search wrote.
+
+    With checkpoint_interval the search saves a checkpoint that often (in seconds) while it runs: the objects read
+    and rows written, and the header and size of every output, whose rows then go to spill files next to them that
+    outlive a crash. A search opened with resume cuts its outputs back to the last checkpoint and carries on from
+    the object after it. The checkpoint and spill files are removed once the search has completed.
+
+    An incremental search over a JSON Lines file that is only ever appended to saves how far it read, along with
+    the header and size of its outputs, once it has completed. The next incremental run only flattens the lines
+    added since and appends their rows to the same CSV files, whose header is rewritten only if new columns showed
+    up (see AppendingDictWriter). A changed input file or settings make it flatten the whole input again.
+    """
+
+    def __init__(self, *, search_name, input_json, file_to_use, item_prefix, total_items, json_lines, shards,
+                 workers, preserve_order, items_parser, flatten_kwargs, csv_filename, header_mode, writer_kwargs, mode,
+                 num_test_rows, verbose, table_files, parquet=False, write_buffer_size=WRITE_BUFFER_SIZE,
+                 pipeline=False, output_compression=None, max_rows_per_file=None, max_bytes_per_file=None,
+                 checkpoint_interval=None, resume=False, incremental=False):
+        self.search_name = search_name
+        self.input_json = input_json
+        self.file_to_use = file_to_use
+        self.item_prefix = item_prefix
+        self.total_items = total_items
+        self.json_lines = json_lines
+        self.shards = shards
+        self.workers = workers
+        self.preserve_order = preserve_order
+        self.items_parser = items_parser
+        self.flatten_kwargs = flatten_kwargs
+        self.csv_filename = csv_filename
+        self.header_mode = header_mode
+        self.writer_kwargs = writer_kwargs
+        self.mode = mode
+        self.num_test_rows = num_test_rows
+        self.verbose = verbose
+        self.table_files = table_files
+        self.parquet = parquet
+        self.write_buffer_size = write_buffer_size
+        self.pipeline = pipeline
+        self.output_compression = output_compression
+        self.max_rows_per_file = max_rows_per_file
+        self.max_bytes_per_file = max_bytes_per_file
+        self.checkpoint_interval = checkpoint_interval
+        self.resume = resume
+        self.incremental = incremental
+        self.incremental_path = None
+        self.start_offset = 0
+        self.end_offset = None
+        self.writer = None
+        self.table_writers = {}
+        self.rows_written = 0
+        self.main_rows_written = 0  # num_test_rows caps the rows of the main CSV, not those of normalized tables
+        self.objects_read = 0
+        self.shards_done = []
+        self.completed = False
+        self.checkpoint_path = None
+        self._next_checkpoint = None
+        self._files = None
+        self._filenames = []  # the files opened by the writers, the main output first
+        self._outputs = {}  # file name -> the CsvOutputFile writing it
+        self._spill_paths = []
+
+    @property
+    def can_share_parse(self):
+        # sharded searches read the input in worker processes, pruned ones need parser events of their own and
+        # checkpointed and incremental ones decide what they read themselves
+        return not self.shards and self.items_parser is None and not self.checkpoint_interval and \
+            not self.incremental
+
+    @property
+    def checkpoint_settings(self):
+        # what shapes the rows, a checkpoint taken with other settings can't be carried on from
+        settings = {key: value for key, value in self.flatten_kwargs.items()
+                    if key not in ('compiled_search', 'row_ids', 'verbose')}
+        return dumps_json([settings, self.item_prefix, self.header_mode, self.parquet, self.shards,
+                           [self.writer_kwargs[key] for key in ('delimiter', 'quoting', 'escapechar')]])
+
+    def open(self):
+        self._files = ExitStack()
+        state = None
+        if self.checkpoint_interval:
+            self.checkpoint_path = get_checkpoint_path(self.csv_filename)
+            if self.resume:
+                state = load_checkpoint(self.checkpoint_path, self.input_json, self.checkpoint_settings)
+                if state is None:
+                    print(f'[+] No checkpoint to resume {self.csv_filename} from, starting from the beginning')
+            self._next_checkpoint = time.monotonic() + self.checkpoint_interval
+        elif self.incremental:
+            self.incremental_path = get_incremental_state_path(self.csv_filename)
+            state = load_incremental_state(self.incremental_path, self.input_json, self.checkpoint_settings)
+            if state is not None and not self._outputs_intact(state):
+                print(f'[-] The outputs of {self.csv_filename} changed since the last run, flattening all of '
+                      f'{self.input_json}')
+                state = None
+            # a last line that is still being written is left for the next run
+            self.start_offset = state['offset'] if state else 0
+            self.end_offset = get_json_lines_end(self.input_json)
+
+        writer_states = state['writers'] if state else {}
+        self.writer = self._open_writer(self.csv_filename, writer_states.get(''))
+        for table, table_state in writer_states.items():
+            if table:
+                self._get_table_writer(table, table_state)
+        if state:
+            self.rows_written = state['rows_written']
+            if 'next_row_id' in state:
+                self.flatten_kwargs['row_ids'] = count(state['next_row_id'])
+        if state and self.incremental:
+            print(f'[+] Appending to {self.csv_filename} ({self.rows_written} rows) what was added to '
+                  f'{self.input_json} since the last run: {self.end_offset - self.start_offset} bytes')
+        elif state:
+            self.objects_read = state['objects_read']
+            self.shards_done = [tuple(shard) for shard in state['shards_done']]
+            print(f'[+] Resuming {self.csv_filename} after {self.objects_read or len(self.shards_done)} '
+                  f'{"objects" if self.objects_read else "shards"}, {self.rows_written} rows written')
+
+    def _get_table_filename(self, table):
+        base, ext = os.path.splitext(self.csv_filename)
+        table_name = re.sub(r'[^\w.\[\]-]+', '_', table)
+        return f"{base}__{table_name}{ext}"
+
+    def _outputs_intact(self, state):
+        # every output of the last incremental run still holds at least the rows it had then
+        for table, writer_state in state['writers'].items():
+            filename = self._get_table_filename(table) if table else self.csv_filename
+            if not os.path.exists(filename):
+                return False
+            with open(filename, 'rb') as f:
+                header_size = len(f.readline())
+                if f.seek(0, os.SEEK_END) < header_size + writer_state['data_size']:
+                    return False
+        return True
+
+    def _take_next_row_id(self):
+        # the next id of the rows linking normalized tables, taken out of the counter and put back
+        next_row_id = next(self.flatten_kwargs['row_ids'])
+        self.flatten_kwargs['row_ids'] = count(next_row_id)
+        return next_row_id
+
+    def save_checkpoint(self):
+        """Saves where the search is, see the class docstring. Only called between two objects."""
+        writers = {'': self.writer.checkpoint()}
+        for table, table_writer in self.table_writers.items():
+            writers[table] = table_writer.checkpoint()
+        state = dict(objects_read=self.objects_read, rows_written=self.rows_written, shards_done=self.shards_done,
+                     writers=writers)
+        if self.flatten_kwargs.get('row_ids') is not None:
+            state['next_row_id'] = self._take_next_row_id()
+        save_checkpoint(self.checkpoint_path, self.input_json, self.checkpoint_settings, state)
+        self._next_checkpoint = time.monotonic() + self.checkpoint_interval
+
+    def _open_writer(self, filename, state=None):
+        if self.incremental and state:
+            # the rows of this run go after the ones of the last one
+            self._filenames.append(filename)
+            writer_kwargs = dict(self.writer_kwargs)
+            writer = AppendingDictWriter(filename, state['data_size'], spill_batch_size=writer_kwargs.pop('batch_rows'),
+                                         spill_batch_bytes=writer_kwargs.pop('batch_bytes'), **writer_kwargs)
+        else:
+            writer = self._open_file_writer(filename, state)
+            if state:
+                writer.resume_from(state)
+        if self.pipeline:
+            # the rows are encoded and written on a writer thread while the next objects are flattened
+            return ThreadedRowWriter(writer, batch_size=self.writer_kwargs['batch_rows'])
+        return writer
+
+    def _open_spill_file(self, filename, state):
+        # checkpointed deferred writers spill to a file of their own instead of a temporary one, resumed from state
+        if not self.checkpoint_interval:
+            return None
+        spill_path = filename + '.spill'
+        self._spill_paths.append(spill_path)
+        return open(spill_path, 'r+b' if state else 'w+b')
+
+    def _open_file_writer(self, filename, state=None):
+        self._filenames.append(filename)
+        if self.parquet:
+            return ParquetDictWriter(filename, spill_batch_size=self.writer_kwargs['batch_rows'],
+                                     spill_batch_bytes=self.writer_kwargs['batch_bytes'],
+                                     spill_file=self._open_spill_file(filename, state))
+        if self.header_mode == 'rewrite':
+            # the header is rewritten in place, which needs a plain file to seek in
+            csvfile = self._files.enter_context(open(filename, 'r+' if state else 'w+',
+                                                     buffering=self.write_buffer_size, newline='', encoding='utf-8'))
+            return get_dynamic_dict_writer(csvfile, header_mode=self.header_mode, **self.writer_kwargs)
+        csvfile = self._outputs[filename] = self._files.enter_context(
+            CsvOutputFile(filename, self.output_compression, self.max_rows_per_file, self.max_bytes_per_file,
+                          buffering=self.write_buffer_size))
+        # TODO add dialect control at config level
+        # 'deferred' spills rows and writes the header once at the end, 'rewrite' rewrites it per new column
+        return get_dynamic_dict_writer(csvfile, header_mode=self.header_mode,
+                                       spill_file=self._open_spill_file(filename, state), **self.writer_kwargs)
+
+    def _get_table_writer(self, table, state=None):
+        # the writer of a normalized array's child table, opened when its first row shows up
+        table_writer = self.table_writers.get(table)
+        if table_writer is None:
+            table_filename = self._get_table_filename(table)
+            table_writer = self.table_writers[table] = self._open_writer(table_filename, state)
+            print(f'[+] Writing normalized array {table} -> {table_filename}')
+        return table_writer
+
+    def write_object(self, obj):
+        """Flattens obj into the CSV files. Returns False once a test mode search has written all its rows."""
+        results = search_and_flatten(input_obj=obj, **self.flatten_kwargs)
+        if not results:
+            return True
+
+        # If results is a single dictionary, wrap it in a list
+        if isinstance(results, dict):
+            results = [results]
+
+        test_mode = self.mode == 'test'
+        for row in results:
+            # writer.smart_writerow(row)  TODO smart writer
+            if isinstance(row, NormalizedRow):
+                # the child rows of the last main row in test mode are still written
+                self._get_table_writer(row.table).writerow(row)
+            elif test_mode and self.main_rows_written >= self.num_test_rows:
+                return False
             else:
-                csv_filename = 'flattened__' + search_name + '__' + datetime + ".csv"
-        if output_format == 'normal':
-            input_json_basename = os.path.basename(input_json)
-            filename_without_ext = os.path.splitext(input_json_basename)[0]
-            csv_filename = f'flattened__{filename_without_ext}.csv'
+                self.writer.writerow(row)
+                self.main_rows_written += 1
+            self.rows_written += 1
+            if self.verbose:
+                print(f'ROW: {row}')
+        return not test_mode or self.main_rows_written < self.num_test_rows
+
+    def _shard_merged(self, shard, rows):
+        self.shards_done.append(shard)
+        self.rows_written += rows
+        if self.checkpoint_interval and time.monotonic() >= self._next_checkpoint:
+            self.save_checkpoint()
+
+    def run(self):
+        # reads the input for this search alone
+        if self.shards:
+            shards = [shard for shard in self.shards if shard not in self.shards_done]
+            flatten_shards_in_parallel(self.writer, self.input_json, shards, self.workers, self.preserve_order,
+                                       self.flatten_kwargs, json_lines=self.json_lines, item_prefix=self.item_prefix,
+                                       prune_events=self.items_parser is not None, on_shard_merged=self._shard_merged)
+        else:
+            # a resumed search skips the objects of the last checkpoint, JSON Lines without even parsing them, an
+            # incremental one reads the lines after the last run
+            with open_json_items(self.file_to_use, self.item_prefix, self.total_items, skip_items=self.objects_read,
+                                 items_parser=self.items_parser, prefetch=self.pipeline,
+                                 start=self.start_offset, end=self.end_offset) as parser:
+                for obj in parser:
+                    if not self.write_object(obj):
+                        print(f'[+] Test row number reached')
+                        break
+                    self.objects_read += 1
+                    if self.checkpoint_interval and time.monotonic() >= self._next_checkpoint:
+                        self.save_checkpoint()
+        self.completed = True
+
+    def close(self):
+        # writer.remove_padding()  TODO smart writer
+        self.writer.close()
+        for table_writer in self.table_writers.values():
+            table_writer.close()
+        self._files.close()
+
+        # a search that didn't get to the end keeps its checkpoint and spill files for a resumed run
+        if self.checkpoint_path and self.completed:
+            remove_checkpoint(self.checkpoint_path)
+            for spill_path in self._spill_paths:
+                os.remove(spill_path)
+        if self.incremental_path and self.completed:
+            self._save_incremental_state()
+
+        # compressed or split files are named after the file they were opened for
+        files = []
+        for filename in self._filenames:
+            output = self._outputs.get(filename)
+            files.extend(output.paths if output is not None else [filename])
+        self.csv_filename, *other_files = files
+        if self.table_files is not None:
+            self.table_files.extend(other_files)
+
+    def _save_incremental_state(self):
+        writers = {}
+        for table, writer in [('', self.writer)] + list(self.table_writers.items()):
+            filename = self._get_table_filename(table) if table else self.csv_filename
+            with open(filename, 'rb') as f:
+                header_size = len(f.readline())
+                data_size = f.seek(0, os.SEEK_END) - header_size
+            writers[table] = {'fieldnames': list(writer.fieldnames), 'data_size': data_size}
+        state = dict(offset=self.end_offset, rows_written=self.rows_written, writers=writers)
+        if self.flatten_kwargs.get('row_ids') is not None:
+            state['next_row_id'] = self._take_next_row_id()
+        save_incremental_state(self.incremental_path, self.input_json, self.checkpoint_settings, state)
+
+
+def search_and_flatten_to_csv(**kwargs):
+    """Runs one search over its input into a CSV file and returns the file name, see open_csv_search."""
+    search = open_csv_search(**kwargs)
+    search.open()
+    try:
+        search.run()
+    finally:
+        search.close()
+    return search.csv_filename
+
+
+def search_and_flatten_to_csvs(searches: List[Dict], parallel: int = 1) -> List[str]:
+    """
+    Runs several searches, each given as the arguments of open_csv_search, and returns their CSV files in the same
+    order. Searches over the objects of the same file share one parse of it: every object is handed to each of them
+    in turn. Sharded or event pruned searches still read the input on their own.
+
+    With parallel > 1 the searches of different input files run in that many worker processes at once.
+    """
+    if parallel and parallel > 1:
+        return run_searches_in_parallel(searches, parallel)
+
+    opened = [open_csv_search(**options) for options in searches]
+
+    used_filenames = set()
+    for search in opened:
+        search.csv_filename = _get_unused_csv_filename(search.csv_filename, search.search_name, used_filenames)
+
+    groups = {}
+    for search in opened:
+        key = (search.file_to_use, search.item_prefix) if search.can_share_parse else id(search)
+        groups.setdefault(key, []).append(search)
+
+    for group in groups.values():
+        with ExitStack() as stack:
+            for search in group:
+                search.open()
+                stack.callback(search.close)
+            if len(group) == 1:
+                group[0].run()
+            else:
+                _run_searches_in_one_parse(group)
+    return [search.csv_filename for search in opened]
 
-        with open(csv_filename, 'w+', newline='', encoding='utf-8') as csvfile:
-            parser = ijson.items(f, item_prefix)
-            # Create the DictWriter with an empty set of fieldnames
-            fieldnames = []
-            if search_config == "*":
-                # TODO improve this for wildcard option
-                headers_csv = get_flattened_csv_headers_from_json(input_json=input_json, root_key=root_key, mode=mode,
-                                                                  num_test_rows=num_test_rows, separator=separator)
-                fieldnames = get_first_column_values(headers_csv)
-                print(fieldnames)
-
-            # TODO add dialect control at config level
-            writer = DynamicDictWriter(csvfile, fieldnames=fieldnames, delimiter=delimiter, dialect='excel',
-                                       quoting=quoting, escapechar=escapechar)
-            if search_config == "*":
-                writer.update_header()
 
-            rows_written = 0
-            for obj in tqdm(parser, total=total_items, desc='Processing objects', unit=' objects', ncols=100):
-                results = search_and_flatten(input_obj=obj,
-                                             search_config=search_config,
-                                             similarity_threshold=similarity_threshold,
-                                             array_handling=array_handling,
-                                             object_handling=object_handling,
-                                             allow_dot_notation=allow_dot_notation,
-                                             separator=separator,
-                                             verbose=verbose,
-                                             max_string_length=max_string_length,
-                                             long_string_handling=long_string_handling,
-                                             quote_handling=quote_handling,
-                                             quote_values=quote_values,
-                                             remove_quotes=remove_quotes)
-                if not results:
-                    continue
+def _get_search_option(options, key):
+    # an argument of open_csv_search, which takes it from the nested options dict first
+    return (options.get('options') or {}).get(key, options.get(key))
 
-                # If results is a single dictionary, wrap it in a list
-                if isinstance(results, dict):
-                    results = [results]
 
-                for row in results:
-                    # writer.smart_writerow(row)  TODO smart writer
-                    writer.writerow(row)
-                    rows_written += 1
-                    if verbose:
-                        print(f'ROW: {row}')
-                    if mode == 'test' and rows_written >= num_test_rows:
-                        break
-                if mode == 'test' and rows_written >= num_test_rows:
-                    print(f'[+] Test row number reached')
-                    break
-            # writer.remove_padding()  TODO smart writer
-    return csv_filename
+def _set_search_option(options, key, value):
+    # sets an argument of open_csv_search where it would be read from (options is a copy for a worker)
+    if key in (options.get('options') or {}):
+        options['options'] = dict(options['options'], **{key: value})
+    else:
+        options[key] = value
+
+
+def _run_search_group(searches):
+    # runs in a worker process: the searches of one input file, with their log kept together for the main process
+    hits_before, misses_before = get_key_match_cache_stats()
+    log = io.StringIO()
+    with redirect_stdout(log):
+        csv_filenames = search_and_flatten_to_csvs(searches)
+    hits, misses = get_key_match_cache_stats()
+    return (csv_filenames, [_get_search_option(options, 'table_files') for options in searches], log.getvalue(),
+            (hits - hits_before, misses - misses_before))
+
+
+def run_searches_in_parallel(searches, parallel):
+    """
+    Runs the searches (arguments of open_csv_search) in a pool of parallel worker processes and returns their CSV
+    files in the order of searches. The searches of one input file stay together in one worker so they still share
+    its parse. Each worker's log is printed in one piece, in the order of the searches.
+    """
+    groups = {}
+    for idx, options in enumerate(searches):
+        groups.setdefault(options.get('input_json'), []).append(idx)
+    groups = list(groups.values())
+
+    # the outputs are named here, inputs of the same name in different folders would have two processes write the
+    # same flattened__<file>.csv
+    csv_filenames = [None] * len(searches)
+    used_filenames = set()
+    for group in groups:
+        for idx in group:
+            settings = dict(searches[idx], **(searches[idx].get('options') or {}))
+            csv_filename = settings.get('csv_filename')
+            if csv_filename is None:
+                root_key = settings.get('root_key')
+                root_key = find_root_key(settings['input_json'], root_key)[1] or root_key
+                csv_filename = get_search_csv_filename(settings['input_json'], settings['search_name'], root_key,
+                                                       settings.get('output_format', 'normal'))
+            csv_filenames[idx] = _get_unused_csv_filename(csv_filename, settings['search_name'], used_filenames)
+
+    tasks = []
+    for group in groups:
+        group_searches = []
+        for idx in group:
+            options = dict(searches[idx], csv_filename=csv_filenames[idx])
+            if options.get('options'):
+                options['options'] = dict(options['options'], csv_filename=csv_filenames[idx])
+            # pool workers can't start pools of their own
+            workers = _get_search_option(options, 'workers')
+            if workers and workers > 1:
+                print(f'[-] {_get_search_option(options, "search_name")} runs in a single process next to the other '
+                      f'searches, ignoring workers')
+                _set_search_option(options, 'workers', 1)
+            # the worker fills its own copy, it's copied back below
+            if _get_search_option(options, 'table_files') is not None:
+                _set_search_option(options, 'table_files', [])
+            group_searches.append(options)
+        tasks.append(group_searches)
+
+    print(f'[+] Running {len(searches)} searches of {len(groups)} files in {min(parallel, len(groups))} processes')
+    with multiprocessing.Pool(min(parallel, len(groups))) as pool:
+        for group, (group_csv_filenames, group_table_files, log, cache_stats) in \
+                zip(groups, pool.imap(_run_search_group, tasks)):
+            print(log, end='')
+            add_key_match_cache_stats(*cache_stats)
+            for idx, csv_filename, table_files in zip(group, group_csv_filenames, group_table_files):
+                csv_filenames[idx] = csv_filename
+                if table_files:
+                    _get_search_option(searches[idx], 'table_files').extend(table_files)
+    return csv_filenames
+
+
+def _run_searches_in_one_parse(searches):
+    # all the searches read the same objects of the same file, so it is parsed once and every object goes to each
+    first = searches[0]
+    print(f'[+] Flattening {first.file_to_use} once for {len(searches)} searches')
+    active = list(searches)
+    with open_json_items(first.file_to_use, first.item_prefix, first.total_items,
+                         prefetch=any(search.pipeline for search in searches)) as parser:
+        for obj in parser:
+            for search in list(active):
+                if not search.write_object(obj):
+                    print(f'[+] Test row number reached for {search.search_name}')
+                    active.remove(search)
+            if not active:
+                break
+
+
+def _flatten_shard(shard):
+    # runs in a worker process: flattens the objects of one byte range of the input and spills the rows to a file
+    input_json, start, end, json_lines, item_prefix, prune_events, flatten_kwargs = shard
+    hits_before, misses_before = get_key_match_cache_stats()
+    temp_folder = "temp"
+    if not os.path.exists(temp_folder):
+        os.makedirs(temp_folder, exist_ok=True)
+
+    with open(input_json, 'rb') as f, \
+            tempfile.NamedTemporaryFile(mode='w+b', dir=temp_folder, suffix='.spill', delete=False) as spill_file:
+        writer = DeferredHeaderDictWriter(None, spill_file=spill_file)
+        if json_lines:
+            f.seek(start)
+            items = iter_json_lines_items(f, item_prefix, end=end)
+        elif prune_events:
+            items = iter_pruned_json_items(JsonArraySliceReader(f, start, end), 'item',
+                                           flatten_kwargs['compiled_search'])
+        else:
+            items = ijson.items(JsonArraySliceReader(f, start, end), 'item')
+        for obj in items:
+            results = search_and_flatten(input_obj=obj, **flatten_kwargs)
+            if not results:
+                continue
+            if isinstance(results, dict):
+                results = [results]
+            writer.writerows(results)
+        fieldnames = writer.finish_spill()
+    hits, misses = get_key_match_cache_stats()
+    return spill_file.name, fieldnames, (start, end), (hits - hits_before, misses - misses_before)
+
+
+def flatten_shards_in_parallel(writer, input_json, shards, workers, preserve_order=True, flatten_kwargs=None,
+                               json_lines=False, item_prefix='item', prune_events=False, on_shard_merged=None):
+    """
+    Flattens the shards (byte ranges of whole objects or lines) in a pool of worker processes and merges the rows
+    each worker spilled into writer. With preserve_order the shards are merged in file order, so the rows and
+    columns come out exactly as a single process run would write them, otherwise shards are merged as they finish.
+    on_shard_merged is called with every shard and the number of its rows once they are in writer.
+    """
+    tasks = [(input_json, start, end, json_lines, item_prefix, prune_events, flatten_kwargs or {})
+             for start, end in shards]
+    rows_written = 0
+    with multiprocessing.Pool(workers) as pool, \
+            tqdm(total=sum(end - start for start, end in shards), desc='Processing objects', unit='B',
+                 unit_scale=True, unit_divisor=1024, ncols=100) as pbar:
+        results = pool.imap(_flatten_shard, tasks) if preserve_order else pool.imap_unordered(_flatten_shard, tasks)
+        for spill_path, fieldnames, (start, end), cache_stats in results:
+            add_key_match_cache_stats(*cache_stats)
+            shard_rows = 0
+            try:
+                with open(spill_path, 'rb') as spill_file:
+                    batches = iter_pickled_batches(spill_file)
+                    if isinstance(writer, DeferredHeaderDictWriter):
+                        shard_rows = writer.write_spilled_rows(fieldnames, batches)
+                    else:
+                        for batch in batches:
+                            for ids, values in batch:
+                                writer.writerow(dict(zip(map(fieldnames.__getitem__, ids), values)))
+                                shard_rows += 1
+            finally:
+                os.remove(spill_path)
+            rows_written += shard_rows
+            if on_shard_merged is not None:
+                on_shard_merged((start, end), shard_rows)
+            pbar.update(end - start)
+    return rows_written
 
 
 def get_flattened_csv_headers_from_json(input_json: Union[str, Dict], root_key: Optional[str] = None,
                                         delimiter: str = ",", separator: str = ".", mode: str = 'normal',
-                                        num_test_rows: int = None):
+                                        num_test_rows: int = None, exact_count: bool = False):
     if mode == 'test' and num_test_rows is None:
         raise ValueError("num_test_rows must be provided when mode is 'test'")
     elif mode == 'test' and num_test_rows:
         print(f'[+] Test mode selected with {num_test_rows} rows')
 
-    # Get the total number objects in the input json file (no matter how large)
     print(f'[+] Parsing -> {input_json}')
-    if find_root_key(input_json):
+    total_items = None
+    if exact_count:
         if mode == 'test':
-            total_items = count_items(input_json, root_key, num_test_rows)
+            total_items = count_items(input_json, root_key, True, num_test_rows)
         else:
-            total_items = count_items(input_json, root_key)
-    else:
-        print(f'[X] Root Key NOT Found for {input_json}')
+            total_items = count_items(input_json, root_key, True)
 
-    with open(input_json, 'r', encoding='utf-8') as f:
-        parser = ijson.items(f, f"{root_key}.item" if root_key else 'item')
+    with open_json_items(input_json, f"{root_key}.item" if root_key else 'item', total_items) as parser:
         datetime = str(get_datetime())
 
         if root_key:
@@ -709,7 +1837,7 @@ def get_flattened_csv_headers_from_json(input_json: Union[str, Dict], root_key:
             fieldnames = set()
             writer = DynamicHeaderWriter(csvfile, fieldnames=fieldnames, delimiter=delimiter)
             rows_written = 0
-            for obj in tqdm(parser, total=total_items, desc='Processing objects', unit=' objects', ncols=100):
+            for obj in parser:
                 results = flatten(obj,
                                   array_handling='stringify',
                                   object_handling='recurse',
@@ -0,0 +1,72 @@
+import csv
+import json
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs the test in an empty folder, the jobs write their outputs (and a temp folder) next to where they run."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def read_csv(path, **fmtparams):
+    """The rows of a CSV as lists, header included."""
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f, **fmtparams))
+
+
+def load_baseline_outputs():
+    """The inputs and outputs of the original implementation kept in data/baseline_outputs.json."""
+    with open(os.path.join(DATA_DIR, 'baseline_outputs.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_baseline_inputs(baseline):
+    """Writes every input of the baseline outputs to <name>.json in the current folder."""
+    for name, data in baseline['inputs'].items():
+        with open(f'{name}.json', 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+
+def flatten_baseline_case(case, **kwargs):
+    """Runs a search_and_flatten_to_csv case of the baseline outputs (kwargs override its options) and reads back
+    what it wrote."""
+    from searchAndFlatten import search_and_flatten_to_csv
+
+    options = dict(case['kwargs'], **kwargs)
+    options.setdefault('search_name', 'golden')
+    return read_csv(search_and_flatten_to_csv(input_json=f"{case['input']}.json", quoting=csv.QUOTE_ALL,
+                                              escapechar=None, **options))
+
+
+def row_multiset(rows):
+    """
+    Flattened rows (dicts) as a sorted list of their non-empty cells, to compare outputs whatever the order of their
+    rows and columns. Rows without any value are left out.
+    """
+    cells = ({key: value for key, value in row.items() if value not in ('', None)} for row in rows)
+    return sorted(json.dumps(row, sort_keys=True) for row in cells if row)
+
+
+def csv_row_multiset(rows):
+    """row_multiset of the rows read_csv returned, header first."""
+    return row_multiset(dict(zip(rows[0], row)) for row in rows[1:]) if rows else []
+
+
+def run_main(monkeypatch, config, *args):
+    """Writes config to config.json and runs main.py on it the way the command line does."""
+    import main
+
+    with open('config.json', 'w') as f:
+        json.dump(config, f)
+    monkeypatch.setattr(sys, 'argv', ['main.py', '-c', 'config.json', *args])
+    main.main()
@@ -0,0 +1,59 @@
+import io
+import json
+
+import pytest
+
+from searchAndFlatten import open_csv_search, search_and_flatten_to_csv, WRITE_BUFFER_SIZE
+from utils import DeferredHeaderDictWriter, DynamicDictWriter, estimate_row_bytes
+
+# new columns keep showing up, so the rewrite mode changes its header in the middle of batches
+OBJECTS = [{'id': i, f'key{i % 7}': 'v' * (i % 13), 'nested': {f'n{i % 5}': i}} for i in range(60)]
+
+
+@pytest.fixture
+def objects_json(workdir):
+    with open('in.json', 'w') as f:
+        json.dump(OBJECTS, f)
+    return 'in.json'
+
+
+def flatten(header_mode, **kwargs):
+    with open(search_and_flatten_to_csv(input_json='in.json', search_name=f'{header_mode}_{kwargs}',
+                                        header_mode=header_mode, **kwargs), newline='') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('header_mode', ['deferred', 'rewrite'])
+@pytest.mark.parametrize('kwargs', [{'batch_rows': 1000}, {'batch_rows': 7}, {'batch_bytes': 10},
+                                    {'batch_rows': 3, 'batch_bytes': 40}, {'write_buffer_size': 16}], ids=str)
+def test_batches_write_what_single_rows_do(objects_json, header_mode, kwargs):
+    assert flatten(header_mode, **kwargs) == flatten(header_mode, batch_rows=1)
+
+
+def test_batches_are_flushed_by_rows_or_bytes(workdir):
+    with open('out.csv', 'w+', newline='') as csvfile:
+        writer = DynamicDictWriter(csvfile, fieldnames=[], batch_size=3, batch_bytes=20)
+        writer.writerows([{'a': 'x'}, {'a': 'y'}])
+        assert len(writer._batch) == 2
+        writer.writerow({'a': 'z'})
+        assert writer._batch == []
+        writer.writerow({'a': 'x' * 20})  # a row over batch_bytes is written right away
+        assert writer._batch == []
+        writer.writerow({'a': 'y'})
+        writer.close()
+    with open('out.csv', newline='') as csvfile:
+        assert csvfile.read().split() == ['a', 'x', 'y', 'z', 'x' * 20, 'y']
+
+    deferred = DeferredHeaderDictWriter(io.StringIO(), spill_batch_size=3, spill_batch_bytes=20)
+    deferred.writerows([{'a': 'x'}, {'a': 'y' * 19}, {'a': 'z'}])
+    assert deferred._batch == [((0,), ('z',))]
+
+
+def test_row_size_estimate():
+    assert estimate_row_bytes(['abc', 1, None, 2.5, '']) == 3 + 8 * 3
+
+
+def test_write_buffer_size_option(objects_json):
+    assert open_csv_search(input_json='in.json', search_name='a').write_buffer_size == WRITE_BUFFER_SIZE
+    assert open_csv_search(input_json='in.json', search_name='a',
+                           options={'write_buffer_size': 4096}).write_buffer_size == 4096
@@ -0,0 +1,216 @@
+import glob
+import json
+import os
+
+import pyarrow.parquet as pq
+import pytest
+
+import searchAndFlatten
+from conftest import run_main
+from searchAndFlatten import CsvSearch, search_and_flatten_to_csv
+
+OBJECTS = [{'id': i, f'key{i % 7}': 'v' * (i % 5), 'tags': ['a', 'b', 'c'][:i % 4]} for i in range(60)]
+
+
+class Crash(Exception):
+    pass
+
+
+class Clock:
+    """Stands in for the time module of searchAndFlatten, every call of monotonic is one second later."""
+
+    def __init__(self):
+        self.now = 0
+
+    def monotonic(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def inputs(workdir, monkeypatch):
+    monkeypatch.setattr(searchAndFlatten, 'time', Clock())
+    with open('array.json', 'w') as f:
+        json.dump(OBJECTS, f, indent=2)
+    with open('lines.jsonl', 'w') as f:
+        f.writelines(json.dumps(obj) + '\n' for obj in OBJECTS)
+    # JSON Lines with a root key, three objects in the array of every line
+    with open('rooted.jsonl', 'w') as f:
+        f.writelines(json.dumps({'data': OBJECTS[i:i + 3]}) + '\n' for i in range(0, len(OBJECTS), 3))
+
+
+@pytest.fixture
+def crash(monkeypatch):
+    """crash(n) makes searches fail after flattening n more objects, crash(None) lets them run again."""
+    remaining = [None]
+    flattened = [0]
+    write_object = CsvSearch.write_object
+
+    def crashing_write_object(self, obj):
+        if remaining[0] is not None:
+            if remaining[0] == 0:
+                raise Crash()
+            remaining[0] -= 1
+        flattened[0] += 1
+        return write_object(self, obj)
+
+    def set_crash(n):
+        remaining[0] = n
+        flattened[0] = 0
+        return flattened
+
+    monkeypatch.setattr(CsvSearch, 'write_object', crashing_write_object)
+    return set_crash
+
+
+def outputs():
+    # the files the search wrote, checkpoint and spill files aside
+    files = {}
+    for path in sorted(glob.glob('flattened__*')):
+        if not path.endswith(('.checkpoint', '.spill')):
+            with open(path, 'rb') as f:
+                files[path] = f.read()
+    return files
+
+
+def remove_outputs():
+    for path in glob.glob('flattened__*'):
+        os.remove(path)
+
+
+INPUTS = [('array.json', None), ('lines.jsonl', None), ('rooted.jsonl', 'data')]
+
+
+@pytest.mark.parametrize('input_json, root_key', INPUTS)
+@pytest.mark.parametrize('kwargs', [{}, {'header_mode': 'rewrite', 'search_config': ['id', 'key1', 'tags']},
+                                    {'pipeline': True}, {'batch_rows': 4},
+                                    {'array_handling': 'normalize', 'object_handling': 'recurse'}], ids=str)
+def test_resumed_run_writes_what_an_uninterrupted_run_does(inputs, crash, input_json, root_key, kwargs):
+    kwargs = dict(kwargs, input_json=input_json, root_key=root_key, search_name='a')
+    search_and_flatten_to_csv(**kwargs)
+    expected = outputs()
+    remove_outputs()
+
+    crash(25)
+    with pytest.raises(Crash):
+        search_and_flatten_to_csv(checkpoint_interval=5, **kwargs)
+    assert glob.glob('flattened__*.checkpoint')
+
+    flattened = crash(None)
+    search_and_flatten_to_csv(resume=True, checkpoint_interval=5, **kwargs)
+    assert outputs() == expected
+    # only the objects after the last checkpoint were flattened again
+    assert 0 < flattened[0] < len(OBJECTS) - 20
+    assert not glob.glob('flattened__*.checkpoint') and not glob.glob('flattened__*.spill')
+
+
+def test_resumed_parquet_output(inputs, crash):
+    expected = pq.read_table(search_and_flatten_to_csv(input_json='array.json', search_name='a',
+                                                       output_format='parquet'))
+    remove_outputs()
+    crash(30)
+    with pytest.raises(Crash):
+        search_and_flatten_to_csv(input_json='array.json', search_name='a', output_format='parquet',
+                                  checkpoint_interval=3)
+    crash(None)
+    output = search_and_flatten_to_csv(input_json='array.json', search_name='a', output_format='parquet', resume=True,
+                                       checkpoint_interval=3)
+    assert pq.read_table(output).equals(expected)
+
+
+def test_resumed_sharded_run(inputs, monkeypatch):
+    search_and_flatten_to_csv(input_json='lines.jsonl', search_name='a', workers=2)
+    expected = outputs()
+    remove_outputs()
+
+    merged = []
+    shard_merged = CsvSearch._shard_merged
+
+    def crashing_shard_merged(self, shard, rows):
+        shard_merged(self, shard, rows)
+        merged.append(shard)
+        if len(merged) == 5:
+            raise Crash()
+
+    monkeypatch.setattr(CsvSearch, '_shard_merged', crashing_shard_merged)
+    with pytest.raises(Crash):
+        search_and_flatten_to_csv(input_json='lines.jsonl', search_name='a', workers=2, checkpoint_interval=1)
+    merged.clear()
+    search_and_flatten_to_csv(input_json='lines.jsonl', search_name='a', workers=2, resume=True,
+                              checkpoint_interval=1)
+    assert outputs() == expected
+    # 2 workers make 8 shards, the ones merged before the crash were not flattened again
+    assert len(merged) == 3
+
+
+def test_checkpoint_of_a_changed_input_is_dropped(inputs, crash, capsys):
+    crash(25)
+    with pytest.raises(Crash):
+        search_and_flatten_to_csv(input_json='lines.jsonl', search_name='a', checkpoint_interval=5)
+    with open('lines.jsonl', 'a') as f:
+        f.write(json.dumps({'id': 'new'}) + '\n')
+    flattened = crash(None)
+    search_and_flatten_to_csv(input_json='lines.jsonl', search_name='a', checkpoint_interval=5, resume=True)
+    assert 'was taken of another input file or with other settings, starting from the beginning' in \
+           capsys.readouterr().out
+    assert flattened[0] == len(OBJECTS) + 1
+    resumed = outputs()
+    remove_outputs()
+    search_and_flatten_to_csv(input_json='lines.jsonl', search_name='a')
+    assert outputs() == resumed
+
+
+def test_rooted_json_lines_skip_objects_not_lines(inputs, crash):
+    # the checkpoint after 5 objects ends part way through the array of the second line
+    crash(7)
+    with pytest.raises(Crash):
+        search_and_flatten_to_csv(input_json='rooted.jsonl', root_key='data', search_name='a', search_config=['id'],
+                                  checkpoint_interval=5)
+    crash(None)
+    output = search_and_flatten_to_csv(input_json='rooted.jsonl', root_key='data', search_name='a',
+                                       search_config=['id'], checkpoint_interval=5, resume=True)
+    with open(output) as f:
+        assert f.read().split() == ['id'] + [str(i) for i in range(len(OBJECTS))]
+
+
+def test_datetime_outputs_are_not_checkpointed(inputs, capsys):
+    search_and_flatten_to_csv(input_json='array.json', search_name='a', output_format='datetime',
+                              checkpoint_interval=1, resume=True)
+    assert 'ignoring checkpoint_interval and resume' in capsys.readouterr().out
+    assert not glob.glob('*.checkpoint') and not glob.glob('*.spill')
+
+
+def flatten_job_config():
+    with open('searches.json', 'w') as f:
+        json.dump({'ids': {'search_config': ['id']}}, f)
+    return {'jobs': [{'name': 'flatten', 'type': 'search_and_flatten_csv', 'search_config_path': 'searches.json',
+                      'searchconfigs': {'ids': 'array.json'}}]}
+
+
+def test_job_progress_is_only_recorded_with_resume(inputs, monkeypatch, capsys):
+    config = flatten_job_config()
+    run_main(monkeypatch, config)
+    assert not os.path.exists('config.json.progress')
+
+    run_main(monkeypatch, config, '-r')
+    assert os.path.exists('config.json.progress')
+    run_main(monkeypatch, config, '-r')
+    assert 'already completed, skipping' in capsys.readouterr().out
+
+
+def test_job_with_changed_files_runs_again(inputs, monkeypatch, capsys):
+    config = flatten_job_config()
+    run_main(monkeypatch, config, '-r')
+    with open('array.json', 'w') as f:
+        json.dump(OBJECTS[:10], f)
+    capsys.readouterr()
+    run_main(monkeypatch, config, '-r')
+    assert 'already completed, skipping' not in capsys.readouterr().out
+    with open('flattened__array.csv') as f:
+        assert len(f.read().split()) == 1 + 10
+
+    # a removed output makes the job run again too
+    os.remove('flattened__array.csv')
+    run_main(monkeypatch, config, '-r')
+    assert 'already completed, skipping' not in capsys.readouterr().out
+    assert os.path.exists('flattened__array.csv')
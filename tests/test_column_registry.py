@@ -0,0 +1,66 @@
+import io
+
+import pyarrow.parquet as pq
+
+from utils import ColumnRegistry, DeferredHeaderDictWriter, DynamicDictWriter, DynamicHeaderWriter, ParquetDictWriter
+
+ROWS = [{'b': 1, 'a': 2}, {'a': 3}, {'d': 4, 'c': 5, 'b': 6}, {'e': 7}, {'c': 8, 'a': 9}]
+HEADER = ['a', 'b', 'c', 'd', 'e']
+
+
+def test_ids_in_the_order_names_show_up():
+    columns = ColumnRegistry(['z', 'y'])
+    columns.add(['y', 'x', 'z', 'w'])
+    assert columns.names == ['z', 'y', 'x', 'w']
+    assert columns.ids == {'z': 0, 'y': 1, 'x': 2, 'w': 3}
+    assert len(columns) == 4
+
+
+def test_ids_of_rows():
+    columns = ColumnRegistry()
+    assert columns.ids_of({'b': 1, 'a': 2}) == (1, 0)
+    # the new keys of a row are numbered sorted, the known ones keep their ids
+    assert columns.ids_of({'d': 1, 'b': 2, 'c': 3}) == (3, 1, 2)
+    assert columns.ids_of({'a': 1}) == (0,)
+    assert columns.names == ['a', 'b', 'c', 'd']
+
+
+def rewrite_header(rows):
+    # the header is rewritten in place, which needs a file
+    with open('rewrite.csv', 'w+', newline='') as csvfile:
+        writer = DynamicDictWriter(csvfile, fieldnames=[], batch_size=2)
+        writer.writerows(rows)
+        writer.flush()
+    with open('rewrite.csv', newline='') as csvfile:
+        return csvfile.read().splitlines()
+
+
+def deferred_header(rows):
+    csvfile = io.StringIO()
+    with DeferredHeaderDictWriter(csvfile, spill_batch_size=2) as writer:
+        writer.writerows(rows)
+    return csvfile.getvalue().splitlines()
+
+
+def test_writers_keep_the_column_order(workdir):
+    assert rewrite_header(ROWS)[0].split(',') == HEADER
+    assert deferred_header(ROWS)[0].split(',') == HEADER
+    assert deferred_header(ROWS)[1:] == ['2,1,,,', '3,,,,', ',6,5,4,', ',,,,7', '9,,8,,']
+
+    csvfile = io.StringIO()
+    header_writer = DynamicHeaderWriter(csvfile, fieldnames=[])
+    for row in ROWS:
+        header_writer.process_row(row)
+    assert csvfile.getvalue().split() == [','.join(HEADER)]
+
+    with ParquetDictWriter('out.parquet', spill_batch_size=2) as writer:
+        writer.writerows(ROWS)
+    assert pq.read_schema('out.parquet').names == HEADER
+
+
+def test_spilled_rows_hold_column_ids(workdir):
+    writer = DeferredHeaderDictWriter(io.StringIO(), fieldnames=['c'], spill_batch_size=2)
+    writer.writerows(ROWS[:3])
+    spilled = [row for batch in writer.iter_spilled_rows() for row in batch]
+    assert writer.fieldnames == ['c', 'a', 'b', 'd']
+    assert spilled == [((2, 1), (1, 2)), ((1,), (3,)), ((3, 0, 2), (4, 5, 6))]
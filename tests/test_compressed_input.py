@@ -0,0 +1,107 @@
+import bz2
+import gzip
+import json
+import lzma
+
+import pytest
+import zstandard
+
+from buildJsonExample import build_example_json
+from conftest import read_csv
+from jsonIndex import build_json_offset_index
+from searchAndFlatten import search_and_flatten_to_csv
+from utils import count_items, find_root_key, get_input_compression, is_json_lines, open_input_file, \
+    read_csv_or_parquet, select_columns_from_csv, strip_compression_ext
+
+COMPRESSORS = {'gzip': gzip.compress, 'bz2': bz2.compress, 'xz': lzma.compress,
+               'zstd': lambda data: zstandard.ZstdCompressor().compress(data)}
+EXTENSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'xz': '.xz', 'zstd': '.zst'}
+
+OBJECTS = [{'id': i, 'name': f'ü{i}', 'tags': ['a'] * (i % 3), 'meta': {f'k{i % 4}': i}} for i in range(50)]
+DOCUMENTS = {
+    'array.json': json.dumps(OBJECTS, indent=2),
+    'rooted.json': json.dumps({'meta': {'n': 50}, 'data': OBJECTS}),
+    'lines.jsonl': ''.join(json.dumps(obj) + '\n' for obj in OBJECTS),
+}
+
+
+@pytest.fixture(params=sorted(COMPRESSORS))
+def compression(request):
+    return request.param
+
+
+def write_compressed(name, text, compression, with_extension=True):
+    path = name + EXTENSIONS[compression] if with_extension else f'{compression}_{name}'
+    with open(path, 'wb') as f:
+        f.write(COMPRESSORS[compression](text.encode('utf-8')))
+    return path
+
+
+@pytest.mark.parametrize('with_extension', [True, False], ids=['extension', 'magic'])
+def test_compression_is_recognized(workdir, compression, with_extension):
+    path = write_compressed('array.json', DOCUMENTS['array.json'], compression, with_extension)
+    assert get_input_compression(path) == compression
+    with open_input_file(path) as f:
+        assert f.read() == DOCUMENTS['array.json'].encode('utf-8')
+    with open_input_file(path, 'r') as f:
+        assert f.read() == DOCUMENTS['array.json']
+    with open('plain.json', 'w') as f:
+        f.write('[]')
+    assert get_input_compression('plain.json') is None
+    assert strip_compression_ext(path) == ('array.json' if with_extension else path)
+
+
+@pytest.mark.parametrize('name, root_key', [('array.json', None), ('rooted.json', 'data'), ('lines.jsonl', None)])
+@pytest.mark.parametrize('with_extension', [True, False], ids=['extension', 'magic'])
+def test_flatten_compressed_input(workdir, compression, name, root_key, with_extension):
+    with open(name, 'w', encoding='utf-8') as f:
+        f.write(DOCUMENTS[name])
+    path = write_compressed(name, DOCUMENTS[name], compression, with_extension)
+    output = search_and_flatten_to_csv(input_json=path, search_name='compressed', root_key=root_key,
+                                       exact_count=True)
+    if with_extension:
+        assert output == f'flattened__{name.split(".")[0]}.csv'
+    # the plain input writes to the same output name
+    compressed_rows = read_csv(output)
+    assert compressed_rows == read_csv(search_and_flatten_to_csv(input_json=name, search_name='plain',
+                                                                 root_key=root_key))
+
+    assert is_json_lines(path) == is_json_lines(name)
+    assert find_root_key(path, root_key) == find_root_key(name, root_key)
+    assert count_items(path, root_key, is_array=True) == len(OBJECTS)
+
+
+def test_compressed_input_ignores_workers(workdir, compression, capsys):
+    path = write_compressed('array.json', DOCUMENTS['array.json'], compression)
+    with open('array.json', 'w', encoding='utf-8') as f:
+        f.write(DOCUMENTS['array.json'])
+    output = search_and_flatten_to_csv(input_json=path, search_name='compressed', workers=2)
+    assert '[-] Compressed input can only be read from the start, ignoring workers' in capsys.readouterr().out
+    compressed_rows = read_csv(output)
+    assert compressed_rows == read_csv(search_and_flatten_to_csv(input_json='array.json', search_name='plain'))
+    with pytest.raises(ValueError, match='is compressed'):
+        build_json_offset_index(path)
+
+
+def test_json_jobs_read_compressed_input(workdir, compression):
+    with open('array.json', 'w', encoding='utf-8') as f:
+        f.write(DOCUMENTS['array.json'])
+    path = write_compressed('array.json', DOCUMENTS['array.json'], compression)
+    with open(build_example_json(path), encoding='utf-8') as f:
+        compressed_example = json.load(f)
+    with open(build_example_json('array.json'), encoding='utf-8') as f:
+        assert compressed_example == json.load(f)
+
+
+CSV_TEXT = 'a,b,c\n' + ''.join(f'{i},ü{i},{i * 2}\n' for i in range(25))
+
+
+def test_csv_jobs_read_compressed_input(workdir, compression):
+    path = write_compressed('in.csv', CSV_TEXT, compression)
+    with open('in.csv', 'w', encoding='utf-8') as f:
+        f.write(CSV_TEXT)
+    assert read_csv_or_parquet(path).equals(read_csv_or_parquet('in.csv'))
+    assert [len(chunk) for chunk in read_csv_or_parquet(path, chunksize=10)] == [10, 10, 5]
+    output = select_columns_from_csv(path, ['c', 'a'], chunksize=7)
+    assert output == 'col_clip__in.csv'
+    assert read_csv(output) == [['c', 'a']] + [[str(i * 2), str(i)] for i in range(25)]
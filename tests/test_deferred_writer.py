@@ -0,0 +1,78 @@
+import csv
+import io
+import json
+
+import pytest
+
+from conftest import read_csv
+from searchAndFlatten import search_and_flatten_to_csv
+from utils import DeferredHeaderDictWriter, DynamicDictWriter, get_dynamic_dict_writer
+
+ROWS = [{'b': 1}, {'a': 2, 'c': 3}, {'b': 4, 'd': 'x'}, {'e': None}]
+
+
+def write_rows(writer, rows):
+    for row in rows:
+        writer.writerow(row)
+    writer.close()
+
+
+def test_header_written_once_with_rows_padded(tmp_path):
+    path = tmp_path / 'out.csv'
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        write_rows(DeferredHeaderDictWriter(f, spill_batch_size=2), ROWS)
+
+    assert read_csv(path) == [['b', 'a', 'c', 'd', 'e'],
+                              ['1', '', '', '', ''],
+                              ['', '2', '3', '', ''],
+                              ['4', '', '', 'x', ''],
+                              ['', '', '', '', '']]
+
+
+def test_same_output_as_rewriting_writer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # DynamicDictWriter keeps its temp files in ./temp
+    rows = [{f'k{(i * 7 + j) % 13}': i * j for j in range(i % 4 + 1)} for i in range(200)]
+    for header_mode in ('deferred', 'rewrite'):
+        with open(f'{header_mode}.csv', 'w+', newline='', encoding='utf-8') as f:
+            write_rows(get_dynamic_dict_writer(f, header_mode=header_mode, batch_rows=7), rows)
+
+    # the rewriting writer leaves the rows written before a new column as short as they were
+    header, *rows = read_csv('rewrite.csv')
+    assert read_csv('deferred.csv') == [header] + [row + [''] * (len(header) - len(row)) for row in rows]
+
+
+def test_header_mode_picks_writer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open('out.csv', 'w+', newline='') as f:
+        assert isinstance(get_dynamic_dict_writer(f, header_mode='deferred'), DeferredHeaderDictWriter)
+        assert isinstance(get_dynamic_dict_writer(f, header_mode='rewrite'), DynamicDictWriter)
+
+
+def test_open_writers_keep_their_own_dialect():
+    semicolons, pipes = io.StringIO(), io.StringIO()
+    first = DeferredHeaderDictWriter(semicolons, delimiter=';', quoting=csv.QUOTE_ALL, escapechar=None)
+    second = DeferredHeaderDictWriter(pipes, delimiter='|')
+    first.writerow({'x': 1, 'y': 2})
+    second.writerow({'x': 1, 'y': 2})
+    first.close()
+    second.close()
+
+    assert semicolons.getvalue() == '"x";"y"\r\n"1";"2"\r\n'
+    assert pipes.getvalue() == 'x|y\r\n1|2\r\n'
+
+
+def test_rows_without_columns_leave_the_csv_empty():
+    out = io.StringIO()
+    write_rows(DeferredHeaderDictWriter(out), [{}, {}])
+    assert out.getvalue() == ''
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'incremental': True}, {'workers': 2}], ids=str)
+def test_search_that_matches_nothing(workdir, kwargs):
+    with open('in.jsonl', 'w') as f:
+        f.writelines(json.dumps({'identifier': i, 'name': 'x'}) + '\n' for i in range(20))
+    for _ in range(2):  # the second incremental run appends to the empty output
+        output = search_and_flatten_to_csv(input_json='in.jsonl', search_name='nothing', search_config=['missing'],
+                                           **kwargs)
+        with open(output, 'rb') as f:
+            assert f.read() == b''
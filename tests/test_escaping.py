@@ -0,0 +1,65 @@
+import copy
+import itertools
+import json
+
+import pytest
+
+from searchAndFlatten import search_and_flatten
+from utils import escape_csv_string, get_csv_string_escaper
+
+
+def baseline_escape_csv_string(s, line_break_handling='escape', quote_handling='double', quote_values=False):
+    # escape_csv_string as it was before the escaper
+    if line_break_handling == 'escape':
+        s = s.replace('\r\n', '\\r\\n').replace('\n', '\\n').replace('\r', '\\r')
+    elif line_break_handling == 'remove':
+        s = s.replace('\r\n', '').replace('\n', '').replace('\r', '')
+    if quote_handling == 'double':
+        s = s.replace('"', '""')
+    elif quote_handling == 'escape':
+        s = s.replace('"', '\\"')
+    if quote_values:
+        s = f'"{s}"'
+    return s
+
+
+STRINGS = ['', 'plain', 'a "quoted" word', '"', 'line\nbreak', 'windows\r\nbreak', 'old mac\rbreak', '\n\r',
+           '\r\r\n\n', 'mixed "\r\n" and \\"', 'tab\tand, comma', 'ünïcödé "ß"\n']
+OPTIONS = list(itertools.product(['escape', 'remove', 'keep'], ['double', 'escape', 'keep'], [False, True]))
+QUOTE_OPTIONS = list(itertools.product(['double', 'escape', 'keep'], [False, True]))
+
+
+@pytest.mark.parametrize('line_break_handling, quote_handling, quote_values', OPTIONS)
+def test_escaper_matches_baseline(line_break_handling, quote_handling, quote_values):
+    escape = get_csv_string_escaper(line_break_handling, quote_handling, quote_values)
+    for s in STRINGS:
+        expected = baseline_escape_csv_string(s, line_break_handling, quote_handling, quote_values)
+        assert escape(s) == expected
+        assert escape_csv_string(s, line_break_handling, quote_handling, quote_values) == expected
+
+
+def test_escaper_is_chosen_once_per_options():
+    assert get_csv_string_escaper('escape', 'double', False) is get_csv_string_escaper('escape', 'double', False)
+    assert get_csv_string_escaper('escape', 'double', False) is not get_csv_string_escaper('escape', 'double', True)
+
+
+def test_values_without_special_characters_are_returned_as_they_are():
+    value = 'x' * 100
+    assert get_csv_string_escaper('escape', 'escape')(value) is value
+
+
+ITEM = {'text': 'a "b"\r\nc', 'list': ['x\ny', '"z"'], 'object': {'k': 'v\r"w"'}}
+
+
+@pytest.mark.parametrize('search_config', ['*', ['text', 'list', 'object']], ids=str)
+@pytest.mark.parametrize('quote_handling, quote_values', QUOTE_OPTIONS)
+@pytest.mark.parametrize('remove_quotes', [False, True])
+def test_flatten_escapes_stringified_values(search_config, quote_handling, quote_values, remove_quotes):
+    rows = search_and_flatten(copy.deepcopy(ITEM), search_config, array_handling='stringify',
+                              object_handling='stringify', quote_handling=quote_handling, quote_values=quote_values,
+                              remove_quotes=remove_quotes)
+    expected_list = baseline_escape_csv_string(json.dumps(ITEM['list']), 'escape', quote_handling, quote_values)
+    if remove_quotes and expected_list.startswith('"') and expected_list.endswith('"'):
+        expected_list = expected_list[1:-1]
+    expected_object = baseline_escape_csv_string(json.dumps(ITEM['object']), 'escape', quote_handling, quote_values)
+    assert rows == [{'text': ITEM['text'], 'list': expected_list, 'object': expected_object}]
@@ -0,0 +1,89 @@
+import io
+import json
+
+import pytest
+
+from conftest import csv_row_multiset, flatten_baseline_case, load_baseline_outputs, write_baseline_inputs
+from searchAndFlatten import compile_search_config, iter_pruned_json_items, search_and_flatten_to_csv
+
+BASELINE = load_baseline_outputs()
+SEARCH_CASES = [case for case in BASELINE['search_and_flatten_to_csv'] if case['kwargs']['search_config'] != '*']
+
+
+def case_id(case):
+    kwargs = case['kwargs']
+    return f"{case['input']}-{kwargs['search_config']}-{kwargs['array_handling']}-{kwargs['object_handling']}"
+
+
+@pytest.mark.parametrize('case', SEARCH_CASES, ids=case_id)
+def test_events_write_what_items_write(case, workdir):
+    write_baseline_inputs(BASELINE)
+    items = flatten_baseline_case(case, parse_mode='items')
+    events = flatten_baseline_case(case, parse_mode='events')
+    assert events == items
+    assert csv_row_multiset(events) == csv_row_multiset([case['header']] + case['rows'])
+
+
+ITEM = {'id': 1, 'blob': {'a': {'b': [1, 2, {'c': 'd'}]}}, 'host': {'os': {'name': 'linux', 'version': '6'}},
+        'services': [{'name': 'ssh', 'port': 22}, 7, {'port': 80}], 'name': 'top'}
+
+
+def pruned_items(search_config, data, item_prefix='item'):
+    matcher = compile_search_config(search_config)
+    items = list(iter_pruned_json_items(io.BytesIO(json.dumps(data).encode()), item_prefix, matcher))
+    return matcher, items
+
+
+@pytest.mark.parametrize('search_config', [
+    ['host.os.name'],
+    ['name'],
+    ['services.[].port', 'id'],
+    {'blob.a': {'object_handling': 'stringify'}, 'version': {}},
+    {'nme': {'similarity_threshold': 0.5}},
+], ids=str)
+def test_pruned_objects_find_the_same_keys(search_config):
+    matcher, items = pruned_items(search_config, [ITEM, ITEM])
+    assert len(items) == 2
+    for item in items:
+        assert matcher.find_keys(item) == matcher.find_keys(ITEM)
+
+
+def test_unreachable_subtrees_are_not_built():
+    # dot notation only keys can't match by name, nothing outside their paths is built
+    search_config = {'host.os.name': {'allow_dot_notation': True}, 'services.[].port': {'allow_dot_notation': True}}
+    _, [item] = pruned_items(search_config, [ITEM])
+    assert item == {'host': {'os': {'name': 'linux'}}, 'services': [{'port': 22}, None, {'port': 80}]}
+
+
+def test_scalars_of_other_keys_are_skipped():
+    # a key name can match at any depth, so containers are still walked but only matching values are kept
+    _, [item] = pruned_items(['name'], [ITEM])
+    assert item == {'blob': {'a': {'b': [None, None, {}]}}, 'host': {'os': {'name': 'linux'}},
+                    'services': [{'name': 'ssh'}, None, {}], 'name': 'top'}
+
+
+def test_matched_subtrees_are_built_whole():
+    _, [item] = pruned_items({'blob': {'allow_dot_notation': True}}, [ITEM])
+    assert item == {'blob': ITEM['blob']}
+
+
+def test_items_under_a_root_key():
+    data = {'meta': {'id': 0}, 'data': {'results': [ITEM, {'id': 2}]}}
+    _, items = pruned_items({'id': {'allow_dot_notation': True}}, data, 'data.results.item')
+    assert items == [{'id': 1}, {'id': 2}]
+
+
+def test_wildcard_falls_back_to_whole_objects(workdir, capsys):
+    with open('in.json', 'w') as f:
+        json.dump([ITEM], f)
+    items = open(search_and_flatten_to_csv(input_json='in.json', search_name='a')).read()
+    events = open(search_and_flatten_to_csv(input_json='in.json', search_name='a', parse_mode='events')).read()
+    assert events == items
+    assert 'parse_mode "events" needs a list or granular search config' in capsys.readouterr().out
+
+
+def test_unknown_parse_mode(workdir):
+    with open('in.json', 'w') as f:
+        json.dump([ITEM], f)
+    with pytest.raises(ValueError, match="Unknown parse_mode 'tokens'"):
+        search_and_flatten_to_csv(input_json='in.json', search_name='a', search_config=['id'], parse_mode='tokens')
@@ -0,0 +1,82 @@
+import copy
+import json
+import sys
+
+import pytest
+
+import searchAndFlatten
+from conftest import load_baseline_outputs, row_multiset
+from searchAndFlatten import flatten, granular_flatten, search_and_flatten
+
+BASELINE = load_baseline_outputs()
+DEPTH = 5000
+
+
+def case_id(case):
+    kwargs = case['kwargs']
+    return f"{case['input']}-{kwargs['search_config']}-{kwargs['array_handling']}-{kwargs['object_handling']}-" \
+           f"{kwargs['quote_handling']}"
+
+
+@pytest.mark.parametrize('case', BASELINE['search_and_flatten'], ids=case_id)
+def test_rows_match_the_recursive_flatten(case):
+    rows = search_and_flatten(copy.deepcopy(BASELINE['inputs'][case['input']]), **case['kwargs'])
+    if 'explode' in json.dumps(case['kwargs']):
+        # exploded rows come in another order since arrays are exploded lazily
+        assert row_multiset(rows) == row_multiset(case['rows'])
+        assert len(rows) == len(case['rows'])
+    else:
+        assert rows == case['rows']
+
+
+KEYS_DATA = {'a"b': {'c\nd': {'e"\r\nf': 1}, 'g': [{'h"': 2}]}, 'top"': 'x"y'}
+
+
+def test_keys_are_sanitized_like_the_recursive_flatten():
+    # as the recursive flatten wrote them: the sanitized prefix is sanitized again with every level below it
+    assert flatten(KEYS_DATA, object_handling='recurse', array_handling='explode', quote_handling='escape') == \
+           [{'a\\\\\\\\"b.c\\nd.e\\"\\r\\nf': 1, 'a\\\\\\\\"b.g.h\\"': 2, 'top\\\\"': 'x"y'}]
+    assert granular_flatten(KEYS_DATA, {}, {}, _object_handling='recurse', _array_handling='explode',
+                            quote_handling='double', line_break_handling='remove', remove_quotes=True) == \
+           [{'a""""""""""""""""b.cd.e""f': '1', 'a""""""""""""""""b.g.h""': '2', 'top""""': 'x\\""y'}]
+
+
+def nested(depth, make):
+    value = 'leaf'
+    for _ in range(depth):
+        value = make(value)
+    return value
+
+
+@pytest.mark.parametrize('array_handling', ['stringify', 'explode', 'horizontal'])
+def test_deep_objects_have_no_recursion_limit(array_handling):
+    assert DEPTH > sys.getrecursionlimit()
+    data = nested(DEPTH, lambda value: {'a': value})
+    key = '.'.join(['a'] * DEPTH)
+    assert flatten(data, array_handling=array_handling) == [{key: 'leaf'}]
+    assert granular_flatten(data, {}, {}, _array_handling=array_handling, remove_quotes=True) == [{key: 'leaf'}]
+
+
+def test_deep_arrays_have_no_recursion_limit():
+    data = {'k': nested(DEPTH, lambda value: [value])}
+    assert flatten(data, array_handling='explode') == [{'k': 'leaf'}]
+    assert flatten(data, array_handling='horizontal') == [{'k' + '[0]' * DEPTH: 'leaf'}]
+    assert granular_flatten(data, {}, {}, _array_handling='explode', remove_quotes=True) == [{'k': 'leaf'}]
+
+
+def test_child_keys_are_sanitized_once_per_job():
+    searchAndFlatten._child_key.cache_clear()
+    data = [{'id': i, 'meta': {'owner': {'name': 'x'}, 'size': i}} for i in range(100)]
+    flatten(data, object_handling='recurse')
+    # id, meta, meta.owner, meta.owner.name, meta.size
+    assert searchAndFlatten._child_key.cache_info().misses == 5
+
+
+def test_exploded_rows_are_independent():
+    rows = flatten({'id': 1, 'meta': {'a': 1}, 'tags': ['x', 'y', 'z'], 'end': 2}, object_handling='recurse',
+                   array_handling='explode')
+    assert sorted(row['tags'] for row in rows) == ['x', 'y', 'z']
+    assert all(row['id'] == 1 and row['meta.a'] == 1 and row['end'] == 2 for row in rows)
+    assert len({id(row) for row in rows}) == 3
+    rows[0]['id'] = 'changed'
+    assert rows[1]['id'] == rows[2]['id'] == 1
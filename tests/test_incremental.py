@@ -0,0 +1,155 @@
+import csv
+import glob
+import gzip
+import json
+import os
+import shutil
+
+import pytest
+
+from searchAndFlatten import CsvSearch, search_and_flatten_to_csv
+
+# the later objects bring new columns, and values with quotes and line breaks
+OBJECTS = [dict({'id': i, 'text': f'say "{i}"\nbye', 'tags': ['a', 'b'][:i % 3]},
+                **({f'late{i % 3}': i} if i >= 40 else {})) for i in range(60)]
+
+
+def json_line(obj):
+    return json.dumps(obj) + '\n'
+
+
+@pytest.fixture
+def feed(workdir, monkeypatch):
+    """Appends the objects to feed.jsonl and counts the objects the searches flatten."""
+    flattened = []
+    write_object = CsvSearch.write_object
+
+    def counting_write_object(self, obj):
+        flattened.append(obj)
+        return write_object(self, obj)
+
+    monkeypatch.setattr(CsvSearch, 'write_object', counting_write_object)
+
+    def append(objects, tail=''):
+        with open('feed.jsonl', 'a') as f:
+            f.writelines(json_line(obj) for obj in objects)
+            f.write(tail)
+        flattened.clear()
+        return flattened
+
+    return append
+
+
+def outputs():
+    files = {}
+    for path in sorted(glob.glob('flattened__*.csv')):
+        with open(path, 'rb') as f:
+            files[path] = f.read()
+    return files
+
+
+def full_run(**kwargs):
+    # what a run over the whole feed writes, in another folder
+    shutil.rmtree('full', ignore_errors=True)
+    os.mkdir('full')
+    with open('feed.jsonl', 'rb') as f, open('full/feed.jsonl', 'wb') as copy:
+        copy.write(f.read())
+    os.chdir('full')
+    try:
+        search_and_flatten_to_csv(input_json='feed.jsonl', search_name='a', **kwargs)
+        return outputs()
+    finally:
+        os.chdir('..')
+
+
+KWARGS = [{}, {'quoting': csv.QUOTE_ALL, 'escapechar': None},
+          {'array_handling': 'normalize', 'object_handling': 'recurse'},
+          {'search_config': ['id', 'late1', 'tags'], 'array_handling': 'explode'}]
+
+
+@pytest.mark.parametrize('kwargs', KWARGS, ids=str)
+def test_appended_lines_are_added_to_the_output(feed, kwargs):
+    feed(OBJECTS[:20])
+    search_and_flatten_to_csv(input_json='feed.jsonl', search_name='a', incremental=True, **kwargs)
+    for start, end in [(20, 45), (45, 60)]:
+        flattened = feed(OBJECTS[start:end])
+        search_and_flatten_to_csv(input_json='feed.jsonl', search_name='a', incremental=True, **kwargs)
+        assert flattened == OBJECTS[start:end]
+    # new columns pad the rows written before, the outputs are the ones of a single run over everything
+    assert outputs() == full_run(**kwargs)
+
+    flattened = feed([])
+    search_and_flatten_to_csv(input_json='feed.jsonl', search_name='a', incremental=True, **kwargs)
+    assert flattened == []
+    assert outputs() == full_run(**kwargs)
+
+
+def test_partial_last_line_is_left_for_the_next_run(feed):
+    feed(OBJECTS[:10])
+    search_and_flatten_to_csv(input_json='feed.jsonl', search_name='a', incremental=True)
+    partial = json_line(OBJECTS[11])
+    flattened = feed(OBJECTS[10:11], tail=partial[:15])
+    search_and_flatten_to_csv(input_json='feed.jsonl', search_name='a', incremental=True)
+    assert flattened == OBJECTS[10:11]
+
+    # the rest of the partial line, then the lines after it
+    flattened = feed([], tail=partial[15:] + ''.join(json_line(obj) for obj in OBJECTS[12:20]))
+    search_and_flatten_to_csv(input_json='feed.jsonl', search_name='a', incremental=True)
+    assert flattened == OBJECTS[11:20]
+    assert outputs() == full_run()
+
+
+@pytest.mark.parametrize('change', ['replaced', 'truncated', 'settings', 'output removed'])
+def test_whole_input_is_flattened_again(feed, capsys, change):
+    feed(OBJECTS[:30])
+    search_and_flatten_to_csv(input_json='feed.jsonl', search_name='a', incremental=True)
+    kwargs = {}
+    if change == 'replaced':
+        os.remove('feed.jsonl')
+        feed(OBJECTS[30:] + OBJECTS[:5])
+    elif change == 'truncated':
+        os.remove('feed.jsonl')
+        feed(OBJECTS[:10])
+    elif change == 'settings':
+        kwargs = {'array_handling': 'explode'}
+    else:
+        os.remove('flattened__feed.csv')
+    flattened = feed([])
+    search_and_flatten_to_csv(input_json='feed.jsonl', search_name='a', incremental=True, **kwargs)
+    out = capsys.readouterr().out
+    if change in ('replaced', 'truncated'):
+        assert 'was replaced rather than appended to since' in out
+    elif change == 'settings':
+        assert 'was saved for another input file or other settings' in out
+    else:
+        assert 'The outputs of flattened__feed.csv changed since the last run' in out
+    with open('feed.jsonl') as f:
+        assert flattened == [json.loads(line) for line in f]
+    assert outputs() == full_run(**kwargs)
+
+
+@pytest.mark.parametrize('kwargs, message, incremental', [
+    ({'output_format': 'datetime'}, 'output_format "datetime" writes a new file every run', False),
+    ({'output_format': 'parquet'}, 'Parquet output and test mode runs are flattened in full', False),
+    ({'workers': 2}, 'Incremental runs read the new lines in one process, ignoring workers', True),
+    ({'checkpoint_interval': 5}, 'Incremental runs are not checkpointed', True),
+    ({'output_compression': 'gzip'}, 'Incremental runs append to one plain CSV', True),
+], ids=str)
+def test_options_incremental_runs_ignore(feed, capsys, kwargs, message, incremental):
+    feed(OBJECTS[:10])
+    search_and_flatten_to_csv(input_json='feed.jsonl', search_name='a', incremental=True, **kwargs)
+    assert message in capsys.readouterr().out
+    assert bool(glob.glob('*.incremental')) == incremental
+    assert not glob.glob('*.checkpoint') and not glob.glob('*.gz')
+
+
+def test_only_plain_json_lines(workdir, capsys):
+    with open('feed.json', 'w') as f:
+        json.dump(OBJECTS, f)
+    with gzip.open('feed.jsonl.gz', 'wt') as f:
+        f.writelines(json_line(obj) for obj in OBJECTS)
+    for input_json in ('feed.json', 'feed.jsonl.gz'):
+        search_and_flatten_to_csv(input_json=input_json, search_name='a', incremental=True)
+        assert 'Only plain JSON Lines files can be flattened incrementally, ignoring incremental' in \
+               capsys.readouterr().out
+    assert not glob.glob('*.incremental')
@@ -0,0 +1,74 @@
+import gzip
+import io
+import json
+import os
+
+import ijson
+import pytest
+
+from jsonIndex import JsonArraySliceReader, build_json_offset_index, get_json_object, load_json_offset_index, \
+    scan_element_offsets
+
+TRICKY = [
+    {'s': 'brackets ] [ } { and "quotes", commas: colons', 'n': None},
+    {'escaped': 'back\\slash \\" still a string ]', 'list': [1, [2, [3]], {'k': []}]},
+    'a bare string',
+    12.5,
+    [],
+    {'unicode': 'ünïcødé ✓', 'empty': {}},
+]
+
+
+def test_offsets_match_the_parsed_elements():
+    for root_key, document in [(None, TRICKY), ('data', {'meta': {'x': [1]}, 'data': TRICKY}),
+                               ('a.b', {'a': {'skip': [0], 'b': TRICKY}})]:
+        data = json.dumps(document, indent=1, ensure_ascii=False).encode('utf-8')
+        # a tiny chunk size puts chunk boundaries inside strings, escapes and whitespace
+        for chunk_size in (3, 7, 1 << 20):
+            spans = list(scan_element_offsets(io.BytesIO(data), root_key, chunk_size=chunk_size))
+            assert [json.loads(data[start:end]) for start, end in spans] == TRICKY
+
+
+@pytest.fixture
+def indexed(workdir):
+    objects = [{'id': i, 'text': f'row ] {i}'} for i in range(100)]
+    with open('in.json', 'w') as f:
+        json.dump({'results': objects}, f)
+    build_json_offset_index('in.json', 'results')
+    return objects
+
+
+def test_index_reads_single_objects_and_ranges(indexed):
+    index = load_json_offset_index('in.json', 'results')
+    assert index.count == len(indexed)
+    assert index.read_object(57) == indexed[57]
+    assert get_json_object('in.json', 99, 'results') == indexed[99]
+    with index.open_items(10, 20) as items:
+        assert list(items) == indexed[10:20]
+    with pytest.raises(IndexError):
+        index.read_object(100)
+
+
+def test_shards_cover_every_object_once(indexed):
+    index = load_json_offset_index('in.json', 'results')
+    objects = []
+    with open('in.json', 'rb') as f:
+        for start, end in index.shard_ranges(7):
+            objects.extend(ijson.items(JsonArraySliceReader(f, start, end), 'item'))
+    assert objects == indexed
+
+
+def test_index_of_a_changed_file_is_not_used(indexed):
+    assert load_json_offset_index('in.json', 'results') is not None
+    assert load_json_offset_index('in.json', None) is None  # built for another prefix
+    with open('in.json', 'a') as f:
+        f.write(' ')
+    assert load_json_offset_index('in.json', 'results') is None
+
+
+def test_compressed_input_is_not_indexed(workdir):
+    with gzip.open('in.json.gz', 'wt') as f:
+        json.dump([1, 2], f)
+    with pytest.raises(ValueError):
+        build_json_offset_index('in.json.gz')
+    assert not os.path.exists('in.json.gz.item.offsets')
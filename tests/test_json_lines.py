@@ -0,0 +1,65 @@
+import io
+import json
+import math
+
+import pytest
+
+from conftest import read_csv
+from searchAndFlatten import search_and_flatten_to_csv
+from utils import count_items, find_root_key, is_json_lines, iter_json_lines_items, reformat_json
+
+OBJECTS = [{'id': i, 'tags': ['a', 'b'][:i % 3], 'meta': {'n': i}} for i in range(20)]
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def json_lines(objects):
+    return ''.join(json.dumps(obj) + '\n' for obj in objects)
+
+
+def test_json_lines_detection(workdir):
+    assert is_json_lines(write('a.jsonl', '{"a": 1}'))
+    assert is_json_lines(write('a.ndjson', '{"a": 1}'))
+    assert is_json_lines(write('lines.json', '{"a": 1}\n\n{"a": 2}\n'))
+    assert not is_json_lines(write('single.json', '{"a": 1}\n'))
+    assert not is_json_lines(write('pretty.json', json.dumps(OBJECTS, indent=2)))
+    assert find_root_key('lines.json') == (True, None)
+
+
+def test_lines_are_read_like_an_array():
+    data = (json_lines(OBJECTS[:2]) + '\n  \n' + json_lines(OBJECTS[2:])).encode()
+    assert list(iter_json_lines_items(io.BytesIO(data))) == OBJECTS
+    # NaN is not JSON, but the json module takes it
+    assert math.isnan(next(iter_json_lines_items(io.BytesIO(b'{"x": NaN}\n')))['x'])
+
+
+def test_root_key_yields_the_array_of_every_line():
+    data = b'{"data": [{"a": 1}, {"a": 2}]}\n{"other": 1}\n{"data": [{"a": 3}]}\n'
+    assert list(iter_json_lines_items(io.BytesIO(data), 'data.item')) == [{'a': 1}, {'a': 2}, {'a': 3}]
+
+
+def test_count_items_counts_lines(workdir):
+    write('in.jsonl', json_lines(OBJECTS) + '\n')
+    assert count_items('in.jsonl') == len(OBJECTS)
+    assert count_items('in.jsonl', row_limit=5) == 5
+
+
+@pytest.mark.parametrize('array_handling', ['stringify', 'explode', 'horizontal'])
+def test_flatten_json_lines_like_the_same_array(workdir, array_handling):
+    write('lines.jsonl', json_lines(OBJECTS))
+    write('array.json', json.dumps(OBJECTS))
+    kwargs = dict(search_name='s', array_handling=array_handling, object_handling='recurse')
+    assert read_csv(search_and_flatten_to_csv(input_json='lines.jsonl', **kwargs)) == \
+        read_csv(search_and_flatten_to_csv(input_json='array.json', **kwargs))
+
+
+def test_reformat_json_lines_into_an_array(workdir):
+    write('in.jsonl', json_lines(OBJECTS))
+    output = reformat_json('in.jsonl')
+    assert output == 'reformatted__in.json'
+    with open(output) as f:
+        assert json.load(f) == OBJECTS
@@ -0,0 +1,122 @@
+import csv
+import datetime
+import io
+import json
+from decimal import Decimal
+
+import ijson
+import numpy as np
+import pytest
+
+from buildJsonExample import build_example_json
+from conftest import read_csv
+from jsonSerializer import dump_json, dumps_json, dumps_json_bytes, dumps_json_spaced
+from searchAndFlatten import search_and_flatten, search_and_flatten_to_csv
+from utils import CustomJSONEncoder, reformat_json
+
+VALUES = [
+    {},
+    [],
+    {'a': 1, 'b': [1, 2.5, None, True, False], 'c': {'d': {}, 'e': []}, 'f': 'text "quoted"\n'},
+    [{'ünïcödé': 'ß €', 'emoji': '\U0001f600'}, -0.5, 0.1, 10 ** 18, 'tab\t', '\u2028'],
+    'just a string',
+    3,
+]
+
+
+@pytest.mark.parametrize('value', VALUES, ids=repr)
+def test_layouts_of_the_json_module(value):
+    assert dumps_json(value) == json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    assert dumps_json(value, indent=True) == json.dumps(value, ensure_ascii=False, indent=2)
+    assert dumps_json_spaced(value) == json.dumps(value, ensure_ascii=False)
+    assert dumps_json_bytes(value) == dumps_json(value).encode('utf-8')
+
+
+def test_floats_in_exponent_notation():
+    # orjson leaves out the zero padding of the exponent (1e-7, json writes 1e-07), the value read back is the same
+    value = [1e-7, 1.5e300, -2e-20]
+    assert dumps_json(value) == '[1e-7,1.5e300,-2e-20]'
+    assert json.loads(dumps_json(value, indent=True)) == value
+
+
+@pytest.mark.parametrize('indent', [False, True])
+def test_ints_wider_than_64_bits_fall_back_to_the_json_module(indent):
+    value = {'big': 2 ** 70, 'list': [-2 ** 64, 'ü']}
+    assert dumps_json(value, indent=indent) == json.dumps(value, ensure_ascii=False, indent=2 if indent else None,
+                                                          separators=(',', ': ') if indent else (',', ':'))
+
+
+def test_values_json_has_no_type_for():
+    when = datetime.datetime(2024, 1, 2, 3, 4, 5)
+    assert dumps_json({'d': Decimal('1.25'), 'when': when, 'id': 1}) == \
+           '{"d":1.25,"when":"2024-01-02 03:04:05","id":1}'
+    assert dumps_json({1: np.int64(2), 'x': np.float64(0.5)}) == '{"1":2,"x":0.5}'
+    # same as json.dumps(default=str)
+    assert dumps_json([when, object]) == json.dumps([when, object], default=str, separators=(',', ':'))
+
+
+def test_dump_json_to_text_and_binary_files():
+    value = {'a': ['ü', Decimal('2.5')]}
+    expected = json.dumps(value, ensure_ascii=False, indent=2, cls=CustomJSONEncoder)
+    text = io.StringIO()
+    dump_json(value, text)
+    assert text.getvalue() == expected
+    binary = io.BytesIO()
+    dump_json(value, binary)
+    assert binary.getvalue() == expected.encode('utf-8')
+    binary = io.BytesIO()
+    dump_json(value, binary, indent=False)
+    assert binary.getvalue() == b'{"a":["\xc3\xbc",2.5]}'
+
+
+OBJECTS = [{'id': 1, 'name': 'ü', 'tags': ['a', 'b'], 'score': 0.5}, {'id': 2, 'nested': {'x': [1, {'y': None}]}}]
+
+
+def test_json_writers_write_what_json_dump_did(workdir):
+    with open('in.json', 'w', encoding='utf-8') as f:
+        json.dump(OBJECTS, f)
+    # fractional numbers come back from ijson as Decimal, written by the json module through CustomJSONEncoder
+    with open(reformat_json('in.json'), encoding='utf-8') as f:
+        assert f.read() == '[\n' + ',\n'.join(json.dumps(obj, ensure_ascii=False, indent=2, cls=CustomJSONEncoder)
+                                              for obj in OBJECTS) + '\n]'
+    with open(build_example_json('in.json'), encoding='utf-8') as f:
+        assert f.read() == json.dumps(dict(OBJECTS[0], nested=OBJECTS[1]['nested']), ensure_ascii=False, indent=2)
+
+
+def test_flatten_cells():
+    item = {'list': [1, 'ü', Decimal('0.5')], 'object': {'a': {'b': 'c'}}}
+    # flatten keeps the spaced layout json.dumps gave it, non-ASCII and Decimals are written as they are
+    assert search_and_flatten(dict(item), '*', quote_handling='keep', remove_quotes=True) == \
+           [{'list': '[1, "ü", 0.5]', 'object': '{"a": {"b": "c"}}'}]
+    # granular_flatten (search configs with options) was already compact with orjson
+    assert search_and_flatten(dict(item), {'list': {}, 'object': {}}, quote_handling='keep', remove_quotes=True) == \
+           [{'list': '[1,"ü",0.5]', 'object': '{"a":{"b":"c"}}'}]
+
+
+def test_decimals_a_float_would_round():
+    # a float only keeps about 17 digits, these are written with the digits they had in the input
+    value = [Decimal('12345678901234567.891'), Decimal('0.30000000000000000001'), Decimal('1.10'), Decimal('1E-30000')]
+    assert dumps_json(value) == '["12345678901234567.891","0.30000000000000000001",1.1,"1E-30000"]'
+    assert dumps_json_spaced(value) == '["12345678901234567.891", "0.30000000000000000001", 1.1, "1E-30000"]'
+
+
+HIGH_PRECISION = b'[{"amounts": [12345678901234567.891, 1.10], "exact": 0.30000000000000000001, "price": 1.10}]'
+
+
+@pytest.mark.parametrize('search_config, amounts', [
+    ('*', '["12345678901234567.891", 1.1]'),
+    (['amounts', 'exact', 'price'], '["12345678901234567.891", 1.1]'),
+    ({'amounts': {}, 'exact': {}, 'price': {}}, '["12345678901234567.891",1.1]'),
+], ids=['wildcard', 'list', 'granular'])
+def test_flatten_cells_of_high_precision_numbers(workdir, search_config, amounts):
+    item = next(ijson.items(io.BytesIO(HIGH_PRECISION), 'item'))
+    [row] = search_and_flatten(item, search_config, quote_handling='keep', remove_quotes=True)
+    assert {key: str(value) for key, value in row.items()} == \
+           {'amounts': amounts, 'exact': '0.30000000000000000001', 'price': '1.10'}
+
+    with open('in.json', 'wb') as f:
+        f.write(HIGH_PRECISION)
+    header, values = read_csv(search_and_flatten_to_csv(input_json='in.json', search_name='precise',
+                                                        search_config=search_config, quoting=csv.QUOTE_ALL,
+                                                        escapechar=None))
+    assert dict(zip(header, values))['exact'] == '0.30000000000000000001'
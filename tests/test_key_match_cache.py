@@ -0,0 +1,105 @@
+import json
+
+import pytest
+from jaccard_index.jaccard import jaccard_index
+
+import utils
+from conftest import read_csv, run_main
+from searchAndFlatten import search_and_flatten, search_and_flatten_to_csv
+from utils import find_ip_keys, gen_bulk_rename_csv_headers, get_key_match_cache_stats, is_key_match, key_similarity
+
+
+@pytest.fixture(autouse=True)
+def empty_caches(monkeypatch):
+    key_similarity.cache_clear()
+    is_key_match.cache_clear()
+    monkeypatch.setattr(utils, '_worker_key_match_stats', [0, 0])
+
+
+def test_similarity_is_jaccard_index():
+    for search_key, key in [('hostname', 'host_name'), ('ip', 'ipAddress'), ('name', 'name'), ('port', 'sku')]:
+        assert key_similarity(search_key, key) == jaccard_index(search_key, key)
+        assert is_key_match(search_key, key, 0.5) == (jaccard_index(search_key, key) >= 0.5)
+
+
+def test_keys_without_bigrams_are_not_similar():
+    with pytest.raises(Exception):
+        jaccard_index('a', 'name')
+    assert key_similarity('a', 'name') == 0.0
+    assert not is_key_match('a', 'name', 0.1)
+
+
+def test_decisions_are_cached_per_key_and_threshold():
+    is_key_match('hostname', 'host_name', 0.5)
+    is_key_match('hostname', 'host_name', 0.5)
+    is_key_match('hostname', 'host_name', 0.9)
+    assert is_key_match.cache_info().hits == 1
+    assert is_key_match.cache_info().misses == 2
+    # the second threshold reuses the similarity score
+    assert key_similarity.cache_info().hits == 1
+    assert get_key_match_cache_stats() == (2, 3)
+
+
+def test_misses_stay_with_the_key_names_not_the_objects():
+    objects = [{'host_name': f'h{i}', 'ip_addr': '10.0.0.1', 'nested': {'host_names': [i]}} for i in range(200)]
+    search_config = {'hostname': {'similarity_threshold': 0.6}, 'ipaddr': {'similarity_threshold': 0.8}}
+
+    rows = search_and_flatten(objects[:1], search_config, remove_quotes=True)
+    _, misses = get_key_match_cache_stats()
+    assert search_and_flatten(objects, search_config, remove_quotes=True)[:1] == rows
+    hits, misses_after = get_key_match_cache_stats()
+    assert misses_after == misses
+    assert hits >= 199
+
+
+def test_worker_counts_are_added(workdir):
+    with open('in.json', 'w') as f:
+        json.dump([{'host_name': f'h{i}', 'port': i} for i in range(50)], f)
+    search_config = {'hostname': {'similarity_threshold': 0.6}}
+
+    single = read_csv(search_and_flatten_to_csv(input_json='in.json', search_name='one', search_config=search_config))
+    hits, misses = get_key_match_cache_stats()
+    assert single[0] == ['host_name']
+    key_similarity.cache_clear()
+    is_key_match.cache_clear()
+
+    sharded = read_csv(search_and_flatten_to_csv(input_json='in.json', search_name='two', search_config=search_config,
+                                                 workers=2))
+    assert sharded == single
+    # every worker starts with empty caches, so they miss at least what the one process missed
+    worker_hits, worker_misses = utils._worker_key_match_stats
+    assert worker_misses >= misses and worker_hits + worker_misses >= hits + misses
+    assert get_key_match_cache_stats() == (worker_hits, worker_misses)
+
+
+def test_bulk_rename_uses_the_similarity_cache(workdir):
+    with open('in.csv', 'w', newline='') as f:
+        f.write('host_name,ip_address,other\n1,2,3\n')
+    gen_bulk_rename_csv_headers('in.csv', {'hostname': 'Host', 'ipaddress': 'IP'}, threshold=0.5)
+    assert read_csv('in_renamed.csv') == [['Host', 'IP', 'other'], ['1', '2', '3']]
+    assert key_similarity.cache_info().misses == 6
+
+
+def test_ip_keys_use_the_match_cache():
+    data = [{'ip_addr': '10.0.0.1', 'name': 'x'}, {'ip_addr': '10.0.0.2', 'inner': {'ipaddr': '10.0.0.3'}}]
+    result = []
+    find_ip_keys(data, '', ['ipaddr'], 0.5, result, use_jaccard=True)
+    assert result == ['[0].ip_addr', '[1].ip_addr', '[1].inner.ipaddr']
+    assert is_key_match.cache_info().hits > 0
+
+
+def test_main_reports_the_cache_of_each_job(workdir, monkeypatch, capsys):
+    with open('in.json', 'w') as f:
+        json.dump([{'host_name': 'a'}, {'host_name': 'b'}], f)
+    with open('searches.json', 'w') as f:
+        json.dump({'fuzzy': {'search_config': {'hostname': {'similarity_threshold': 0.6}}},
+                   'exact': {'search_config': ['host_name']}}, f)
+    jobs = [{'name': 'fuzzy', 'type': 'search_and_flatten_csv', 'search_config_path': 'searches.json',
+             'searchconfigs': {'fuzzy': 'in.json'}},
+            {'name': 'exact', 'type': 'search_and_flatten_csv', 'search_config_path': 'searches.json',
+             'searchconfigs': {'exact': 'in.json'}}]
+    run_main(monkeypatch, {'jobs': jobs})
+
+    out = capsys.readouterr().out
+    assert out.count('[+] Key match cache:') == 1
+    assert '[+] Key match cache: 1 hits, 2 misses' in out
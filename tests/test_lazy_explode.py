@@ -0,0 +1,91 @@
+import json
+import types
+from itertools import islice
+
+import pytest
+
+from conftest import csv_row_multiset, flatten_baseline_case, load_baseline_outputs, read_csv, write_baseline_inputs
+from searchAndFlatten import flatten, granular_flatten, search_and_flatten, search_and_flatten_to_csv
+
+BASELINE = load_baseline_outputs()
+EXPLODE_CASES = [case for case in BASELINE['search_and_flatten_to_csv'] if 'explode' in json.dumps(case['kwargs'])]
+
+
+def case_id(case):
+    kwargs = case['kwargs']
+    return f"{case['input']}-{kwargs['search_config']}-{kwargs['array_handling']}-{kwargs['object_handling']}"
+
+
+@pytest.mark.parametrize('case', EXPLODE_CASES, ids=case_id)
+def test_exploded_csv_rows_match_the_baseline(case, workdir):
+    write_baseline_inputs(BASELINE)
+    assert csv_row_multiset(flatten_baseline_case(case)) == csv_row_multiset([case['header']] + case['rows'])
+
+
+def flatten_both(data, **kwargs):
+    # the rows of flatten and granular_flatten (with the same handling for every key)
+    array_handling = kwargs.pop('array_handling', 'explode')
+    return (flatten(data, array_handling=array_handling, object_handling='recurse', **kwargs),
+            granular_flatten(data, {}, {}, _array_handling=array_handling, remove_quotes=True, **kwargs))
+
+
+def test_lazy_rows_are_the_same_rows():
+    data = [{'id': 1, 'a': [1, 2], 'b': [{'c': 'x'}, {'c': 'y'}]}, {'id': 2, 'a': []}]
+    for eager, lazy in zip(flatten_both(data), flatten_both(data, lazy=True)):
+        assert isinstance(lazy, types.GeneratorType)
+        assert list(lazy) == eager
+
+
+def test_rows_come_in_product_order():
+    rows, granular_rows = flatten_both({'a': [1, 2], 'b': ['x', 'y']})
+    assert [(row['a'], row['b']) for row in rows] == [(1, 'x'), (1, 'y'), (2, 'x'), (2, 'y')]
+    assert [(row['a'], row['b']) for row in granular_rows] == [('1', 'x'), ('1', 'y'), ('2', 'x'), ('2', 'y')]
+
+
+def test_the_product_is_not_built():
+    # a billion rows, only the first ones are flattened
+    data = {'a': list(range(1000)), 'b': list(range(1000)), 'c': list(range(1000))}
+    for rows in flatten_both(data, lazy=True):
+        assert [(row['a'], row['b'], row['c']) for row in islice(rows, 3)] in \
+               ([(0, 0, 0), (0, 0, 1), (0, 0, 2)], [('0', '0', '0'), ('0', '0', '1'), ('0', '0', '2')])
+
+
+def test_row_cap_applies_per_object(capsys):
+    data = [{'id': i, 'a': list(range(10)), 'b': list(range(10))} for i in range(3)]
+    for rows in flatten_both(data, max_rows=7):
+        assert [row['id'] for row in rows] == [0] * 7 + [1] * 7 + [2] * 7 or \
+               [row['id'] for row in rows] == ['0'] * 7 + ['1'] * 7 + ['2'] * 7
+    assert capsys.readouterr().out.count('[-] Object explodes into more than 7 rows, skipping the rest') == 6
+
+
+def test_objects_under_the_cap_are_untouched(capsys):
+    data = {'a': [1, 2, 3]}
+    assert flatten_both(data, max_rows=3) == flatten_both(data)
+    assert capsys.readouterr().out == ''
+
+
+def test_size_cap(capsys):
+    data = {'text': 'x' * 100, 'a': list(range(1000))}
+    for rows in flatten_both(data, max_bytes=1000):
+        # every row is about 110 bytes
+        assert 9 <= len(rows) <= 10
+    assert 'bytes), skipping the rest of its rows' in capsys.readouterr().out
+
+
+def test_search_and_flatten_passes_the_caps():
+    data = [{'a': list(range(10)), 'b': list(range(10))}] * 2
+    rows = search_and_flatten(data, ['a', 'b'], array_handling='explode', max_rows_per_object=5)
+    assert len(rows) == 10
+
+
+def test_csv_caps(workdir, capsys):
+    with open('in.json', 'w') as f:
+        json.dump([{'id': i, 'a': list(range(100)), 'b': list(range(100))} for i in range(4)], f)
+    rows = read_csv(search_and_flatten_to_csv(input_json='in.json', search_name='a', array_handling='explode',
+                                              object_handling='recurse', max_rows_per_object=25))
+    assert sorted(rows[0]) == ['a', 'b', 'id'] and len(rows) == 1 + 4 * 25
+    rows = read_csv(search_and_flatten_to_csv(input_json='in.json', search_name='a', array_handling='explode',
+                                              object_handling='recurse', max_object_bytes=50))
+    # id, a and b are 6 to 8 bytes a row
+    assert 4 * 6 <= len(rows) - 1 <= 4 * 9
+    assert capsys.readouterr().out.count('[-] Object explodes into more than') == 8
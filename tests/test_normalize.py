@@ -0,0 +1,115 @@
+import json
+
+from conftest import read_csv
+from searchAndFlatten import NORMALIZED_ID_KEY, NORMALIZED_PARENT_ID_KEY, NormalizedRow, flatten, granular_flatten, \
+    search_and_flatten_to_csv
+
+OBJECTS = [{'id': 1, 'items': [{'sku': 'a', 'opts': [1, 2]}, {'sku': 'b'}], 'tags': ['x']},
+           {'id': 2, 'items': []},
+           {'id': 3, 'items': [{'sku': 'c', 'opts': [3]}], 'tags': ['y', 'z']}]
+
+
+def tables(rows):
+    # the rows by table, None for the main rows
+    by_table = {}
+    for row in rows:
+        by_table.setdefault(row.table if isinstance(row, NormalizedRow) else None, []).append(dict(row))
+    return by_table
+
+
+def test_arrays_go_to_linked_child_rows():
+    rows = tables(flatten(OBJECTS, array_handling='normalize', object_handling='recurse'))
+    main_ids = {row['id']: row[NORMALIZED_ID_KEY] for row in rows[None]}
+    assert [sorted(row) for row in rows[None]] == [[NORMALIZED_ID_KEY, 'id']] * 3
+
+    items = {row['items.sku']: row for row in rows['items']}
+    assert {sku: row[NORMALIZED_PARENT_ID_KEY] for sku, row in items.items()} == \
+           {'a': main_ids[1], 'b': main_ids[1], 'c': main_ids[3]}
+    assert sorted((row[NORMALIZED_PARENT_ID_KEY], row['items.opts']) for row in rows['items.opts']) == \
+           [(items['a'][NORMALIZED_ID_KEY], 1), (items['a'][NORMALIZED_ID_KEY], 2), (items['c'][NORMALIZED_ID_KEY], 3)]
+    assert sorted((row[NORMALIZED_PARENT_ID_KEY], row['tags']) for row in rows['tags']) == \
+           [(main_ids[1], 'x'), (main_ids[3], 'y'), (main_ids[3], 'z')]
+
+    all_ids = [row[NORMALIZED_ID_KEY] for table_rows in rows.values() for row in table_rows]
+    assert sorted(all_ids) == list(range(1, len(all_ids) + 1))
+
+
+def test_granular_normalize_of_one_key():
+    rows = tables(granular_flatten(OBJECTS[0], {'items': {'array_handling': 'normalize'}}, {'items': 'items'},
+                                   _object_handling='recurse', remove_quotes=True))
+    assert rows[None] == [{NORMALIZED_ID_KEY: 1, 'id': '1', 'tags': '[\\"x\\"]'}]
+    assert rows['items'] == [
+        {NORMALIZED_ID_KEY: 2, NORMALIZED_PARENT_ID_KEY: 1, 'items.sku': 'a', 'items.opts': '[1,2]'},
+        {NORMALIZED_ID_KEY: 3, NORMALIZED_PARENT_ID_KEY: 1, 'items.sku': 'b'}]
+
+
+def test_other_handlings_have_no_ids():
+    assert flatten(OBJECTS[:1], array_handling='explode', object_handling='recurse')[0] == \
+           {'id': 1, 'items.sku': 'a', 'items.opts': 1, 'tags': 'x'}
+
+
+def flatten_to_csvs(**kwargs):
+    table_files = []
+    main = search_and_flatten_to_csv(input_json='in.json', search_name='a', array_handling='normalize',
+                                     object_handling='recurse', options={'table_files': table_files}, **kwargs)
+    return main, table_files
+
+
+def csv_rows(filename):
+    header, *rows = read_csv(filename)
+    return [{key: value for key, value in zip(header, row) if value != ''} for row in rows]
+
+
+def test_child_csvs(workdir):
+    with open('in.json', 'w') as f:
+        json.dump(OBJECTS, f)
+    main, table_files = flatten_to_csvs()
+    assert sorted(table_files) == ['flattened__in__items.csv', 'flattened__in__items.opts.csv',
+                                   'flattened__in__tags.csv']
+
+    main_rows = csv_rows(main)
+    assert [row['id'] for row in main_rows] == ['1', '2', '3']
+    parent_of = {row[NORMALIZED_ID_KEY]: row['id'] for row in main_rows}
+    items = csv_rows('flattened__in__items.csv')
+    assert [(parent_of[row[NORMALIZED_PARENT_ID_KEY]], row['items.sku']) for row in items] == \
+           [('1', 'a'), ('1', 'b'), ('3', 'c')]
+    item_of = {row[NORMALIZED_ID_KEY]: row['items.sku'] for row in items}
+    assert [(item_of[row[NORMALIZED_PARENT_ID_KEY]], row['items.opts'])
+            for row in csv_rows('flattened__in__items.opts.csv')] == [('a', '1'), ('a', '2'), ('c', '3')]
+
+
+def test_ids_are_unique_across_the_job(workdir):
+    with open('in.json', 'w') as f:
+        json.dump(OBJECTS * 20, f)
+    main, table_files = flatten_to_csvs()
+    ids = [row[NORMALIZED_ID_KEY] for filename in [main] + table_files for row in csv_rows(filename)]
+    assert len(ids) == len(set(ids))
+
+
+def test_workers_are_ignored(workdir, capsys):
+    with open('in.json', 'w') as f:
+        json.dump(OBJECTS, f)
+    main, _ = flatten_to_csvs()
+    expected = open(main).read()
+    main, _ = flatten_to_csvs(workers=3)
+    assert open(main).read() == expected
+    assert '[-] Normalized arrays are written by a single process, ignoring workers' in capsys.readouterr().out
+
+
+def test_test_mode_counts_main_rows(workdir):
+    with open('in.json', 'w') as f:
+        json.dump(OBJECTS + [{'id': 4, 'items': [{'sku': 'd'}]}], f)
+    main, table_files = flatten_to_csvs(mode='test', num_test_rows=2)
+    assert [row['id'] for row in csv_rows(main)] == ['1', '2']
+    # the child rows of the main rows written are all there, and no others
+    assert [row['items.sku'] for row in csv_rows('flattened__in__items.csv')] == ['a', 'b']
+    assert [row['items.opts'] for row in csv_rows('flattened__in__items.opts.csv')] == ['1', '2']
+    assert [row['tags'] for row in csv_rows('flattened__in__tags.csv')] == ['x']
+
+
+def test_test_mode_still_caps_exploded_rows(workdir):
+    with open('in.json', 'w') as f:
+        json.dump([{'id': 1, 'tags': list('abcdef')}, {'id': 2, 'tags': ['g']}], f)
+    rows = read_csv(search_and_flatten_to_csv(input_json='in.json', search_name='a', array_handling='explode',
+                                              object_handling='recurse', mode='test', num_test_rows=4))
+    assert sorted(rows[0]) == ['id', 'tags'] and len(rows) == 5
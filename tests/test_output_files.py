@@ -0,0 +1,106 @@
+import csv
+import glob
+import json
+
+import pytest
+
+from searchAndFlatten import search_and_flatten_to_csv
+from utils import CsvOutputFile, get_output_path, open_input_file, select_columns_from_csv
+
+OBJECTS = [{'id': i, 'name': f'ü{i}', 'tags': ['a'] * (i % 3), 'meta': {f'k{i % 4}': i}} for i in range(50)]
+
+
+@pytest.fixture
+def objects_json(workdir):
+    with open('in.json', 'w', encoding='utf-8') as f:
+        json.dump(OBJECTS, f)
+    return 'in.json'
+
+
+def read_output(path):
+    with open_input_file(path, 'r', newline='') as f:
+        return list(csv.reader(f))
+
+
+def read_parts(first_part):
+    return [read_output(path) for path in sorted(glob.glob(first_part.replace('_part0001', '_part*')))]
+
+
+def flatten(**kwargs):
+    return search_and_flatten_to_csv(input_json='in.json', search_name='a', **kwargs)
+
+
+@pytest.mark.parametrize('compression, extension', [('gzip', '.gz'), ('zstd', '.zst')])
+def test_compressed_output(objects_json, compression, extension):
+    plain = read_output(flatten())
+    output = flatten(output_compression=compression)
+    assert output == 'flattened__in.csv' + extension
+    assert read_output(output) == plain
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip', 'zstd'])
+@pytest.mark.parametrize('split', [{'max_rows_per_file': 7}, {'max_bytes_per_file': 200}], ids=str)
+def test_split_output(objects_json, compression, split):
+    header, *rows = read_output(flatten())
+    output = flatten(output_compression=compression, **split)
+    assert output == get_output_path('flattened__in_part0001.csv', compression)
+    parts = read_parts(output)
+    assert len(parts) > 1
+    assert all(part[0] == header for part in parts)
+    assert [row for part in parts for row in part[1:]] == rows
+    if 'max_rows_per_file' in split:
+        assert [len(part) - 1 for part in parts] == [7] * 7 + [1]
+
+
+def test_further_parts_are_listed_with_the_table_files(objects_json):
+    table_files = []
+    output = flatten(options={'table_files': table_files, 'max_rows_per_file': 20})
+    assert [output] + table_files == ['flattened__in_part0001.csv', 'flattened__in_part0002.csv',
+                                      'flattened__in_part0003.csv']
+
+
+def test_rewritten_header_falls_back_to_deferred(objects_json, capsys):
+    plain = read_output(flatten(search_config=['id', 'tags']))
+    output = flatten(search_config=['id', 'tags'], header_mode='rewrite', output_compression='gzip')
+    assert '[-] Compressed or split output writes the header once, using header_mode "deferred"' in \
+           capsys.readouterr().out
+    assert read_output(output) == plain
+
+
+def test_parts_end_on_record_boundaries(workdir):
+    # records with quoted line breaks span several lines, a part only ends after a whole record
+    rows = [['id', 'text']] + [[str(i), 'line\n' * (i % 4) + 'end'] for i in range(30)]
+    with CsvOutputFile('out.csv', max_rows=4) as output:
+        writer = csv.writer(output)
+        for row in rows:
+            writer.writerow(row)
+    parts = read_parts(output.name)
+    assert output.paths == [f'out_part{i:04d}.csv' for i in range(1, 9)]
+    assert all(part[0] == rows[0] for part in parts)
+    assert [row for part in parts for row in part[1:]] == rows[1:]
+
+    # a record written in pieces is kept in one part
+    with CsvOutputFile('pieces.csv', max_bytes=1) as output:
+        output.write('a,b\n')
+        for i in range(3):
+            output.write(f'{i},')
+            output.write(f'{i}\n')
+    assert [read_output(path) for path in output.paths] == [[['a', 'b'], [str(i), str(i)]] for i in range(3)]
+
+
+def test_only_a_header(workdir):
+    with CsvOutputFile('empty.csv', compression='gzip', max_rows=2) as output:
+        output.write('a,b')  # no line end yet, written on close
+    assert output.paths == ['empty_part0001.csv.gz']
+    assert read_output('empty_part0001.csv.gz') == [['a', 'b']]
+
+
+def test_chunked_csv_job_output(workdir):
+    with open('in.csv', 'w') as f:
+        f.write('a,b,c\n' + ''.join(f'{i},{i + 1},{i + 2}\n' for i in range(25)))
+    output = select_columns_from_csv('in.csv', ['c', 'a'], chunksize=4, output_compression='zstd',
+                                     max_rows_per_file=10)
+    assert output == 'col_clip__in_part0001.csv.zst'
+    parts = read_parts(output)
+    assert [len(part) - 1 for part in parts] == [10, 10, 5]
+    assert [row for part in parts for row in part[1:]] == [[str(i + 2), str(i)] for i in range(25)]
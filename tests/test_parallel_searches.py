@@ -0,0 +1,70 @@
+import json
+import os
+
+from conftest import read_csv
+from searchAndFlatten import _get_unused_csv_filename, get_search_csv_filename, search_and_flatten_to_csvs
+
+
+def write_objects(filename, count, **extra):
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump([dict({'id': i, 'tags': ['a', 'b'][:1 + i % 2]}, **extra) for i in range(count)], f)
+
+
+def searches():
+    write_objects('one.json', 30)
+    write_objects('two.json', 20)
+    write_objects('three.json', 10)
+    return [dict(input_json='one.json', search_name='ids', search_config=['id']),
+            dict(input_json='two.json', search_name='all', array_handling='explode'),
+            dict(input_json='one.json', search_name='tags', search_config=['tags'], array_handling='explode'),
+            dict(input_json='three.json', search_name='all')]
+
+
+def test_parallel_runs_write_what_one_process_writes(workdir, capsys):
+    expected = {filename: read_csv(filename) for filename in search_and_flatten_to_csvs(searches())}
+    for filename in expected:
+        os.remove(filename)
+
+    csv_filenames = search_and_flatten_to_csvs(searches(), parallel=2)
+    assert csv_filenames == list(expected)
+    assert {filename: read_csv(filename) for filename in csv_filenames} == expected
+    out = capsys.readouterr().out
+    assert '[+] Running 4 searches of 3 files in 2 processes' in out
+    # the searches of one.json stayed together and shared its parse
+    assert '[+] Flattening one.json once for 2 searches' in out
+
+
+def test_inputs_of_the_same_name_in_different_folders(workdir):
+    write_objects('a/in.json', 5, source='a')
+    write_objects('b/in.json', 7, source='b')
+    searches = [dict(input_json=f'{folder}/in.json', search_name=folder, search_config=['source'])
+                for folder in ('a', 'b')]
+    csv_filenames = search_and_flatten_to_csvs(searches, parallel=2)
+    assert csv_filenames == ['flattened__in.csv', 'flattened__in__b.csv']
+    assert read_csv(csv_filenames[0]) == [['source']] + [['a']] * 5
+    assert read_csv(csv_filenames[1]) == [['source']] + [['b']] * 7
+
+
+def test_workers_and_table_files(workdir, capsys):
+    write_objects('one.json', 30)
+    write_objects('two.json', 20)
+    table_files = []
+    # the options of open_csv_search can also be nested in its options dict
+    search_and_flatten_to_csvs([dict(input_json='one.json', search_name='one', options={'workers': 4}),
+                                dict(input_json='two.json', search_name='two', array_handling='normalize',
+                                     object_handling='recurse', options={'table_files': table_files})],
+                               parallel=2)
+    assert '[-] one runs in a single process next to the other searches, ignoring workers' in capsys.readouterr().out
+    assert table_files == ['flattened__two__tags.csv']
+    assert len(read_csv(table_files[0])) == 1 + sum(1 + i % 2 for i in range(20))
+
+
+def test_output_names():
+    assert get_search_csv_filename('data/in.json.gz', 's', None, 'normal') == 'flattened__in.csv'
+    assert get_search_csv_filename('in.jsonl', 's', 'results', 'parquet') == 'flattened__in.parquet'
+    assert get_search_csv_filename('in.json', 's', 'results', 'datetime').startswith('flattened__s__results_')
+
+    used = set()
+    assert [_get_unused_csv_filename('flattened__in.csv', name, used) for name in ('a', 'b', 'b', 'b')] == \
+           ['flattened__in.csv', 'flattened__in__b.csv', 'flattened__in__b_2.csv', 'flattened__in__b_3.csv']
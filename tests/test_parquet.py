@@ -0,0 +1,97 @@
+import csv
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from conftest import read_csv
+from searchAndFlatten import search_and_flatten_to_csv
+from utils import ParquetDictWriter, read_csv_or_parquet
+
+OBJECTS = [{'id': 1, 'score': 1.5, 'ok': True, 'name': 'a', 'mixed': 1, 'big': 2 ** 70, 'tags': ['x', 'y']},
+           {'id': 2, 'score': 2, 'ok': False, 'name': 'b', 'mixed': 'two', 'extra': None},
+           {'id': 3, 'name': 'a', 'mixed': 3, 'extra': 'e'}]
+
+
+@pytest.fixture
+def parquet_output(workdir):
+    with open('in.json', 'w') as f:
+        json.dump(OBJECTS, f)
+    return search_and_flatten_to_csv(input_json='in.json', search_name='a', output_format='parquet')
+
+
+def test_columns_get_the_types_of_their_values(parquet_output):
+    assert parquet_output == 'flattened__in.parquet'
+    schema = pq.read_schema(parquet_output)
+    types = {name: schema.field(name).type for name in schema.names}
+    assert types == {'id': pa.int64(), 'score': pa.float64(), 'ok': pa.bool_(), 'name': pa.string(),
+                     'mixed': pa.string(), 'big': pa.string(), 'tags': pa.string(), 'extra': pa.string()}
+    # strings are dictionary encoded
+    column = pq.ParquetFile(parquet_output).metadata.row_group(0).column(schema.names.index('name'))
+    assert 'RLE_DICTIONARY' in column.encodings or 'PLAIN_DICTIONARY' in column.encodings
+
+
+def test_rows_are_the_csv_rows(parquet_output):
+    df = read_csv_or_parquet(parquet_output)
+    assert df['id'].tolist() == [1, 2, 3]
+    assert df['score'].tolist()[:2] == [1.5, 2.0] and pd.isna(df['score'][2])
+    assert df['ok'].tolist()[:2] == [True, False]
+    assert df['mixed'].tolist() == ['1', 'two', '3']
+    assert df['big'][0] == str(2 ** 70)
+
+    csv_rows = read_csv(search_and_flatten_to_csv(input_json='in.json', search_name='a'), quoting=csv.QUOTE_NONE,
+                        escapechar='\\')
+    assert sorted(csv_rows[0]) == sorted(df.columns)
+    for column in ('name', 'mixed', 'tags', 'extra'):
+        assert [None if value == '' else value for value in (row[csv_rows[0].index(column)] for row in csv_rows[1:])] \
+               == [None if pd.isna(value) else value for value in df[column]]
+
+
+def test_row_groups(workdir):
+    writer = ParquetDictWriter('out.parquet', row_group_size=4, spill_batch_size=3)
+    for i in range(10):
+        writer.writerow({'n': i} if i % 2 else {'n': i, 'odd': False})
+    writer.close()
+    parquet_file = pq.ParquetFile('out.parquet')
+    assert parquet_file.num_row_groups == 3
+    table = parquet_file.read()
+    assert table.column('n').to_pylist() == list(range(10))
+    assert table.column('odd').to_pylist() == [False, None] * 5
+
+
+def test_no_rows(workdir):
+    writer = ParquetDictWriter('out.parquet')
+    writer.close()
+    assert pq.ParquetFile('out.parquet').metadata.num_rows == 0
+
+
+def test_read_options(parquet_output):
+    assert read_csv_or_parquet(parquet_output, usecols=['name', 'id']).columns.tolist() == ['name', 'id']
+    assert read_csv_or_parquet(parquet_output, nrows=2)['id'].tolist() == [1, 2]
+    assert read_csv_or_parquet(parquet_output, nrows=0, usecols=['id']).columns.tolist() == ['id']
+    chunks = list(read_csv_or_parquet(parquet_output, chunksize=2))
+    assert [chunk['id'].tolist() for chunk in chunks] == [[1, 2], [3]]
+    chunks = list(read_csv_or_parquet(parquet_output, chunksize=2, nrows=1))
+    assert [chunk['id'].tolist() for chunk in chunks] == [[1]]
+    assert read_csv_or_parquet(parquet_output, dtype=str)['id'].tolist() == ['1', '2', '3']
+    df = read_csv_or_parquet(parquet_output, dtype={'id': 'float64', 'missing': str}, low_memory=False)
+    assert df['id'].dtype == 'float64'
+
+
+@pytest.mark.parametrize('args, kwargs', [
+    ((), {'sep': ';'}),
+    ((), {'skiprows': 1}),
+    ((';',), {}),
+    ((), {'usecols': lambda column: column == 'id'}),
+])
+def test_read_options_that_do_not_apply(parquet_output, args, kwargs):
+    with pytest.raises(ValueError):
+        read_csv_or_parquet(parquet_output, *args, **kwargs)
+
+
+def test_csv_files_are_read_by_pandas(workdir):
+    with open('in.csv', 'w') as f:
+        f.write('a;b\n1;2\n')
+    assert read_csv_or_parquet('in.csv', sep=';').to_dict('records') == [{'a': 1, 'b': 2}]
@@ -0,0 +1,120 @@
+import io
+import json
+
+import pyarrow.parquet as pq
+import pytest
+
+from searchAndFlatten import open_csv_search, search_and_flatten_to_csv
+from utils import DeferredHeaderDictWriter, PrefetchingReader, ThreadedRowWriter
+
+OBJECTS = [{'id': i, f'key{i % 7}': 'v' * (i % 13), 'nested': {f'n{i % 5}': [i, {'x': i}]}} for i in range(200)]
+
+
+@pytest.fixture
+def inputs(workdir):
+    with open('array.json', 'w') as f:
+        json.dump(OBJECTS, f, indent=2)
+    with open('rooted.json', 'w') as f:
+        json.dump({'meta': {'n': len(OBJECTS)}, 'data': OBJECTS}, f)
+    with open('lines.jsonl', 'w') as f:
+        f.writelines(json.dumps(obj) + '\n' for obj in OBJECTS)
+
+
+def flatten(input_json, **kwargs):
+    with open(search_and_flatten_to_csv(input_json=input_json, search_name=json.dumps(kwargs, sort_keys=True),
+                                        **kwargs), newline='') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('input_json, root_key', [('array.json', None), ('rooted.json', 'data'),
+                                                  ('lines.jsonl', None)])
+@pytest.mark.parametrize('kwargs', [{}, {'header_mode': 'rewrite'}, {'batch_rows': 3}, {'exact_count': True},
+                                    {'search_config': ['id', 'nested.n1'], 'parse_mode': 'events'},
+                                    {'output_format': 'parquet'}], ids=str)
+def test_pipeline_writes_what_a_single_thread_does(inputs, input_json, root_key, kwargs):
+    kwargs = dict(kwargs, root_key=root_key)
+    if kwargs.get('output_format') == 'parquet':
+        pipelined = search_and_flatten_to_csv(input_json=input_json, search_name='pipelined', pipeline=True, **kwargs)
+        single = search_and_flatten_to_csv(input_json=input_json, search_name='single', **kwargs)
+        assert pq.read_table(pipelined).equals(pq.read_table(single))
+        return
+    assert flatten(input_json, pipeline=True, **kwargs) == flatten(input_json, **kwargs)
+
+
+def test_pipeline_in_test_mode(inputs):
+    assert flatten('array.json', pipeline=True, mode='test', num_test_rows=5) == \
+           flatten('array.json', mode='test', num_test_rows=5)
+
+
+def test_sharded_searches_ignore_pipeline(inputs):
+    assert open_csv_search(input_json='array.json', search_name='a', pipeline=True).pipeline
+    assert not open_csv_search(input_json='array.json', search_name='a', pipeline=True, workers=2).pipeline
+    assert open_csv_search(input_json='array.json', search_name='a', options={'pipeline': True}).pipeline
+
+
+DATA = b''.join(b'line %d\n' % i for i in range(1000)) + b'no newline at the end'
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 4096, 1 << 20])
+def test_prefetching_reader_reads_the_file(block_size):
+    with PrefetchingReader(io.BytesIO(DATA), block_size=block_size, queue_size=2) as reader:
+        # like a raw file, a read returns at most size bytes, possibly fewer
+        first = reader.read(5)
+        assert DATA.startswith(first) and 0 < len(first) <= 5
+        assert reader.read() == DATA[len(first):]
+        assert reader.read(5) == b''
+    with PrefetchingReader(io.BytesIO(DATA), block_size=block_size, queue_size=2) as reader:
+        assert list(reader) == io.BytesIO(DATA).readlines()
+    chunks = []
+    with PrefetchingReader(io.BytesIO(DATA), block_size=block_size) as reader:
+        for chunk in iter(lambda: reader.read(100), b''):
+            chunks.append(chunk)
+    assert b''.join(chunks) == DATA
+
+
+def test_prefetching_reader_stops_when_closed_early():
+    reader = PrefetchingReader(io.BytesIO(DATA), block_size=1, queue_size=1)
+    assert reader.read(3) == DATA[:1]
+    reader.close()  # the thread is blocked on the full queue, closing must not hang
+    assert not reader._thread.is_alive()
+
+
+class FailingFile(io.BytesIO):
+    def read(self, size=-1):
+        if self.tell() >= 10:
+            raise OSError('disk gone')
+        return super().read(size)
+
+
+def test_prefetching_reader_raises_read_errors():
+    with PrefetchingReader(FailingFile(DATA), block_size=4) as reader:
+        with pytest.raises(OSError, match='disk gone'):
+            reader.read()
+
+
+def test_threaded_row_writer_writes_every_row():
+    csvfile = io.StringIO()
+    writer = ThreadedRowWriter(DeferredHeaderDictWriter(csvfile), batch_size=3, queue_size=1)
+    writer.writerows({'n': i} if i % 2 else {'n': i, 'even': True} for i in range(10))
+    writer.close()
+    assert writer.fieldnames == ['even', 'n']
+    assert csvfile.getvalue().split() == ['even,n'] + [f'True,{i}' if i % 2 == 0 else f',{i}' for i in range(10)]
+
+
+class FailingWriter:
+    fieldnames = []
+
+    def writerows(self, rows):
+        raise ValueError('cannot write')
+
+    def close(self):
+        raise AssertionError('a failed writer is not closed')
+
+
+def test_threaded_row_writer_raises_write_errors():
+    writer = ThreadedRowWriter(FailingWriter(), batch_size=1, queue_size=1)
+    with pytest.raises(ValueError, match='cannot write'):
+        for i in range(100):
+            writer.writerow({'n': i})
+    with pytest.raises(ValueError, match='cannot write'):
+        writer.close()
@@ -0,0 +1,71 @@
+import glob
+import io
+import json
+
+import pytest
+
+import searchAndFlatten
+import utils
+from utils import ByteProgressReader, open_json_items, reformat_json, trim_json
+
+OBJECTS = [{'id': i, 'name': f'n{i}', 'tags': list(range(i % 3))} for i in range(50)]
+
+
+class FakeBar:
+    def __init__(self):
+        self.n = 0
+
+    def update(self, n):
+        self.n += n
+
+
+@pytest.fixture
+def array_json(workdir):
+    with open('in.json', 'w') as f:
+        json.dump(OBJECTS, f, indent=2)
+    return 'in.json'
+
+
+@pytest.fixture
+def no_counting(monkeypatch):
+    """Fails the test if the input gets a counting pass."""
+    def count_items(*args, **kwargs):
+        raise AssertionError('the input was counted before being read')
+    monkeypatch.setattr(utils, 'count_items', count_items)
+    monkeypatch.setattr(searchAndFlatten, 'count_items', count_items)
+
+
+def test_byte_progress_reader_counts_bytes_read():
+    bar = FakeBar()
+    reader = ByteProgressReader(io.BytesIO(b'x' * 100), bar)
+    assert reader.read(30) == b'x' * 30
+    reader.read()
+    assert bar.n == 100
+
+
+def test_items_follow_the_byte_position(array_json, no_counting):
+    with open_json_items(array_json, 'item') as items:
+        assert list(items) == OBJECTS
+
+
+def test_exact_count_counts_objects(array_json):
+    with open_json_items(array_json, 'item', total_items=len(OBJECTS)) as items:
+        assert items.total == len(OBJECTS)
+        assert list(items) == OBJECTS
+
+
+def test_flatten_reads_the_input_once(array_json, no_counting):
+    csv_filename = searchAndFlatten.search_and_flatten_to_csv(input_json=array_json, search_name='s')
+    with open(csv_filename) as f:
+        assert len(f.readlines()) == len(OBJECTS) + 1
+
+
+def test_reformat_separates_every_object(array_json, no_counting):
+    with open(reformat_json(array_json)) as f:
+        assert json.load(f) == OBJECTS
+
+
+def test_trim_json_range(array_json, no_counting):
+    trim_json(array_json, range_str='5-12')
+    with open(glob.glob('trimmed_json__*.json')[0]) as f:
+        assert json.load(f) == OBJECTS[5:12]
@@ -0,0 +1,94 @@
+import copy
+
+import pytest
+
+from conftest import load_baseline_outputs, row_multiset
+from searchAndFlatten import SearchMatcher, compile_search_config, search_and_flatten
+
+BASELINE = load_baseline_outputs()
+SEARCH_CASES = [case for case in BASELINE['search_and_flatten'] if case['kwargs']['search_config'] != '*']
+
+
+def case_id(case):
+    kwargs = case['kwargs']
+    return f"{case['input']}-{kwargs['search_config']}-{kwargs['array_handling']}-{kwargs['object_handling']}-" \
+           f"{kwargs['quote_handling']}"
+
+
+@pytest.mark.parametrize('compiled', [True, False], ids=['compiled', 'process_dict'])
+@pytest.mark.parametrize('case', SEARCH_CASES, ids=case_id)
+def test_search_matches_baseline(case, compiled):
+    kwargs = dict(case['kwargs'])
+    if compiled:
+        kwargs['compiled_search'] = compile_search_config(kwargs['search_config'])
+        assert kwargs['compiled_search'] is not None
+    rows = search_and_flatten(copy.deepcopy(BASELINE['inputs'][case['input']]), **kwargs)
+    assert len(rows) == len(case['rows'])
+    assert row_multiset(rows) == row_multiset(case['rows'])
+
+
+def process_dict_rows(search_config, item, **kwargs):
+    return search_and_flatten(copy.deepcopy(item), search_config, remove_quotes=True, **kwargs)
+
+
+def compiled_rows(search_config, item, **kwargs):
+    compiled = compile_search_config(search_config, allow_dot_notation=kwargs.get('allow_dot_notation', False))
+    return search_and_flatten(copy.deepcopy(item), search_config, remove_quotes=True, compiled_search=compiled,
+                              **kwargs)
+
+
+ITEM = {
+    'ports[0]': 22, 'ports[1]': 80, 'ports[2]': 443, 'ports[3]': 8080,
+    'host': {'name': 'a', 'ports[1]': 81, 'os': {'name': 'linux', 'version': '6'}},
+    'services': [{'name': 'ssh', 'port': 22, 'tags': ['x']}, {'name': 'http', 'port': 80},
+                 [{'name': 'nested', 'port': 1}]],
+    'name': 'top',
+}
+
+
+@pytest.mark.parametrize('search_config', [
+    ['ports[1-2]'],
+    ['host.ports[0-5]', 'ports[3-3]'],
+    ['services.[].name', 'services.[].port'],
+    ['host.os.name', 'name'],
+    {'services.[].port': {}, 'host.os': {'object_handling': 'recurse'}},
+    {'services': {'array_handling': 'explode', 'object_handling': 'recurse'}, 'ports[0-1]': {}},
+    {'nam': {'similarity_threshold': 0.5}, 'port': {'similarity_threshold': 0.6}},
+], ids=str)
+def test_compiled_search_matches_process_dict(search_config):
+    assert compiled_rows(search_config, ITEM) == process_dict_rows(search_config, ITEM)
+    assert compiled_rows(search_config, [ITEM, ITEM]) == process_dict_rows(search_config, [ITEM, ITEM])
+
+
+def test_dot_notation_option_of_list_configs():
+    search_config = ['host.name', 'services.[].name']
+    for allow_dot_notation in (True, False):
+        assert compiled_rows(search_config, ITEM, allow_dot_notation=allow_dot_notation) == \
+               process_dict_rows(search_config, ITEM, allow_dot_notation=allow_dot_notation)
+
+
+def test_many_search_keys_in_one_traversal():
+    item = {f'field{i}': {'value': i, 'list': [{'value': -i}]} for i in range(60)}
+    search_config = [f'field{i}.value' for i in range(0, 60, 2)] + [f'field{i}.list.[].value' for i in range(1, 60, 2)]
+    assert compiled_rows(search_config, item) == process_dict_rows(search_config, item)
+
+    found, matches = compile_search_config(search_config).find_keys(item)
+    assert found['field0.value'] == 0 and found['field58.value'] == 58
+    assert len(found) == len(search_config)
+
+
+def test_range_segments_are_parsed_once():
+    matcher = SearchMatcher({'ports[1-2]': {}, 'services.[].port': {}})
+    kinds = sorted(kind for kind, _, _, _ in matcher.root.patterns)
+    assert kinds == ['range']
+    assert matcher.root.exact['services'].patterns[0][0] == 'index'
+
+
+def test_malformed_range_is_rejected():
+    with pytest.raises(ValueError, match='Malformed range'):
+        SearchMatcher({'ports[1-2-3]': {}})
+
+
+def test_wildcard_and_other_separators_are_not_compiled():
+    assert compile_search_config('*') is None
+    assert compile_search_config(['a.b'], separator='/') is None
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from conftest import read_csv
+from searchAndFlatten import search_and_flatten_to_csv
+from utils import get_json_lines_shard_ranges
+
+OBJECTS = [{'id': i, 'ports': [80, 443][:i % 3], 'meta': {f'k{i % 5}': i},
+            'vulns': [{'cve': f'c{j}'} for j in range(i % 2)]} for i in range(300)]
+
+
+def flatten(input_json, **kwargs):
+    return read_csv(search_and_flatten_to_csv(input_json=input_json, search_name='s', array_handling='explode',
+                                              object_handling='recurse', **kwargs))
+
+
+@pytest.fixture(params=['array', 'json_lines'])
+def input_file(request, workdir):
+    if request.param == 'array':
+        with open('in.json', 'w') as f:
+            json.dump({'results': OBJECTS}, f)
+        return 'in.json', 'results'
+    with open('in.jsonl', 'w') as f:
+        f.writelines(json.dumps(obj) + '\n' for obj in OBJECTS)
+    return 'in.jsonl', None
+
+
+def test_workers_write_what_one_process_writes(input_file, capsys):
+    input_json, root_key = input_file
+    single = flatten(input_json, root_key=root_key)
+    assert flatten(input_json, root_key=root_key, workers=3) == single
+    assert 'shards with 3 workers' in capsys.readouterr().out
+
+
+def test_unordered_merge_writes_the_same_rows(input_file):
+    input_json, root_key = input_file
+    header, *rows = flatten(input_json, root_key=root_key)
+    unordered_header, *unordered_rows = flatten(input_json, root_key=root_key, workers=3, preserve_order=False)
+    assert sorted(unordered_header) == sorted(header)
+    reordered = [[dict(zip(unordered_header, row))[name] for name in header] for row in unordered_rows]
+    assert sorted(reordered) == sorted(rows)
+
+
+def test_json_lines_shards_split_at_line_breaks(workdir):
+    lines = [json.dumps({'i': i, 'pad': 'x' * (i % 17)}) + '\n' for i in range(100)]
+    with open('in.jsonl', 'w') as f:
+        f.writelines(lines)
+    data = ''.join(lines).encode()
+
+    shards = get_json_lines_shard_ranges('in.jsonl', 8)
+    assert shards[0][0] == 0 and shards[-1][1] == len(data)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(shards, shards[1:]))
+    assert all(data[start - 1:start] == b'\n' for start, _ in shards[1:])
@@ -0,0 +1,88 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+
+import searchAndFlatten
+from conftest import csv_row_multiset, flatten_baseline_case, load_baseline_outputs, read_csv, run_main, \
+    write_baseline_inputs
+from searchAndFlatten import search_and_flatten_to_csvs
+
+BASELINE = load_baseline_outputs()
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    # the files opened for their objects
+    opened = []
+    open_json_items = searchAndFlatten.open_json_items
+
+    @contextmanager
+    def counting_open_json_items(input_json, *args, **kwargs):
+        opened.append(input_json)
+        with open_json_items(input_json, *args, **kwargs) as items:
+            yield items
+
+    monkeypatch.setattr(searchAndFlatten, 'open_json_items', counting_open_json_items)
+    return opened
+
+
+@pytest.mark.parametrize('input_name', ['array', 'rooted', 'wrapped'])
+def test_one_parse_writes_what_separate_runs_write(input_name, workdir, parses, capsys):
+    write_baseline_inputs(BASELINE)
+    cases = [case for case in BASELINE['search_and_flatten_to_csv'] if case['input'] == input_name]
+    searches = [dict(case['kwargs'], input_json=f'{input_name}.json', search_name=f's{idx}', quoting=1,
+                     escapechar=None) for idx, case in enumerate(cases)]
+
+    csv_filenames = search_and_flatten_to_csvs(searches)
+    assert len(set(csv_filenames)) == len(cases)
+    assert parses == [f'{input_name}.json']
+    assert f'[+] Flattening {input_name}.json once for {len(cases)} searches' in capsys.readouterr().out
+
+    shared = [read_csv(csv_filename) for csv_filename in csv_filenames]
+    for rows, case in zip(shared, cases):
+        assert rows == flatten_baseline_case(case)
+        assert csv_row_multiset(rows) == csv_row_multiset([case['header']] + case['rows'])
+
+
+def write_objects(filename, count):
+    with open(filename, 'w') as f:
+        json.dump([{'id': i, 'tags': ['a', 'b']} for i in range(count)], f)
+
+
+def test_test_mode_search_stops_alone(workdir, parses):
+    write_objects('in.json', 10)
+    test_search, full_search = search_and_flatten_to_csvs([
+        dict(input_json='in.json', search_name='test', mode='test', num_test_rows=3),
+        dict(input_json='in.json', search_name='full', search_config=['id'])])
+    assert len(read_csv(test_search)) == 1 + 3
+    assert read_csv(full_search) == [['id']] + [[str(i)] for i in range(10)]
+    assert parses == ['in.json']
+
+
+def test_searches_that_cannot_share_read_on_their_own(workdir, parses, capsys):
+    write_objects('in.json', 10)
+    write_objects('other.json', 5)
+    outputs = search_and_flatten_to_csvs([
+        dict(input_json='in.json', search_name='items', search_config=['id']),
+        dict(input_json='in.json', search_name='events', search_config=['id'], parse_mode='events'),
+        dict(input_json='other.json', search_name='other', search_config=['id'])])
+    assert read_csv(outputs[0]) == read_csv(outputs[1]) == [['id']] + [[str(i)] for i in range(10)]
+    assert len(read_csv(outputs[2])) == 1 + 5
+    # the pruned search needs parser events of its own
+    assert sorted(parses) == ['in.json', 'in.json', 'other.json']
+    assert 'once for' not in capsys.readouterr().out
+
+
+def test_main_groups_the_searches_of_a_file(workdir, monkeypatch, capsys):
+    write_objects('in.json', 10)
+    with open('searches.json', 'w') as f:
+        json.dump({'ids': {'search_config': ['id']}, 'tags': {'search_config': ['tags'], 'array_handling': 'explode'},
+                   'all': {'search_config': '*'}}, f)
+    run_main(monkeypatch, {'jobs': [{'name': 'flatten', 'type': 'search_and_flatten_csv',
+                                     'search_config_path': 'searches.json',
+                                     'searchconfigs': {'ids': 'in.json', 'tags': 'in.json', 'all': 'in.json'}}]})
+    assert '[+] Flattening in.json once for 3 searches' in capsys.readouterr().out
+    assert len(read_csv('flattened__in.csv')) == 1 + 10
+    assert len(read_csv('flattened__in__tags.csv')) == 1 + 20
+    assert len(read_csv('flattened__in__all.csv')) == 1 + 10
@@ -0,0 +1,69 @@
+import io
+import json
+import os
+
+import pytest
+
+from conftest import csv_row_multiset, flatten_baseline_case, load_baseline_outputs, read_csv, write_baseline_inputs
+from searchAndFlatten import compile_search_config, iter_pruned_json_items, search_and_flatten_to_csv
+
+BASELINE = load_baseline_outputs()
+# the original implementation wrote no rows for single object files, its outputs of the same object in an array are
+# what they should have been
+WRAPPED_CASES = [case for case in BASELINE['search_and_flatten_to_csv'] if case['input'] == 'wrapped']
+
+
+@pytest.fixture
+def inputs(workdir):
+    write_baseline_inputs(BASELINE)
+
+
+def case_id(case):
+    kwargs = case['kwargs']
+    return f"{kwargs['search_config']}-{kwargs['array_handling']}-{kwargs['object_handling']}"
+
+
+@pytest.mark.parametrize('case', WRAPPED_CASES, ids=case_id)
+def test_single_object_matches_baseline_of_wrapped_object(inputs, case):
+    rows = flatten_baseline_case(dict(case, input='single'))
+    if case['kwargs']['search_config'] == '*':
+        # without the columns the two pass wildcard header made up (see test_wildcard_header)
+        assert set(rows[0]) <= set(case['header'])
+    else:
+        assert rows[0] == case['header']
+    assert csv_row_multiset(rows) == csv_row_multiset([case['header']] + case['rows'])
+
+
+@pytest.mark.parametrize('kwargs', [{'pipeline': True}, {'exact_count': True}, {'header_mode': 'rewrite'}], ids=str)
+def test_single_object_options(inputs, kwargs):
+    case = WRAPPED_CASES[0]
+    assert read_csv(search_and_flatten_to_csv(input_json='single.json', search_name='single', **case['kwargs'],
+                                              **kwargs)) == \
+           read_csv(search_and_flatten_to_csv(input_json='wrapped.json', search_name='wrapped', **case['kwargs']))
+
+
+def test_single_object_is_not_copied(inputs):
+    search_and_flatten_to_csv(input_json='single.json', search_name='single')
+    copies = [name for name in os.listdir('temp') if name.endswith('.json')] if os.path.isdir('temp') else []
+    assert copies == []
+
+
+def test_events_of_the_root_object():
+    search_config = {'meta.owner.name': {}, 'tags': {}}
+    matcher = compile_search_config(search_config)
+    data = json.dumps(BASELINE['inputs']['single']).encode('utf-8')
+    objects = list(iter_pruned_json_items(io.BytesIO(data), '', matcher))
+    assert len(objects) == 1
+    assert objects[0]['meta']['owner']['name'] == 'z'
+    assert objects[0]['tags'] == BASELINE['inputs']['single']['tags']
+    # the values no search key can match are left out
+    assert 'id' not in objects[0]
+    assert all('sku' not in item for item in objects[0]['items'])
+
+
+def test_events_parse_mode_of_single_object(inputs):
+    search_config = ['meta.owner.name', 'items.[].sku']
+    assert read_csv(search_and_flatten_to_csv(input_json='single.json', search_name='events',
+                                              search_config=search_config, parse_mode='events')) == \
+           read_csv(search_and_flatten_to_csv(input_json='wrapped.json', search_name='items',
+                                              search_config=search_config))
@@ -0,0 +1,67 @@
+import pytest
+
+import searchAndFlatten
+from conftest import csv_row_multiset, flatten_baseline_case, load_baseline_outputs, read_csv, write_baseline_inputs
+from searchAndFlatten import search_and_flatten_to_csv
+
+BASELINE = load_baseline_outputs()
+WILDCARD_CASES = [case for case in BASELINE['search_and_flatten_to_csv'] if case['kwargs']['search_config'] == '*']
+
+
+def case_id(case):
+    return f"{case['input']}-{case['kwargs']['array_handling']}-{case['kwargs']['object_handling']}"
+
+
+def baseline_keys(case):
+    # the columns of the rows the original flatten returned for the objects of the case
+    input_name = 'single' if case['input'] == 'wrapped' else 'array'
+    for function_case in BASELINE['search_and_flatten']:
+        kwargs = function_case['kwargs']
+        if function_case['input'] == input_name and kwargs['search_config'] == '*' and \
+                kwargs['quote_handling'] == 'escape' and kwargs['array_handling'] == case['kwargs']['array_handling'] \
+                and kwargs['object_handling'] == case['kwargs']['object_handling']:
+            return {key for row in function_case['rows'] for key in row}
+
+
+@pytest.fixture
+def no_header_pass(monkeypatch):
+    def header_pass(*args, **kwargs):
+        raise AssertionError('the wildcard header is found in the flatten pass')
+
+    monkeypatch.setattr(searchAndFlatten, 'get_flattened_csv_headers_from_json', header_pass)
+    monkeypatch.setattr(searchAndFlatten, 'get_first_column_values', header_pass)
+
+
+@pytest.mark.parametrize('case', WILDCARD_CASES, ids=case_id)
+def test_header_has_the_columns_written(case, workdir, no_header_pass):
+    write_baseline_inputs(BASELINE)
+    rows = flatten_baseline_case(case)
+    # the two pass header also had the columns of a recursive flatten, empty when objects were stringified
+    assert set(rows[0]) == baseline_keys(case)
+    assert set(rows[0]) <= set(case['header'])
+    assert csv_row_multiset(rows) == csv_row_multiset([case['header']] + case['rows'])
+    assert all(len(row) == len(rows[0]) for row in rows)
+
+
+def test_columns_are_added_row_by_row(workdir, no_header_pass):
+    # like the dynamic writers, the new columns of each row go after the others, sorted
+    with open('in.json', 'w') as f:
+        f.write('[{"b": 1, "a": {"y": 2}}, {"c": 3, "a": {"x": 4}}, {"a": {"z": 5}, "b": 6}]')
+    rows = read_csv(search_and_flatten_to_csv(input_json='in.json', search_name='a', object_handling='recurse'))
+    assert rows == [['a.y', 'b', 'a.x', 'c', 'a.z'], ['2', '1', '', '', ''], ['', '', '4', '3', ''],
+                    ['', '6', '', '', '5']]
+
+
+def test_no_temporary_files(workdir, no_header_pass):
+    with open('in.json', 'w') as f:
+        f.write('[{"a": 1}, {"b": 2}]')
+    search_and_flatten_to_csv(input_json='in.json', search_name='a')
+    assert sorted(path.name for path in workdir.rglob('*') if path.is_file()) == ['flattened__in.csv', 'in.json']
+
+
+def test_rewrite_header_mode_is_replaced(workdir, capsys):
+    with open('in.json', 'w') as f:
+        f.write('[{"a": 1}, {"b": 2}]')
+    rows = read_csv(search_and_flatten_to_csv(input_json='in.json', search_name='a', header_mode='rewrite'))
+    assert rows == [['a', 'b'], ['1', ''], ['', '2']]
+    assert 'discovers its columns in the one flatten pass, using header_mode "deferred"' in capsys.readouterr().out
@@ -1,7 +1,12 @@
 import json
 import sys
+import io
+import gzip
+import bz2
+import lzma
 
 import ijson
+import orjson
 import re
 import heapq
 from typing import Any, Dict, List, Union, Optional
@@ -13,9 +18,14 @@ import csv
 import os
 import tempfile
 import shutil
+import pickle
+import queue
+import threading
 import humanize
 import jsonlines
-from functools import partial
+from functools import partial, lru_cache
+from itertools import islice
+from contextlib import contextmanager
 from decimal import Decimal
 import warnings
 import numpy as np
@@ -23,6 +33,8 @@ import pandas as pd
 from pandas.api.types import CategoricalDtype
 import ast
 from jaccard_index.jaccard import jaccard_index
+from jsonIndex import load_json_offset_index
+from jsonSerializer import dumps_json, dump_json
 
 
 class CustomJSONEncoder(json.JSONEncoder):
@@ -145,7 +157,7 @@ class CustomComparisonTqdm(tqdm):
 
 
 def count_items_old(json_input, root_key=None, row_limit=None):
-    with open(json_input, 'r', encoding='utf-8') as f:
+    with open_input_file(json_input) as f:
         if root_key:
             items = ijson.items(f, f"{root_key}.item")
         else:
@@ -160,7 +172,19 @@ def count_items_old(json_input, root_key=None, row_limit=None):
 
 
 def count_items(json_input, root_key=None, is_array=False, row_limit=None):
-    with open(json_input, 'r', encoding='utf-8') as f:
+    if not root_key and is_json_lines(json_input):
+        # one object per line, so the lines just need counting, not parsing
+        with open_input_file(json_input) as f:
+            count = sum(1 for line in f if line.strip())
+        return count if row_limit is None else min(count, row_limit)
+
+    if root_key or is_array:
+        # an up to date offset index already knows how many objects there are
+        index = load_json_offset_index(json_input, root_key)
+        if index is not None:
+            return index.count if row_limit is None else min(index.count, row_limit)
+
+    with open_input_file(json_input) as f:
         if root_key:
             items = ijson.items(f, f"{root_key}.item")
         elif is_array:
@@ -176,24 +200,585 @@ def count_items(json_input, root_key=None, is_array=False, row_limit=None):
         return count
 
 
-def reformat_json(input_json: str = None):
+class ByteProgressReader:
+    """
+    Read-only wrapper around a binary file that advances a byte based tqdm bar as the parser consumes it.
+    """
+
+    def __init__(self, file_obj, pbar):
+        self.file_obj = file_obj
+        self.pbar = pbar
+
+    def read(self, size=-1):
+        data = self.file_obj.read(size)
+        self.pbar.update(len(data))
+        return data
+
+
+# read ahead of the parser by a PrefetchingReader, and the batches waiting in a ThreadedRowWriter
+PREFETCH_BLOCK_SIZE = 1024 * 1024
+PIPELINE_QUEUE_SIZE = 8
+
+
+class PrefetchingReader(io.RawIOBase):
+    """
+    Read-only wrapper around a binary file whose blocks are read ahead by a background thread, so waiting for the
+    disk (or decompressing, when file_obj is a decompressor) overlaps with parsing what was already read. At most
+    queue_size blocks wait in memory. The files in closing are closed along with the reader.
+    """
+
+    def __init__(self, file_obj, block_size=PREFETCH_BLOCK_SIZE, queue_size=PIPELINE_QUEUE_SIZE, closing=()):
+        super().__init__()
+        self.file_obj = file_obj
+        self.block_size = block_size
+        self.closing = closing
+        self._blocks = queue.Queue(maxsize=queue_size)
+        self._buffer = b''
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_ahead, daemon=True)
+        self._thread.start()
+
+    def readable(self):
+        return True
+
+    def _read_ahead(self):
+        try:
+            while not self._stop.is_set():
+                block = self.file_obj.read(self.block_size)
+                self._put(block)
+                if not block:
+                    return
+        except Exception as error:
+            self._put(error)
+
+    def _put(self, item):
+        # gives up once the reader is closed, a consumer that stopped early never takes the block
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _next_block(self):
+        if self._eof:
+            return b''
+        block = self._blocks.get()
+        if isinstance(block, Exception):
+            self._eof = True
+            raise block
+        if not block:
+            self._eof = True
+        return block
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self._buffer]
+            self._buffer = b''
+            for block in iter(self._next_block, b''):
+                chunks.append(block)
+            return b''.join(chunks)
+        if not self._buffer:
+            self._buffer = self._next_block()
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        parts = []
+        length = 0
+        while size is None or size < 0 or length < size:
+            if not self._buffer:
+                self._buffer = self._next_block()
+                if not self._buffer:
+                    break
+            end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+            if size is not None and size >= 0:
+                end = min(end, size - length)
+            parts.append(self._buffer[:end])
+            length += end
+            line_end = self._buffer[end - 1:end] == b'\n'
+            self._buffer = self._buffer[end:]
+            if line_end:
+                break
+        return b''.join(parts)
+
+    def __iter__(self):
+        # lines, like iterating over the file itself
+        parts = [self._buffer]
+        self._buffer = b''
+        for block in iter(self._next_block, b''):
+            parts.append(block)
+            if b'\n' in block:
+                *lines, last = b''.join(parts).split(b'\n')
+                for line in lines:
+                    yield line + b'\n'
+                parts = [last]
+        last = b''.join(parts)
+        if last:
+            yield last
+
+    def fileno(self):
+        return self.file_obj.fileno()
+
+    def close(self):
+        if self.closed:
+            return
+        self._stop.set()
+        self._thread.join()
+        for file_obj in self.closing:
+            file_obj.close()
+        super().close()
+
+
+# compressed inputs are recognized by their extension, or else by the magic bytes they start with
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.gzip': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zstd', '.zstd': 'zstd'}
+COMPRESSION_MAGIC = [(re.compile(rb'\x1f\x8b'), 'gzip'), (re.compile(rb'BZh[1-9]1AY&SY'), 'bz2'),
+                     (re.compile(rb'\xfd7zXZ\x00'), 'xz'), (re.compile(rb'\x28\xb5\x2f\xfd'), 'zstd')]
+
+
+def get_input_compression(path) -> Optional[str]:
+    """'gzip', 'bz2', 'xz' or 'zstd' if the file at path is compressed with it, None for a plain file."""
+    if not isinstance(path, (str, os.PathLike)):
+        return None
+    compression = COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if compression is None:
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(10)
+        except OSError:
+            return None
+        compression = next((name for magic, name in COMPRESSION_MAGIC if magic.match(head)), None)
+    return compression
+
+
+def strip_compression_ext(path: str) -> str:
+    # data.json.gz -> data.json, so the extension of the data itself can be looked at
+    base, ext = os.path.splitext(path)
+    return base if ext.lower() in COMPRESSION_EXTENSIONS else path
+
+
+def _open_decompressor(file_obj, compression):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file_obj, mode='rb')
+    elif compression == 'bz2':
+        return bz2.BZ2File(file_obj)
+    elif compression == 'xz':
+        return lzma.LZMAFile(file_obj)
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading zstd compressed input needs zstandard (pip install zstandard)")
+    return zstandard.ZstdDecompressor().stream_reader(file_obj, read_across_frames=True)
+
+
+def open_input_file(path, mode: str = 'rb', encoding: str = 'utf-8', newline=None, prefetch: bool = False,
+                    pbar=None):
+    """
+    Opens an input file for reading like open(), decompressing it on the fly if it is compressed with gzip, bz2, xz
+    or zstd (see get_input_compression).
+
+    Compressed files are decompressed on the background thread of a PrefetchingReader, so decompressing overlaps
+    with parsing; prefetch reads plain files ahead the same way. A compressed file advances pbar by the compressed
+    bytes read from disk (a plain file leaves the progress to the caller). Text modes decode with encoding.
+    """
+    compression = get_input_compression(path)
+    if compression is None:
+        if not prefetch:
+            return open(path, mode, encoding=None if 'b' in mode else encoding, newline=newline)
+        raw_file = open(path, 'rb')
+        stream = PrefetchingReader(raw_file, closing=(raw_file,))
+    else:
+        raw_file = open(path, 'rb')
+        decompressor = _open_decompressor(raw_file if pbar is None else ByteProgressReader(raw_file, pbar),
+                                          compression)
+        stream = PrefetchingReader(decompressor, closing=(decompressor, raw_file))
+    if 'b' in mode:
+        return stream
+    return io.TextIOWrapper(io.BufferedReader(stream), encoding=encoding, newline=newline)
+
+
+class BackgroundWriter(io.RawIOBase):
+    """
+    Write-only wrapper around a binary file whose writes are done by a background thread, so compressing (when
+    file_obj is a compressor) and waiting for the disk overlap with producing the next data. At most queue_size
+    writes wait in memory. The files in closing are closed along with the writer, an error of the thread is raised
+    by the next write or by close().
+    """
+
+    def __init__(self, file_obj, queue_size=PIPELINE_QUEUE_SIZE, closing=()):
+        super().__init__()
+        self.file_obj = file_obj
+        self.closing = closing
+        self._blocks = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def writable(self):
+        return True
+
+    def _drain(self):
+        for block in iter(self._blocks.get, None):
+            if self._error is not None:
+                continue  # keep taking blocks, so write never blocks on a full queue
+            try:
+                self.file_obj.write(block)
+            except Exception as error:
+                self._error = error
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        # the caller may reuse its buffer as soon as write returns
+        self._blocks.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._blocks.put(None)
+            self._thread.join()
+        finally:
+            try:
+                for file_obj in self.closing:
+                    file_obj.close()
+            finally:
+                super().close()
+        if self._error is not None:
+            raise self._error
+
+
+# compressed outputs get the extension of their compression added
+OUTPUT_COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+OUTPUT_WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def _open_compressor(file_obj, compression):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file_obj, mode='wb', compresslevel=6)
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Writing zstd compressed output needs zstandard (pip install zstandard)")
+    return zstandard.ZstdCompressor(level=3).stream_writer(file_obj)
+
+
+def get_output_path(path: str, compression: Optional[str] = None) -> str:
+    """path with the extension of compression ('gzip' or 'zstd') added, unless it already ends with it."""
+    if compression is None:
+        return path
+    if compression not in OUTPUT_COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unknown output compression '{compression}', expected 'gzip' or 'zstd'")
+    if COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1].lower()) == compression:
+        return path
+    return path + OUTPUT_COMPRESSION_EXTENSIONS[compression]
+
+
+def open_output_file(path, compression: Optional[str] = None, encoding: str = 'utf-8', newline='', buffering=-1):
+    """
+    Opens a text file for writing like open(path, 'w'), compressing it with gzip or zstd on the fly if compression
+    is given. Compressed files are compressed on the background thread of a BackgroundWriter, the text is encoded
+    and buffered on the calling thread. path is used as it is, see get_output_path for adding the extension.
+    """
+    if compression is None:
+        return open(path, 'w', buffering=buffering, encoding=encoding, newline=newline)
+    raw_file = open(path, 'wb')
+    try:
+        compressor = _open_compressor(raw_file, compression)
+    except Exception:
+        raw_file.close()
+        raise
+    stream = BackgroundWriter(compressor, closing=(compressor, raw_file))
+    buffer_size = buffering if buffering and buffering > 1 else OUTPUT_WRITE_BUFFER_SIZE
+    return io.TextIOWrapper(io.BufferedWriter(stream, buffer_size), encoding=encoding, newline=newline)
+
+
+class CsvOutputFile:
+    """
+    Text file for a CSV output that can be compressed (see open_output_file) and rolled over into numbered part
+    files. With max_rows or max_bytes, a new part is started once the current one holds that many rows or
+    (uncompressed) bytes; the parts are named <name>_part0001.csv, <name>_part0002.csv, ... and every part starts
+    with the header, the first line written. paths lists the files written, in order.
+
+    Rows are counted per write call ending a line, which is one record for the csv module writers and pandas.
+    """
+
+    def __init__(self, path, compression: Optional[str] = None, max_rows: Optional[int] = None,
+                 max_bytes: Optional[int] = None, buffering=-1):
+        self.path = path
+        self.compression = compression
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.buffering = buffering
+        self.split = bool(max_rows or max_bytes)
+        self.paths = []
+        self.closed = False
+        self._header = None
+        self._header_parts = []
+        self._line_start = True  # a record spread over several writes is kept together in one part
+        self._rows = 0
+        self._bytes = 0
+        self._file = self._open_part()
+        if not self.split:
+            self.write = self._file.write
+
+    @property
+    def name(self):
+        return self.paths[0]
+
+    def _open_part(self):
+        if self.split:
+            base, ext = os.path.splitext(strip_compression_ext(self.path))
+            path = f'{base}_part{len(self.paths) + 1:04d}{ext}'
+        else:
+            path = self.path
+        path = get_output_path(path, self.compression)
+        self.paths.append(path)
+        return open_output_file(path, self.compression, buffering=self.buffering)
+
+    def write(self, data):
+        if self._header is None:
+            self._header_parts.append(data)
+            if data.endswith('\n'):
+                self._header = ''.join(self._header_parts)
+                self._file.write(self._header)
+            return len(data)
+        if self._line_start and ((self.max_rows and self._rows >= self.max_rows) or
+                                 (self.max_bytes and self._bytes >= self.max_bytes)):
+            self._file.close()
+            self._file = self._open_part()
+            self._file.write(self._header)
+            self._rows = 0
+            self._bytes = 0
+        self._file.write(data)
+        self._bytes += len(data)
+        self._line_start = data.endswith('\n')
+        if self._line_start:
+            self._rows += 1
+        return len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._header is None and self._header_parts:
+            self._file.write(''.join(self._header_parts))
+        self._file.close()
+        if len(self.paths) > 1:
+            print(f'[+] Wrote {len(self.paths)} parts: {self.paths[0]} ... {self.paths[-1]}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+JSON_LINES_EXTENSIONS = ('.jsonl', '.ndjson')
+JSON_LINES_SNIFF_LIMIT = 16 * 1024 * 1024  # longest first line read when sniffing for JSON Lines
+
+
+def is_json_lines(input_json: str) -> bool:
+    """
+    True if the file is JSON Lines / NDJSON: a .jsonl/.ndjson extension, or a first line that is a complete
+    JSON value followed by more content (a plain JSON document can't have anything after its top level value).
+    """
+    if os.path.splitext(strip_compression_ext(input_json))[1].lower() in JSON_LINES_EXTENSIONS:
+        return True
+
+    with open_input_file(input_json) as f:
+        first_line = f.readline(JSON_LINES_SNIFF_LIMIT)
+        while first_line and not first_line.strip():
+            first_line = f.readline(JSON_LINES_SNIFF_LIMIT)
+        try:
+            orjson.loads(first_line)
+        except orjson.JSONDecodeError:
+            return False
+        for line in f:
+            if line.strip():
+                return True
+    return False
+
+
+def parse_json_line(line):
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        # orjson rejects a few things the json module takes, like NaN or out of range numbers
+        return json.loads(line)
+
+
+def iter_json_lines_items(file_obj, item_prefix: str = 'item', skip_items: int = 0, end: Optional[int] = None,
+                          pbar=None):
+    """
+    Yields the objects of a JSON Lines file the same way ijson.items would for item_prefix: every line for 'item',
+    or the elements of the array under "<root_key>" in every line for "<root_key>.item".
+
+    Lines are parsed one at a time with orjson. The first skip_items objects are left out, for 'item' without even
+    parsing their lines. If end is given, reading stops at that byte offset (file_obj must then be positioned at the
+    start of a line).
+    """
+    path = item_prefix.split('.')[:-1]
+    position = file_obj.tell() if end is not None else 0
+    pending_progress = 0
+    for line in file_obj:
+        if end is not None:
+            if position >= end:
+                break
+            position += len(line)
+        if pbar is not None:
+            pending_progress += len(line)
+            if pending_progress >= 1024 * 1024:
+                pbar.update(pending_progress)
+                pending_progress = 0
+        if not line.strip():
+            continue
+        if not path:
+            if skip_items:
+                skip_items -= 1
+                continue
+            yield parse_json_line(line)
+        else:
+            value = parse_json_line(line)
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if isinstance(value, list):
+                if skip_items:
+                    # the skipped objects can end part way through the array of a line
+                    skipped = min(skip_items, len(value))
+                    skip_items -= skipped
+                    value = value[skipped:]
+                yield from value
+    if pbar is not None:
+        pbar.update(pending_progress)
+
+
+def get_json_lines_shard_ranges(input_json: str, num_shards: int):
+    """
+    Splits a JSON Lines file into at most num_shards byte ranges (start, end) that start and end on line boundaries.
+    """
+    size = os.path.getsize(input_json)
+    boundaries = [0]
+    with open(input_json, 'rb') as f:
+        for shard in range(1, num_shards):
+            target = max(shard * size // num_shards, boundaries[-1])
+            f.seek(target)
+            if target > 0:
+                f.seek(target - 1)
+                f.readline()  # move on to the start of the next line
+            boundary = f.tell()
+            if boundary >= size:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def get_json_lines_end(input_json: str) -> int:
+    """
+    The byte offset after the last complete line of a JSON Lines file that may still be appended to. A last line
+    without a line break only counts if it already parses, otherwise it is taken to be still being written.
+    """
+    with open(input_json, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            block_start = max(0, position - PREFETCH_BLOCK_SIZE)
+            f.seek(block_start)
+            block = f.read(position - block_start)
+            line_break = block.rfind(b'\n')
+            if line_break >= 0:
+                last_line_start = block_start + line_break + 1
+                break
+            position = block_start
+        else:
+            last_line_start = 0
+        if last_line_start < end:
+            f.seek(last_line_start)
+            try:
+                orjson.loads(f.read())
+            except orjson.JSONDecodeError:
+                return last_line_start
+    return end
+
+
+@contextmanager
+def open_json_items(input_json: str, item_prefix: str, total_items: Optional[int] = None,
+                    desc: str = 'Processing objects', skip_items: int = 0, items_parser=None, prefetch: bool = False,
+                    start: int = 0, end: Optional[int] = None):
+    """
+    Opens a JSON file and yields an iterator over the objects found under item_prefix, with a progress bar.
+    JSON Lines files are read line by line with orjson instead of going through ijson.
+
+    If total_items is known (exact count mode) the progress bar counts objects. Otherwise it follows the
+    position in the file, so the input does not need a separate counting pass before the real one.
+    The first skip_items objects are left out (JSON Lines skips them without parsing).
+    items_parser replaces ijson.items for JSON input, called with the file and item_prefix.
+    With prefetch the file is read ahead on a background thread (see PrefetchingReader). Compressed files are
+    decompressed as they are read (see open_input_file), the progress bar then follows the compressed bytes.
+    The lines of a plain JSON Lines file can be limited to the byte range [start, end), start and end being the
+    starts of lines.
+    """
+    json_lines = is_json_lines(input_json)
+    if start or end is not None:
+        if not json_lines or get_input_compression(input_json) is not None:
+            raise ValueError(f"Only the lines of a plain JSON Lines file can be read from a byte range, "
+                             f"{input_json} is not one")
+        end = os.path.getsize(input_json) if end is None else end
+        with tqdm(total=end - start, desc=desc, unit='B', unit_scale=True, unit_divisor=1024, ncols=100) as pbar, \
+                open(input_json, 'rb') as f:
+            f.seek(start)
+            yield iter_json_lines_items(f, item_prefix, skip_items=skip_items, end=end, pbar=pbar)
+        return
+    items_parser = items_parser or ijson.items
+    if total_items is not None:
+        with open_input_file(input_json, prefetch=prefetch) as f:
+            if json_lines:
+                items = iter_json_lines_items(f, item_prefix, skip_items=skip_items)
+            else:
+                items = islice(items_parser(f, item_prefix), skip_items, None)
+            yield tqdm(items, total=total_items, desc=desc, unit=' objects', ncols=100)
+    else:
+        compressed = get_input_compression(input_json) is not None
+        with tqdm(total=os.path.getsize(input_json), desc=desc, unit='B', unit_scale=True, unit_divisor=1024,
+                  ncols=100) as pbar, \
+                open_input_file(input_json, prefetch=prefetch, pbar=pbar) as f:
+            if json_lines:
+                yield iter_json_lines_items(f, item_prefix, skip_items=skip_items, pbar=None if compressed else pbar)
+            else:
+                yield islice(items_parser(f if compressed else ByteProgressReader(f, pbar), item_prefix),
+                             skip_items, None)
+
+
+def reformat_json(input_json: str = None, exact_count: bool = False):
     # Set up the input and output file paths
-    output_path = "reformatted__" + os.path.basename(input_json)
+    # always a JSON array, also when the input is JSON Lines
+    output_path = "reformatted__" + os.path.splitext(os.path.basename(input_json))[0] + ".json"
 
-    # Count the total number of top-level objects in the input JSON file
-    total_objects = count_items(input_json)
+    # Only count the top-level objects up front if an exact progress bar was asked for
+    total_objects = count_items(input_json, is_array=True) if exact_count else None
 
     # Process the input JSON file and reformat it
-    with open(input_json, 'r', encoding='utf-8') as input_file, \
+    with open_json_items(input_json, 'item', total_objects) as parser, \
             open(output_path, 'w', encoding='utf-8') as output_file:
         output_file.write("[\n")
-        parser = ijson.items(input_file, 'item')
-        for index, obj in tqdm(enumerate(parser), total=total_objects, desc="Processing objects", unit=" objects",
-                               ncols=100):
-            formatted_obj = json.dumps(obj, ensure_ascii=False, indent=2, cls=CustomJSONEncoder)
-            output_file.write(formatted_obj)
-            if index < total_objects - 1:
+        for index, obj in enumerate(parser):
+            if index > 0:
                 output_file.write(",\n")
+            formatted_obj = dumps_json(obj, indent=True)
+            output_file.write(formatted_obj)
         output_file.write("\n]")
         return output_path
 
@@ -214,7 +799,7 @@ def truncate_json_inefficient_memory(input_json: str = None, root_key: str = Non
 
     truncated_data = []
 
-    with open(input_json, 'r', encoding='utf-8') as f:
+    with open_input_file(input_json) as f:
         parser = ijson.items(f, f"{root_key}.item" if root_key else 'item')
         input_json_basename = os.path.basename(input_json)
         filename_without_ext = os.path.splitext(input_json_basename)[0]
@@ -225,7 +810,7 @@ def truncate_json_inefficient_memory(input_json: str = None, root_key: str = Non
             truncated_data.append(truncated_obj)
 
     with open(json_output_filename, 'w+', newline='', encoding='utf-8') as json_output:
-        json.dump(truncated_data, json_output, ensure_ascii=False, indent=2, cls=CustomJSONEncoder)
+        dump_json(truncated_data, json_output)
 
     return json_output_filename
 
@@ -244,7 +829,7 @@ def truncate_jsonl(input_json: str = None, root_key: str = None, depth: int = 1)
 
     total_items = count_items(input_json, root_key)
 
-    with open(input_json, 'r', encoding='utf-8') as f:
+    with open_input_file(input_json) as f:
         parser = ijson.items(f, f"{root_key}.item" if root_key else 'item')
         input_json_basename = os.path.basename(input_json)
         filename_without_ext = os.path.splitext(input_json_basename)[0]
@@ -258,7 +843,7 @@ def truncate_jsonl(input_json: str = None, root_key: str = None, depth: int = 1)
     return json_output_filename
 
 
-def truncate_json(input_json: str = None, root_key: str = None, depth: int = 1):
+def truncate_json(input_json: str = None, root_key: str = None, depth: int = 1, exact_count: bool = False):
     def truncate(obj, current_depth):
         if current_depth > depth:
             return '{}' if isinstance(obj, dict) else '[]' if isinstance(obj, list) else str(obj)
@@ -270,10 +855,9 @@ def truncate_json(input_json: str = None, root_key: str = None, depth: int = 1):
         else:
             return obj
 
-    total_items = count_items(input_json, root_key)
+    total_items = count_items(input_json, root_key, is_array=True) if exact_count else None
 
-    with open(input_json, 'r', encoding='utf-8') as f:
-        parser = ijson.items(f, f"{root_key}.item" if root_key else 'item')
+    with open_json_items(input_json, f"{root_key}.item" if root_key else 'item', total_items) as parser:
         input_json_basename = os.path.basename(input_json)
         filename_without_ext = os.path.splitext(input_json_basename)[0]
         json_output_filename = f'truncated__{filename_without_ext}.json'
@@ -281,19 +865,19 @@ def truncate_json(input_json: str = None, root_key: str = None, depth: int = 1):
         with open(json_output_filename, 'w', newline='', encoding='utf-8') as json_output:
             json_output.write('[')
             first_item = True
-            for obj in tqdm(parser, total=total_items, desc='Processing objects', unit=' objects', ncols=100):
+            for obj in parser:
                 truncated_obj = truncate(obj, 1)
                 if first_item:
                     first_item = False
                 else:
                     json_output.write(',')
-                json.dump(truncated_obj, json_output, ensure_ascii=False, indent=2, cls=CustomJSONEncoder)
+                dump_json(truncated_obj, json_output)
             json_output.write(']')
 
     return json_output_filename
 
 
-def collapse_json(input_json: str = None, root_key: str = None, depth: int = 1):
+def collapse_json(input_json: str = None, root_key: str = None, depth: int = 1, exact_count: bool = False):
     def truncate_stats(obj, current_depth):
         if current_depth == depth:
             if isinstance(obj, dict):
@@ -311,18 +895,23 @@ def collapse_json(input_json: str = None, root_key: str = None, depth: int = 1):
     filename_without_ext = os.path.splitext(input_json_basename)[0]
     json_output_filename = f'collapse__{filename_without_ext}.json'
 
-    with open(input_json, 'r', encoding='utf-8') as f:
+    with open_input_file(input_json) as f:
         first_token = next(ijson.parse(f))
-        is_single_object = first_token[0] == "start_map"
-        f.seek(0)
+        # JSON Lines starts with a map too, but holds one object per line
+        is_single_object = first_token[0] == "start_map" and not is_json_lines(input_json)
 
-        if is_single_object:
-            parser = ijson.items(f, 'item')
-            total_items = count_items(input_json, root_key) if root_key else count_items(input_json)
-        else:
-            parser = ijson.items(f, f"{root_key}.item" if root_key else 'item')
-            total_items = count_items(input_json, root_key) if root_key else count_items(input_json)
+    if is_single_object:
+        item_prefix = 'item'
+    else:
+        item_prefix = f"{root_key}.item" if root_key else 'item'
+
+    # the number of items is part of the output at depth 0, otherwise it is only needed for an exact progress bar
+    if depth == 0 or exact_count:
+        total_items = count_items(input_json, root_key, is_array=not is_single_object)
+    else:
+        total_items = None
 
+    with open_json_items(input_json, item_prefix, total_items) as parser:
         with open(json_output_filename, 'w', newline='', encoding='utf-8') as json_output:
             if depth == 0:
                 if is_single_object:
@@ -338,18 +927,49 @@ def collapse_json(input_json: str = None, root_key: str = None, depth: int = 1):
 
             json_output.write('[')
             first_item = True
-            for obj in tqdm(parser, total=total_items, desc='Processing objects', unit=' objects', ncols=100):
+            for obj in parser:
                 truncated_obj = truncate_stats(obj, 1)
                 if first_item:
                     first_item = False
                 else:
                     json_output.write(',')
-                json.dump(truncated_obj, json_output, ensure_ascii=False, indent=2, cls=CustomJSONEncoder)
+                dump_json(truncated_obj, json_output)
             json_output.write(']')
 
     return json_output_filename
 
 
+# Key names repeat across millions of objects, so similarity scores and match decisions are cached (bounded)
+KEY_MATCH_CACHE_SIZE = 65536
+_worker_key_match_stats = [0, 0]  # hits and misses of the caches in worker processes
+
+
+@lru_cache(maxsize=KEY_MATCH_CACHE_SIZE)
+def key_similarity(search_key: str, key: str) -> float:
+    try:
+        return jaccard_index(search_key, key)
+    except Exception:  # jaccard_index raises for keys without 2-grams (like single characters), they aren't similar
+        return 0.0
+
+
+@lru_cache(maxsize=KEY_MATCH_CACHE_SIZE)
+def is_key_match(search_key: str, key: str, threshold: float) -> bool:
+    return key_similarity(search_key, key) >= threshold
+
+
+def get_key_match_cache_stats():
+    # (hits, misses) of the key similarity / match caches, including what worker processes reported back
+    similarity_info = key_similarity.cache_info()
+    matches_info = is_key_match.cache_info()
+    return (similarity_info.hits + matches_info.hits + _worker_key_match_stats[0],
+            similarity_info.misses + matches_info.misses + _worker_key_match_stats[1])
+
+
+def add_key_match_cache_stats(hits: int, misses: int):
+    _worker_key_match_stats[0] += hits
+    _worker_key_match_stats[1] += misses
+
+
 def dot_notation_match(search_key, path):
     if search_key == path:
         return True
@@ -424,7 +1044,7 @@ def get_datetime():
 
 
 def find_root_key_old(input_json: str):
-    with open(input_json, 'r', encoding='utf-8') as f:
+    with open_input_file(input_json) as f:
         parser = ijson.parse(f)
 
         for prefix, event, value in parser:
@@ -436,7 +1056,11 @@ def find_root_key_old(input_json: str):
 
 
 def find_root_key(input_json: str, root_key=None):
-    with open(input_json, 'r', encoding='utf-8') as f:
+    # JSON Lines is read like a top level array with one object per line
+    if is_json_lines(input_json):
+        return (True, None)
+
+    with open_input_file(input_json) as f:
         parser = ijson.parse(f)
         is_array = False
         for prefix, event, value in parser:
@@ -467,7 +1091,7 @@ def create_temp_array_wrapped_json(input_json: str, return_basename: bool = Fals
     # Create a temporary folder in the current directory
     temp_folder = "temp"
     if not os.path.exists(temp_folder):
-        os.makedirs(temp_folder)
+        os.makedirs(temp_folder, exist_ok=True)
 
     with open(input_json, 'r', encoding='utf-8') as original_file:
         # Use the temporary folder for the NamedTemporaryFile
@@ -484,12 +1108,65 @@ def create_temp_array_wrapped_json(input_json: str, return_basename: bool = Fals
         return temp_file_path
 
 
+class ColumnRegistry:
+    """
+    Stable integer ids for the columns (flattened paths) of an output, numbered in the order they first show up.
+    Writers keep rows as column ids and find new columns by comparing ids instead of diffing sets of names.
+    """
+
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        self.add(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, names):
+        for name in names:
+            if name not in self.ids:
+                self.ids[name] = len(self.names)
+                self.names.append(name)
+
+    def ids_of(self, row):
+        # the column ids of the keys of row; new keys are numbered in sorted order, like DynamicDictWriter adds them
+        try:
+            return tuple(map(self.ids.__getitem__, row))
+        except KeyError:
+            self.add(sorted(key for key in row if key not in self.ids))
+            return tuple(map(self.ids.__getitem__, row))
+
+
+def estimate_row_bytes(values):
+    # cheap size estimate of a row's values for byte bounded batches, strings by length and anything else as 8
+    return sum(len(value) if type(value) is str else 8 for value in values)
+
+
+def get_csv_dialect(delimiter=None, dialect='excel', quoting=csv.QUOTE_NONE, escapechar='\\'):
+    """
+    The dialect a writer writes (and reads back) its CSV with: dialect, or with a delimiter one of its own with that
+    delimiter, quoting and escapechar. A dialect registered by name would be shared by every writer open at the time.
+    """
+    if not delimiter:
+        return dialect
+    return type('CustomDialect', (csv.excel,), {'delimiter': delimiter, 'quoting': quoting, 'escapechar': escapechar})
+
+
 class DynamicDictWriter:  # TODO finish smart functions
+    """
+    Dict writer that rewrites the header of the CSV when a row brings new columns.
+
+    Rows are collected into batches of batch_size rows (or batch_bytes estimated bytes) and written together with
+    writerows as plain lists, the batch is flushed when it is full and by close().
+    """
+
     def __init__(self, csvfile, fieldnames, delimiter=None, dialect='excel', quoting=csv.QUOTE_NONE, escapechar='\\',
-                 smart_header_padding_amount=100000):
+                 smart_header_padding_amount=100000, batch_size=1000, batch_bytes=None):
         self.headers_written = False
-        self.fieldnames = list(fieldnames)  # Ensure fieldnames is a list
+        self.columns = ColumnRegistry(fieldnames)
+        self.fieldnames = self.columns.names  # grows with the registry
         self.csvfile = csvfile
+        self.original_csvfile = csvfile
         self.delimiter = delimiter
         self.smart_header_padding_amount = smart_header_padding_amount
         self.smart_header_present = False
@@ -497,21 +1174,20 @@ class DynamicDictWriter:  # TODO finish smart functions
         self.padding_length = 0
         self.previous_header_length = 0
         self.remaining_padding = 0
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self._batch = []
+        self._batch_bytes = 0
 
         # Create a temporary folder in the current directory
         self.temp_folder = "temp"
         if not os.path.exists(self.temp_folder):
-            os.makedirs(self.temp_folder)
+            os.makedirs(self.temp_folder, exist_ok=True)
 
-        if delimiter:
-            # Register a new dialect with the specified delimiter
-            csv.register_dialect('custom_dialect', delimiter=delimiter,
-                                 quoting=quoting, escapechar=escapechar)
-            self.dialect = 'custom_dialect'
-        else:
-            self.dialect = dialect
+        self.dialect = get_csv_dialect(delimiter, dialect, quoting, escapechar)
 
         self.writer = csv.DictWriter(csvfile, fieldnames=fieldnames, dialect=self.dialect)
+        self.list_writer = csv.writer(csvfile, dialect=self.dialect)
         self.headers_written = True
 
     def writeheader(self):
@@ -520,13 +1196,48 @@ class DynamicDictWriter:  # TODO finish smart functions
             self.headers_written = True
 
     def writerow(self, row):
-        new_fields = set(row.keys()) - set(self.fieldnames)
-        new_fields_sorted = sorted(new_fields)
-        if new_fields:
-            self.fieldnames += new_fields_sorted
+        known_columns = len(self.columns)
+        self.columns.ids_of(row)
+        if len(self.columns) > known_columns:  # the row got new column ids
+            # batched rows are written after the rewrite, padded out to the new header
             self.update_header()
             self.update_writer()
-        self.writer.writerow(row)
+        self._batch.append(row)
+        if self.batch_bytes:
+            self._batch_bytes += estimate_row_bytes(row.values())
+            if self._batch_bytes >= self.batch_bytes:
+                self.flush()
+                return
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        # every key of a batched row is a known column, so the rows map straight onto the header
+        if self._batch:
+            fieldnames = self.fieldnames
+            self.list_writer.writerows([[row.get(name) for name in fieldnames] for row in self._batch])
+            self._batch = []
+            self._batch_bytes = 0
+
+    def checkpoint(self):
+        """
+        Writes the batched rows through to the file and returns the header and size of the CSV so far, which
+        resume_from can go back to.
+        """
+        self.flush()
+        self.csvfile.flush()
+        return {'fieldnames': list(self.fieldnames), 'size': self.csvfile.seek(0, os.SEEK_END)}
+
+    def resume_from(self, state):
+        # csvfile is the CSV a checkpoint() was taken of, opened for reading and writing
+        self.csvfile.seek(state['size'])
+        self.csvfile.truncate()
+        self.columns.add(state['fieldnames'])
+        self.update_writer()
 
     def update_header(self):
         # Read the current header row from the file up to the newline character
@@ -576,10 +1287,10 @@ class DynamicDictWriter:  # TODO finish smart functions
         self.update_writer()
 
     def smart_writerow(self, row):
-        new_fields = set(row.keys()) - set(self.fieldnames)
-        new_fields_sorted = sorted(new_fields)
-        if new_fields:
-            self.fieldnames += new_fields_sorted
+        self.flush()
+        known_columns = len(self.columns)
+        self.columns.ids_of(row)
+        if len(self.columns) > known_columns:
             self.smart_update_header()
             self.update_writer()
         self.writer.writerow(row)
@@ -656,7 +1367,7 @@ class DynamicDictWriter:  # TODO finish smart functions
 
             temp_folder = "temp"
             if not os.path.exists(temp_folder):
-                os.makedirs(temp_folder)
+                os.makedirs(temp_folder, exist_ok=True)
 
             with tempfile.NamedTemporaryFile(mode='w+', delete=False, dir=temp_folder, newline='',
                                              encoding='utf-8') as temp_file:
@@ -676,32 +1387,507 @@ class DynamicDictWriter:  # TODO finish smart functions
 
     def update_writer(self):
         self.writer = csv.DictWriter(self.csvfile, self.fieldnames, dialect=self.dialect)
+        self.list_writer = csv.writer(self.csvfile, dialect=self.dialect)
         if not self.headers_written:
             self.writer.writeheader()
 
+    def close(self):
+        self.flush()
+        # update_header re-opens the output file, so the handle we hold may not be the caller's
+        self.csvfile.flush()
+        if self.csvfile is not self.original_csvfile:
+            self.csvfile.close()
+
+
+class DeferredHeaderDictWriter:
+    """
+    Dict writer for rows whose columns are only known once every row has been seen.
+
+    Rows are spilled to a temporary file as (column ids, values) pairs instead of being written to the CSV
+    directly, so a new column never forces a rewrite of the output. close() writes the final header exactly
+    once and then streams the spilled rows into the CSV, padded out to the full header.
+    """
+
+    def __init__(self, csvfile, fieldnames=(), delimiter=None, dialect='excel', quoting=csv.QUOTE_NONE,
+                 escapechar='\\', spill_batch_size=1000, spill_file=None, spill_batch_bytes=None):
+        self.csvfile = csvfile
+        self.columns = ColumnRegistry(fieldnames)
+        self.fieldnames = self.columns.names
+        self.column_ids = self.columns.ids
+        self.delimiter = delimiter
+        self.spill_batch_size = spill_batch_size
+        self.spill_batch_bytes = spill_batch_bytes
+        self.rows_written = 0
+        self.closed = False
+        self._batch = []
+        self._batch_bytes = 0
+
+        # Create a temporary folder in the current directory
+        self.temp_folder = "temp"
+        if not os.path.exists(self.temp_folder):
+            os.makedirs(self.temp_folder, exist_ok=True)
+        # a caller provided spill file lets the spilled rows outlive the writer (e.g. one per worker process)
+        self.spill_file = spill_file or tempfile.TemporaryFile(mode='w+b', dir=self.temp_folder)
+
+        self.dialect = get_csv_dialect(delimiter, dialect, quoting, escapechar)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_columns(self, names):
+        self.columns.add(names)
+
+    def writeheader(self):
+        pass  # the header is written by close()
+
+    def writerow(self, row):
+        # same column order as DynamicDictWriter: new fields of a row are appended sorted
+        values = tuple(row.values())
+        self._batch.append((self.columns.ids_of(row), values))
+        self.rows_written += 1
+        if self.spill_batch_bytes:
+            self._batch_bytes += estimate_row_bytes(values)
+            if self._batch_bytes >= self.spill_batch_bytes:
+                self._spill()
+                return
+        if len(self._batch) >= self.spill_batch_size:
+            self._spill()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def _spill(self):
+        if self._batch:
+            pickle.dump(self._batch, self.spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+            self._batch = []
+            self._batch_bytes = 0
+
+    def iter_spilled_rows(self):
+        self._spill()
+        self.spill_file.seek(0)
+        return iter_pickled_batches(self.spill_file)
+
+    def checkpoint(self):
+        """
+        Spills the batched rows and returns the columns and size of the spill file so far, which resume_from can go
+        back to when the spill file outlives the writer (see spill_file).
+        """
+        self._spill()
+        self.spill_file.flush()
+        return {'fieldnames': list(self.fieldnames), 'rows_written': self.rows_written,
+                'size': self.spill_file.tell()}
+
+    def resume_from(self, state):
+        # spill_file is the one a checkpoint() was taken of, the rows spilled after it are dropped
+        self.spill_file.seek(state['size'])
+        self.spill_file.truncate()
+        self.add_columns(state['fieldnames'])
+        self.rows_written = state['rows_written']
+
+    def finish_spill(self):
+        """
+        Spills the remaining rows without writing any CSV and returns the fieldnames the spilled column ids refer to.
+        The spill file is left open for its owner, who can merge it into another writer with write_spilled_rows().
+        """
+        self._spill()
+        self.spill_file.flush()
+        self.closed = True
+        return self.fieldnames
+
+    def write_spilled_rows(self, fieldnames, batches):
+        """
+        Adds rows spilled by another writer (see finish_spill) as if they had been passed to writerow in order,
+        so the columns end up in the same order as if this writer had seen the rows itself.
+        """
+        id_map = []  # column id in the other writer -> column id in this one
+        rows_written = 0
+        for batch in batches:
+            for ids, values in batch:
+                if ids and max(ids) >= len(id_map):
+                    # the row introduced new columns in the other writer, those are already sorted
+                    new_names = fieldnames[len(id_map):max(ids) + 1]
+                    self.add_columns(new_names)
+                    id_map.extend(map(self.column_ids.__getitem__, new_names))
+                self._batch.append((tuple(map(id_map.__getitem__, ids)), values))
+                rows_written += 1
+            if len(self._batch) >= self.spill_batch_size:
+                self._spill()
+        self.rows_written += rows_written
+        return rows_written
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        # rows without a value for any column (a search that matched nothing) leave the CSV empty
+        if self.fieldnames:
+            writer = csv.writer(self.csvfile, dialect=self.dialect)
+            writer.writerow(self.fieldnames)
+            self._write_rows(writer)
+            self.csvfile.flush()
+
+        self.spill_file.close()
+
+    def _write_rows(self, writer):
+        # the spilled rows, padded out to the full header
+        width = len(self.fieldnames)
+        for batch in self.iter_spilled_rows():
+            rows = []
+            for ids, values in batch:
+                row = [None] * width
+                for column_id, value in zip(ids, values):
+                    row[column_id] = value
+                rows.append(row)
+            writer.writerows(rows)
+
+
+class AppendingDictWriter(DeferredHeaderDictWriter):
+    """
+    DeferredHeaderDictWriter that adds its rows to the end of the existing CSV at path instead of writing a new one.
+
+    The rows of the CSV are taken to end data_size bytes after its header line, anything after that (left by an
+    interrupted run) is cut off. Without new columns the rows are simply appended. New columns come after the ones
+    of the existing header, and close() then has to write the CSV again under the new header: the rows already in
+    it are copied as they are, padded with empty values for the new columns.
+    """
+
+    def __init__(self, path, data_size, delimiter=None, dialect='excel', quoting=csv.QUOTE_NONE, escapechar='\\',
+                 spill_batch_size=1000, spill_batch_bytes=None, spill_file=None):
+        super().__init__(None, delimiter=delimiter, dialect=dialect, quoting=quoting, escapechar=escapechar,
+                         spill_batch_size=spill_batch_size, spill_batch_bytes=spill_batch_bytes,
+                         spill_file=spill_file)
+        self.path = path
+        self.data_size = data_size
+        with open(path, 'rb') as f:
+            self.header_line = f.readline()
+        self.header = next(csv.reader([self.header_line.decode('utf-8')], dialect=self.dialect), [])
+        self.add_columns(self.header)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        with open(self.path, 'r+b') as f:
+            f.truncate(len(self.header_line) + self.data_size)
+        if len(self.fieldnames) > len(self.header):
+            # a copy of the CSV under the new header, swapped in once it is complete
+            with tempfile.NamedTemporaryFile(mode='w', dir=os.path.dirname(os.path.abspath(self.path)),
+                                             suffix='.csv', delete=False, newline='', encoding='utf-8') as csvfile:
+                writer = csv.writer(csvfile, dialect=self.dialect)
+                writer.writerow(self.fieldnames)
+                self._copy_padded_rows(csvfile)
+                self._write_rows(writer)
+            shutil.copymode(self.path, csvfile.name)
+            os.replace(csvfile.name, self.path)
+        elif self.rows_written and self.fieldnames:
+            with open(self.path, 'a', newline='', encoding='utf-8') as csvfile:
+                self._write_rows(csv.writer(csvfile, dialect=self.dialect))
+
+        self.spill_file.close()
+
+    def _copy_padded_rows(self, csvfile):
+        # the text of every row of the old CSV is kept, only the empty values of the new columns are added to its end
+        record_lines = []
+
+        def read_lines():
+            for line in old_file:
+                record_lines.append(line)
+                yield line
+
+        paddings = {}
+        with open(self.path, 'r', newline='', encoding='utf-8') as old_file:
+            old_file.readline()  # the old header
+            for row in csv.reader(read_lines(), dialect=self.dialect):
+                record = ''.join(record_lines)
+                record_lines.clear()
+                missing = len(self.fieldnames) - len(row)
+                if row and missing > 0:
+                    if missing not in paddings:
+                        paddings[missing] = self._get_padding(missing)
+                    end = len(record) - (2 if record.endswith('\r\n') else 1 if record.endswith(('\n', '\r')) else 0)
+                    record = record[:end] + paddings[missing] + record[end:]
+                csvfile.write(record)
+
+    def _get_padding(self, missing):
+        # what the writer puts after a value for missing empty values, e.g. ',,' or ',"",""'
+        encoded = io.StringIO()
+        writer = csv.writer(encoded, dialect=self.dialect, lineterminator='\n')
+        writer.writerow(['x'])
+        value_length = encoded.tell() - 1
+        writer.writerow(['x'] + [None] * missing)
+        return encoded.getvalue()[2 * value_length + 1:-1]
+
+
+class ParquetDictWriter(DeferredHeaderDictWriter):
+    """
+    DeferredHeaderDictWriter that writes a Parquet file instead of a CSV.
+
+    The schema widens as new columns show up: rows are spilled like for a CSV, and close() writes them in row
+    groups of row_group_size rows with the final schema, null where a row has no value. A column holding only ints
+    (or numbers, or bools) gets that type, anything else becomes a dictionary encoded string column, which keeps
+    mostly repeated values small.
+    """
+
+    def __init__(self, path, fieldnames=(), row_group_size=100000, spill_batch_size=1000, spill_batch_bytes=None,
+                 spill_file=None):
+        super().__init__(None, fieldnames=fieldnames, spill_batch_size=spill_batch_size,
+                         spill_batch_bytes=spill_batch_bytes, spill_file=spill_file)
+        self.path = path
+        self.row_group_size = row_group_size
+
+    def _get_schema(self):
+        import pyarrow as pa
+
+        # one pass over the spilled rows for the types of the values of every column
+        column_types = [set() for _ in self.fieldnames]
+        for batch in self.iter_spilled_rows():
+            for ids, values in batch:
+                for column_id, value in zip(ids, values):
+                    if value is not None:
+                        # ints that don't fit an int64 are kept as strings
+                        column_types[column_id].add(
+                            str if type(value) is int and not -2 ** 63 <= value < 2 ** 63 else type(value))
+        fields = []
+        for name, types in zip(self.fieldnames, column_types):
+            if types and types <= {int}:
+                fields.append(pa.field(name, pa.int64()))
+            elif types and types <= {int, float, Decimal}:
+                fields.append(pa.field(name, pa.float64()))
+            elif types and types <= {bool}:
+                fields.append(pa.field(name, pa.bool_()))
+            else:
+                fields.append(pa.field(name, pa.string()))
+        return pa.schema(fields)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow)")
+
+        schema = self._get_schema()
+        converters = [float if field.type == pa.float64() else str if field.type == pa.string() else None
+                      for field in schema]
+        with pq.ParquetWriter(self.path, schema, use_dictionary=[field.name for field in schema
+                                                                 if field.type == pa.string()]) as writer:
+            columns = [[] for _ in schema]
+            size = 0
+            for batch in self.iter_spilled_rows():
+                for ids, values in batch:
+                    for column in columns:
+                        column.append(None)
+                    for column_id, value in zip(ids, values):
+                        convert = converters[column_id]
+                        columns[column_id][-1] = value if convert is None or value is None else convert(value)
+                    size += 1
+                    if size >= self.row_group_size:
+                        writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+                        columns = [[] for _ in schema]
+                        size = 0
+            if size or not self.rows_written:
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+        self.spill_file.close()
+
+
+# read_csv options read_csv_or_parquet takes for Parquet files too, and the ones that mean nothing for them
+PARQUET_READ_CSV_OPTIONS = {'usecols', 'nrows', 'chunksize', 'dtype'}
+PARQUET_IGNORED_READ_CSV_OPTIONS = {'iterator', 'low_memory', 'encoding', 'compression'}
+
+
+def read_csv_or_parquet(filepath_or_buffer, *args, **kwargs):
+    """
+    pd.read_csv that also reads the Parquet files written with output_format='parquet'. For those only the usecols
+    columns are read, chunksize streams them in DataFrames of that many rows, nrows stops early and dtype converts
+    the columns with astype. Other read_csv options would change what is read, they raise a ValueError.
+    """
+    if not (isinstance(filepath_or_buffer, (str, os.PathLike)) and
+            os.fspath(filepath_or_buffer).lower().endswith('.parquet')):
+        if 'compression' not in kwargs:
+            # pandas only goes by the extension, this also finds compressed files by their magic bytes
+            kwargs['compression'] = get_input_compression(filepath_or_buffer) or 'infer'
+        return pd.read_csv(filepath_or_buffer, *args, **kwargs)
+
+    unsupported = sorted(set(kwargs) - PARQUET_READ_CSV_OPTIONS - PARQUET_IGNORED_READ_CSV_OPTIONS)
+    if args or unsupported:
+        raise ValueError(f"The read_csv options {unsupported or 'passed by position'} don't apply to the Parquet "
+                         f"file {filepath_or_buffer}, it is read with {sorted(PARQUET_READ_CSV_OPTIONS)} only")
+    if callable(kwargs.get('usecols')):
+        raise ValueError(f"usecols has to list the columns to read of the Parquet file {filepath_or_buffer}")
+
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(filepath_or_buffer)
+    columns = list(kwargs['usecols']) if kwargs.get('usecols') is not None else None
+    nrows = kwargs.get('nrows')
+    chunksize = kwargs.get('chunksize')
+    dtype = kwargs.get('dtype')
+
+    def to_pandas(table):
+        df = table.to_pandas()
+        if isinstance(dtype, dict):
+            return df.astype({column: column_type for column, column_type in dtype.items() if column in df.columns})
+        return df if dtype is None else df.astype(dtype)
+
+    def iter_chunks(batch_size):
+        remaining = nrows
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            chunk = to_pandas(batch)
+            if remaining is not None:
+                chunk = chunk.iloc[:remaining]
+                remaining -= len(chunk)
+            yield chunk
+            if remaining is not None and remaining <= 0:
+                break
+
+    if chunksize:
+        return iter_chunks(chunksize)
+    if nrows is not None:
+        chunks = list(iter_chunks(max(nrows, 1)))
+        if chunks:
+            return pd.concat(chunks, ignore_index=True)
+        empty = parquet_file.schema_arrow.empty_table()
+        return to_pandas(empty.select(columns) if columns else empty)
+    return to_pandas(parquet_file.read(columns=columns))
+
+
+def iter_pickled_batches(file_obj):
+    # reads back the batches pickled one after another into a spill file
+    while True:
+        try:
+            batch = pickle.load(file_obj)
+        except EOFError:
+            break
+        yield batch
+
+
+class ThreadedRowWriter:
+    """
+    Passes the rows given to writerow on to another dict writer from a background thread, in batches of batch_size
+    rows, so encoding and writing them overlaps with flattening the next ones. At most queue_size batches wait in
+    memory. close() waits for the thread to write everything and then closes the wrapped writer.
+    """
+
+    def __init__(self, writer, batch_size=1000, queue_size=PIPELINE_QUEUE_SIZE):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.closed = False
+        self._batch = []
+        self._batches = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    @property
+    def fieldnames(self):
+        return self.writer.fieldnames
+
+    def _drain(self):
+        while True:
+            batch = self._batches.get()
+            try:
+                if batch is None:
+                    return
+                if self._error is None:  # else keep taking batches, so writerow never blocks on a full queue
+                    self.writer.writerows(batch)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._batches.task_done()
+
+    def _put_batch(self):
+        if self._error is not None:
+            raise self._error
+        if self._batch:
+            self._batches.put(self._batch)
+            self._batch = []
+
+    def writeheader(self):
+        pass  # the wrapped writer writes its header itself
+
+    def writerow(self, row):
+        self._batch.append(row)
+        if len(self._batch) >= self.batch_size:
+            self._put_batch()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def checkpoint(self):
+        # waits for the thread to write every row given so far, then checkpoints the wrapped writer
+        self._put_batch()
+        self._batches.join()
+        if self._error is not None:
+            raise self._error
+        return self.writer.checkpoint()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._put_batch()
+        finally:
+            self._batches.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+        self.writer.close()
+
+
+def get_dynamic_dict_writer(csvfile, fieldnames=(), header_mode='deferred', delimiter=None, dialect='excel',
+                            quoting=csv.QUOTE_NONE, escapechar='\\', batch_rows=1000, batch_bytes=None,
+                            spill_file=None):
+    """
+    Returns the dict writer used for outputs whose columns grow while rows are written.
+
+    header_mode:
+        'deferred' - DeferredHeaderDictWriter, the header is written once when the writer is closed
+        'rewrite'  - DynamicDictWriter, the file is rewritten every time a new column shows up
+
+    Rows are written in batches of batch_rows rows, or sooner once a batch holds about batch_bytes bytes.
+    spill_file is the file a 'deferred' writer spills its rows to instead of a temporary one.
+    """
+    if header_mode == 'deferred':
+        return DeferredHeaderDictWriter(csvfile, fieldnames=fieldnames, delimiter=delimiter, dialect=dialect,
+                                        quoting=quoting, escapechar=escapechar, spill_batch_size=batch_rows,
+                                        spill_batch_bytes=batch_bytes, spill_file=spill_file)
+    elif header_mode == 'rewrite':
+        return DynamicDictWriter(csvfile, fieldnames=fieldnames, delimiter=delimiter, dialect=dialect,
+                                 quoting=quoting, escapechar=escapechar, batch_size=batch_rows,
+                                 batch_bytes=batch_bytes)
+    raise ValueError(f"Unknown header_mode '{header_mode}', expected 'deferred' or 'rewrite'")
+
 
 class DynamicHeaderWriter(csv.DictWriter):
     def __init__(self, csvfile, fieldnames, delimiter=None, dialect='excel'):
         self.headers_written = False
-        self.fieldnames = list(fieldnames)  # Ensure fieldnames is a list
+        self.columns = ColumnRegistry(fieldnames)
+        self.fieldnames = self.columns.names  # grows with the registry
         self.csvfile = csvfile
         self.delimiter = delimiter
 
-        if delimiter:
-            # Register a new dialect with the specified delimiter
-            csv.register_dialect('custom_dialect', delimiter=delimiter)
-            self.dialect = 'custom_dialect'
-        else:
-            self.dialect = dialect
+        self.dialect = get_csv_dialect(delimiter, dialect, csv.QUOTE_MINIMAL, None)
 
         self.writer = csv.DictWriter(csvfile, fieldnames=fieldnames, dialect=self.dialect)
         self.headers_written = True
 
     def process_row(self, row):
-        new_fields = set(row.keys()) - set(self.fieldnames)
-        new_fields_sorted = sorted(new_fields)
-        if new_fields:
-            self.fieldnames += new_fields_sorted
+        known_columns = len(self.columns)
+        self.columns.ids_of(row)
+        if len(self.columns) > known_columns:
             self.update_header()
 
     def update_header(self):
@@ -734,29 +1920,40 @@ class DynamicHeaderWriter(csv.DictWriter):
         self.writer = csv.DictWriter(self.csvfile, self.fieldnames, dialect=self.dialect)
 
 
-def trim_json(input_json: Union[str, Dict], root_key: Optional[str] = None, range_str: Optional[str] = None):
+def trim_json(input_json: Union[str, Dict], root_key: Optional[str] = None, range_str: Optional[str] = None,
+              exact_count: bool = False):
     if range_str:
+        # objects before the range are skipped and parsing stops at its end, so the progress bar sees the range
         start, end = map(int, range_str.split('-'))
-        total_items = count_items(input_json, root_key, end)
+        total_items = end - start
     else:
-        total_items = count_items(input_json, root_key)
-        start, end = 0, total_items
+        start, end = 0, None
+        total_items = count_items(input_json, root_key, is_array=True) if exact_count else None
 
-    with open(input_json, 'r', encoding='utf-8') as f:
-        parser = ijson.items(f, f"{root_key}.item" if root_key else 'item')
+    index = load_json_offset_index(input_json, root_key)
+    if index is not None:
+        # the offset index knows where each object starts, so only the requested range gets parsed
+        items_context = index.open_items(start, end)
+    else:
+        items_context = open_json_items(input_json, f"{root_key}.item" if root_key else 'item', total_items,
+                                        skip_items=start)
+
+    with items_context as parser:
         datetime = str(get_datetime())
-        json_output_filename = 'trimmed_json__' + root_key + '_' + datetime + ".json"
+        if root_key:
+            json_output_filename = 'trimmed_json__' + root_key + '_' + datetime + ".json"
+        else:
+            json_output_filename = 'trimmed_json__' + datetime + ".json"
 
         with open(json_output_filename, 'w+', newline='', encoding='utf-8') as json_output:
             json_output.write("[\n")
-            for idx, obj in enumerate(
-                    tqdm(parser, total=total_items, desc='Processing objects', unit=' objects', ncols=100)):
-                if start <= idx < end:
-                    json.dump(obj, json_output, ensure_ascii=False, indent=2, cls=CustomJSONEncoder)
-                    if idx < end - 1:
-                        json_output.write(",\n")
-                elif idx >= end:
+            for idx, obj in enumerate(parser, start):
+                if end is not None and idx >= end:
                     break
+                if idx >= start:
+                    if idx > start:
+                        json_output.write(",\n")
+                    dump_json(obj, json_output)
             json_output.write("\n]")
 
 
@@ -778,7 +1975,7 @@ def bulk_rename_csv_headers(input_csv: str, rename_obj: dict, threshold: float =
                 best_match = col
                 if threshold is not None:
                     for old_name in rename_obj:
-                        similarity = jaccard_index(col, old_name)
+                        similarity = key_similarity(old_name, col)
                         if similarity > max_similarity and similarity >= threshold:
                             max_similarity = similarity
                             best_match = rename_obj[old_name]
@@ -799,7 +1996,7 @@ def bulk_rename_csv_headers(input_csv: str, rename_obj: dict, threshold: float =
             # Create a temporary folder in the current directory
             temp_folder = "temp"
             if not os.path.exists(temp_folder):
-                os.makedirs(temp_folder)
+                os.makedirs(temp_folder, exist_ok=True)
 
             # Use the temporary folder for the NamedTemporaryFile
             with tempfile.NamedTemporaryFile(mode='w+', delete=False, dir=temp_folder, newline='',
@@ -845,7 +2042,7 @@ def gen_bulk_rename_csv_headers(input_csv: str, rename_obj: dict, threshold: flo
                 best_match = col
                 if threshold is not None:
                     for old_name in rename_obj:
-                        similarity = jaccard_index(col, old_name)
+                        similarity = key_similarity(old_name, col)
                         if similarity > max_similarity and similarity >= threshold:
                             max_similarity = similarity
                             best_match = rename_obj[old_name]
@@ -867,27 +2064,41 @@ def gen_bulk_rename_csv_headers(input_csv: str, rename_obj: dict, threshold: flo
 
 
 def escape_csv_string(s, line_break_handling='escape', quote_handling='double', quote_values=False):
-    # try:
-    if line_break_handling == 'escape':
-        s = s.replace('\r\n', '\\r\\n').replace('\n', '\\n').replace('\r', '\\r')
-    elif line_break_handling == 'remove':
-        s = s.replace('\r\n', '').replace('\n', '').replace('\r', '')
+    return get_csv_string_escaper(line_break_handling, quote_handling, quote_values)(s)
 
-    '''
-    except Exception as e:
-        print(f'String: {s}')
-        print(f"An error occurred: {e}")
-    '''
 
+@lru_cache(maxsize=None)
+def get_csv_string_escaper(line_break_handling='escape', quote_handling='double', quote_values=False):
+    """
+    Returns escape_csv_string for one set of options, as a function of the string alone, so the options are looked
+    at once per job instead of once per value. Most values have no line break or quote at all: they are found with
+    the `in` checks and returned without any replace. The others only get the replaces the options ask for ('\\r\\n'
+    needs none of its own, escaping '\\n' and then '\\r' gives the same result).
+    """
+    replacements = []
+    if line_break_handling == 'escape':
+        replacements += [('\n', '\\n'), ('\r', '\\r')]
+    elif line_break_handling == 'remove':
+        replacements += [('\n', ''), ('\r', '')]
     if quote_handling == 'double':
-        s = s.replace('"', '""')
+        replacements.append(('"', '""'))
     elif quote_handling == 'escape':
-        s = s.replace('"', '\\"')
+        replacements.append(('"', '\\"'))
+    replacements = tuple(replacements)
 
     if quote_values:
-        s = f'"{s}"'
-
-    return s
+        def escape(s):
+            if '"' in s or '\n' in s or '\r' in s:
+                for char, replacement in replacements:
+                    s = s.replace(char, replacement)
+            return f'"{s}"'
+    else:
+        def escape(s):
+            if '"' in s or '\n' in s or '\r' in s:
+                for char, replacement in replacements:
+                    s = s.replace(char, replacement)
+            return s
+    return escape
 
 
 def sanitize_key_name(key_name, line_break_handling='escape', quote_handling='double'):
@@ -904,7 +2115,7 @@ def sanitize_top_level_keys(data, line_break_handling='escape', quote_handling='
 
 
 def count_rows(file_path):
-    with CustomCSVTqdm(pd.read_csv(file_path, iterator=True, chunksize=10000), ncols=100,
+    with CustomCSVTqdm(read_csv_or_parquet(file_path, iterator=True, chunksize=10000), ncols=100,
                        desc='Counting rows') as reader:
         return sum(chunk.shape[0] for chunk in reader)
 
@@ -916,7 +2127,7 @@ def count_rows_in_chunks(file_path, chunksize):
 
 
 def read_csv_in_chunks(file_path, chunksize):
-    reader = pd.read_csv(file_path, iterator=True, chunksize=chunksize, low_memory=False)
+    reader = read_csv_or_parquet(file_path, iterator=True, chunksize=chunksize, low_memory=False)
     for chunk in reader:
         yield chunk
 
@@ -965,7 +2176,7 @@ def filter_rows_by_priority_old(row_limit, input_csv, output_csv=None, filter_co
             max_val = None
 
             with tqdm(total=total_rows, desc='Calculating value ranges', unit=' rows', ncols=100) as pbar:
-                for chunk in pd.read_csv(input_csv, chunksize=chunksize, usecols=[col]):
+                for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, usecols=[col]):
                     chunk_min, chunk_max = chunk[col].min(), chunk[col].max()
                     if min_val is None or chunk_min < min_val:
                         min_val = chunk_min
@@ -982,7 +2193,7 @@ def filter_rows_by_priority_old(row_limit, input_csv, output_csv=None, filter_co
     rows_written = 0
 
     with tqdm(total=total_rows, desc='Filtering rows', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize):
             if score_breakdown:
                 chunk['score'], chunk['breakdown'] = zip(*chunk.apply(calculate_score, axis=1))
             else:
@@ -1013,7 +2224,7 @@ def filter_rows_by_priority_old(row_limit, input_csv, output_csv=None, filter_co
         temp_file = tempfile.NamedTemporaryFile(mode='w+', delete=False, newline='', encoding='utf-8')
         with tqdm(total=row_limit, desc='Dropping score column', unit=' rows', ncols=100) as pbar:
             header_written = False
-            for chunk in pd.read_csv(output_csv, chunksize=chunksize):
+            for chunk in read_csv_or_parquet(output_csv, chunksize=chunksize):
                 chunk.drop(columns=['score'], inplace=True)
                 if not header_written:
                     chunk.to_csv(temp_file, index=False)
@@ -1085,7 +2296,7 @@ def filter_rows_by_priority_prev(row_limit, input_csv, output_csv=None, filter_c
             max_val = None
 
             with tqdm(total=total_rows, desc='Calculating value ranges', unit=' rows', ncols=100) as pbar:
-                for chunk in pd.read_csv(input_csv, chunksize=chunksize, usecols=[col]):
+                for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, usecols=[col]):
                     chunk_min, chunk_max = chunk[col].min(), chunk[col].max()
                     if min_val is None or chunk_min < min_val:
                         min_val = chunk_min
@@ -1102,7 +2313,7 @@ def filter_rows_by_priority_prev(row_limit, input_csv, output_csv=None, filter_c
     rows_written = 0
 
     with tqdm(total=total_rows, desc='Filtering rows', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize):
             if score_breakdown:
                 chunk['score'], chunk['score_breakdown'] = zip(
                     *chunk.apply(lambda row: calculate_score(row, score_breakdown=True), axis=1))
@@ -1134,7 +2345,7 @@ def filter_rows_by_priority_prev(row_limit, input_csv, output_csv=None, filter_c
         temp_file = tempfile.NamedTemporaryFile(mode='w+', delete=False, newline='', encoding='utf-8')
         with tqdm(total=row_limit, desc='Dropping score column', unit=' rows', ncols=100) as pbar:
             header_written = False
-            for chunk in pd.read_csv(output_csv, chunksize=chunksize):
+            for chunk in read_csv_or_parquet(output_csv, chunksize=chunksize):
                 chunk.drop(columns=['score'], inplace=True)
                 if not header_written:
                     chunk.to_csv(temp_file, index=False)
@@ -1205,7 +2416,7 @@ def filter_rows_by_priority_pandas(row_limit, input_csv, output_csv=None, filter
             min_val = None
             max_val = None
 
-            for chunk in pd.read_csv(input_csv, chunksize=chunksize, usecols=[col]):
+            for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, usecols=[col]):
                 chunk_min, chunk_max = chunk[col].min(), chunk[col].max()
                 if min_val is None or chunk_min < min_val:
                     min_val = chunk_min
@@ -1219,7 +2430,7 @@ def filter_rows_by_priority_pandas(row_limit, input_csv, output_csv=None, filter
     header_written = False
     rows_written = 0
     with tqdm(total=total_rows, desc='Filtering rows', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, low_memory=False):
             if score_breakdown:
                 chunk['score'], chunk['score_breakdown'] = zip(
                     *chunk.apply(lambda row: calculate_score(row, score_breakdown=True), axis=1))
@@ -1257,7 +2468,7 @@ def filter_rows_by_priority_pandas(row_limit, input_csv, output_csv=None, filter
         temp_file = tempfile.NamedTemporaryFile(mode='w+', delete=False, newline='', encoding='utf-8')
         with tqdm(total=row_limit, desc='Dropping score column', unit=' rows', ncols=100) as pbar:
             header_written = False
-            for chunk in pd.read_csv(output_csv, chunksize=chunksize):
+            for chunk in read_csv_or_parquet(output_csv, chunksize=chunksize):
                 chunk.drop(columns=['score'], inplace=True)
                 if not header_written:
                     chunk.to_csv(temp_file, index=False)
@@ -1282,7 +2493,7 @@ def sort_big_csv(input_csv, output_path, sort_key, ascending=False, chunksize=10
     sorted_chunks = []
 
     with tqdm(total=total_rows, desc='Sorting chunks', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, low_memory=False):
             sorted_chunks.append(process_chunk(chunk))
             pbar.update(len(chunk))
 
@@ -1300,7 +2511,7 @@ def sort_big_csv(input_csv, output_path, sort_key, ascending=False, chunksize=10
 
 
 # TODO change to use dynamicdictwriter
-def sort_big_csv2(input_csv, output_path=None, sort_key=None, ascending=True, chunksize=10000):
+def sort_big_csv2(input_csv, output_path=None, sort_key=None, ascending=True, chunksize=10000, header_mode='deferred'):
     # If output path not given, use the input_csv path and append "_sorted" before the extension
     if output_path is None:
         output_path = os.path.splitext(input_csv)[0] + "_sorted" + os.path.splitext(input_csv)[1]
@@ -1310,15 +2521,16 @@ def sort_big_csv2(input_csv, output_path=None, sort_key=None, ascending=True, ch
     # Open the output CSV file in write mode
     with open(output_path, mode='w+', newline='', encoding='utf-8') as csvfile:
 
-        # Initialize DynamicDictWriter
-        fieldnames = set()  # Start with no fieldnames; DynamicDictWriter will add them as they appear
-        writer = DynamicDictWriter(csvfile, fieldnames=fieldnames, delimiter=',', dialect='excel')
+        # Initialize the dynamic dict writer
+        fieldnames = set()  # Start with no fieldnames; the writer will add them as they appear
+        writer = get_dynamic_dict_writer(csvfile, fieldnames=fieldnames, header_mode=header_mode, delimiter=',',
+                                         dialect='excel')
 
         # Keep track of the number of rows written
         rows_written = 0
 
         # Read and sort the CSV in chunks
-        for chunk in tqdm(pd.read_csv(input_csv, chunksize=chunksize), total=total_rows, desc='Processing chunks',
+        for chunk in tqdm(read_csv_or_parquet(input_csv, chunksize=chunksize), total=total_rows, desc='Processing chunks',
                           unit=' chunks', ncols=100):
             # If a sort key is provided, sort the chunk
             if sort_key:
@@ -1330,12 +2542,15 @@ def sort_big_csv2(input_csv, output_path=None, sort_key=None, ascending=True, ch
                 writer.writerow(row)
                 rows_written += 1
 
+        writer.close()
+
     # Return the path to the sorted CSV
     return output_path
 
 
 def filter_rows_by_priority(row_limit, input_csv, output_csv=None, filter_config=None, chunksize=10000,
-                            drop_score=True, score_breakdown=True, drop_below=None):
+                            drop_score=True, score_breakdown=True, drop_below=None, output_compression=None,
+                            max_rows_per_file=None, max_bytes_per_file=None):
     def calculate_score2(row, score_breakdown=False):
         score = 0
         breakdown = []
@@ -1488,7 +2703,7 @@ def filter_rows_by_priority(row_limit, input_csv, output_csv=None, filter_config
     # First pass to calculate value ranges if not provided
     for col, config in filter_config.items():
         if not config.get('range'):
-            if pd.read_csv(input_csv, nrows=5, usecols=[col])[col].dtype == object:
+            if read_csv_or_parquet(input_csv, nrows=5, usecols=[col])[col].dtype == object:
                 # Handle string or categorical columns
                 config['range'] = ""
             else:
@@ -1496,7 +2711,7 @@ def filter_rows_by_priority(row_limit, input_csv, output_csv=None, filter_config
                 min_val = None
                 max_val = None
 
-                for chunk in pd.read_csv(input_csv, chunksize=chunksize, usecols=[col]):
+                for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, usecols=[col]):
                     chunk_min, chunk_max = chunk[col].min(), chunk[col].max()
                     if min_val is None or chunk_min < min_val:
                         min_val = chunk_min
@@ -1511,7 +2726,7 @@ def filter_rows_by_priority(row_limit, input_csv, output_csv=None, filter_config
     scores_df = pd.DataFrame()
 
     with tqdm(total=total_rows, desc='Calculating scores', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, low_memory=False):
             if score_breakdown:
                 chunk['score'], chunk['score_breakdown'], chunk['partial_scores'] = zip(
                     *chunk.apply(lambda row: calculate_score(row, score_breakdown=True), axis=1))
@@ -1546,7 +2761,7 @@ def filter_rows_by_priority(row_limit, input_csv, output_csv=None, filter_config
     counter = 0
     temp_total = row_limit if (row_limit < total_rows) else total_rows
     with tqdm(total=temp_total, desc='Applying row limit', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(output_csv_with_scores, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(output_csv_with_scores, chunksize=chunksize, low_memory=False):
 
             drop_zero_lambda = lambda row: all([
                 (not filter_config[col].get('drop_zero', False)) or (calculate_score(row)[2][col] != 0)
@@ -1585,26 +2800,22 @@ def filter_rows_by_priority(row_limit, input_csv, output_csv=None, filter_config
 
     # Rest of the function
     if output_csv is None:
-        input_csv_basename = os.path.basename(input_csv)
+        input_csv_basename = os.path.basename(strip_compression_ext(input_csv))
         filename_without_ext = os.path.splitext(input_csv_basename)[0]
         output_csv = f'custom_filtered__{filename_without_ext}.csv'
 
-    if drop_score:
-        temp_file = tempfile.NamedTemporaryFile(mode='w+', delete=False, newline='', encoding='utf-8')
-        with tqdm(total=row_limit, desc='Dropping score column', unit=' rows', ncols=100) as pbar:
+    if drop_score or output_compression or max_rows_per_file or max_bytes_per_file:
+        with tqdm(total=row_limit, desc='Writing output', unit=' rows', ncols=100) as pbar, \
+                CsvOutputFile(output_csv, output_compression, max_rows_per_file, max_bytes_per_file) as output:
             header_written = False
-            for chunk in pd.read_csv(temp_file_limited.name, chunksize=chunksize):
-                chunk.drop(columns=['score'], inplace=True)
-                if not header_written:
-                    chunk.to_csv(temp_file, index=False)
-                    header_written = True
-                else:
-                    chunk.to_csv(temp_file, index=False, header=False)
+            for chunk in read_csv_or_parquet(temp_file_limited.name, chunksize=chunksize):
+                if drop_score:
+                    chunk.drop(columns=['score'], inplace=True)
+                chunk.to_csv(output, index=False, header=not header_written)
+                header_written = True
                 pbar.update(chunk.shape[0])
-
-        temp_file.flush()
-        temp_file.close()
-        shutil.move(temp_file.name, output_csv)
+        os.remove(temp_file_limited.name)
+        output_csv = output.name
     else:
         shutil.move(temp_file_limited.name, output_csv)
 
@@ -1620,7 +2831,7 @@ def unique_values_with_counts_chunked(input_csv, column_names, output_csv=None,
     result = pd.DataFrame(columns=['column_name', 'value', 'count'])
 
     with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, low_memory=False):
             for column_name in column_names:
                 unique_counts = chunk[column_name].value_counts().reset_index()
                 unique_counts.columns = ['value', 'count']
@@ -1663,7 +2874,7 @@ def generate_column_analytics_in_chunks(input_csv, output_csv=None, chunksize=10
     result = pd.DataFrame()
 
     with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, low_memory=False):
             chunk_stats = []
 
             for column_name in chunk.columns:
@@ -1715,7 +2926,7 @@ def generate_column_analytics_in_chunks(input_csv, output_csv=None, chunksize=10
                         else:
                             col_stats['unique_values'] = list(str_value_counts.keys())
 
-                        serialized_unique_values = json.dumps(col_stats['unique_values'], default=str)
+                        serialized_unique_values = dumps_json(col_stats['unique_values'])
 
                         if max_value_length is not None and len(serialized_unique_values) > max_value_length:
                             if long_value_handling == 'truncate':
@@ -1772,7 +2983,7 @@ def partial_json_loads_ijson(json_string):
 
 
 def apply_long_value_handling2(col_stats, max_value_length, long_value_handling):
-    serialized_unique_values = json.dumps(col_stats['unique_values'], default=str)
+    serialized_unique_values = dumps_json(col_stats['unique_values'])
 
     if max_value_length is not None and len(serialized_unique_values) > max_value_length:
         if long_value_handling == 'truncate':
@@ -1796,7 +3007,7 @@ def apply_long_value_handling2(col_stats, max_value_length, long_value_handling)
 
 def apply_long_value_handling3(col_stats, max_value_length, long_value_handling, value_check_mode):
     if value_check_mode is not None:
-        serialized_unique_values = json.dumps(col_stats['unique_values'], default=str)
+        serialized_unique_values = dumps_json(col_stats['unique_values'])
 
         if value_check_mode == 'both' or value_check_mode == 'values':
             if isinstance(col_stats['unique_values'], dict):
@@ -1834,7 +3045,7 @@ def apply_long_value_handling3(col_stats, max_value_length, long_value_handling,
 
 def apply_long_value_handling(unique_values, max_value_length, long_value_handling, value_check_mode):
     if value_check_mode is not None:
-        serialized_unique_values = json.dumps(unique_values, default=str)
+        serialized_unique_values = dumps_json(unique_values)
 
         if value_check_mode == 'both' or value_check_mode == 'values':
             if isinstance(unique_values, dict):
@@ -1914,7 +3125,7 @@ def generate_column_analytics(input_csv, output_csv=None, chunksize=10000,
     with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
 
         # for each chunk of the input csv
-        for chunk_num, chunk in enumerate(pd.read_csv(input_csv, chunksize=chunksize, low_memory=False)):
+        for chunk_num, chunk in enumerate(read_csv_or_parquet(input_csv, chunksize=chunksize, low_memory=False)):
             chunk_stats = []
 
             def stringify_values(value_counts):
@@ -2071,7 +3282,7 @@ def generate_column_analytics(input_csv, output_csv=None, chunksize=10000,
                                                                                  exceed_value=
                                                                                  'Exceeded count threshold')
 
-                        serialized_agg_unique_values = json.dumps(agg_stats['unique_values'], default=str)
+                        serialized_agg_unique_values = dumps_json(agg_stats['unique_values'])
                         # TODO fix issue with stringifying unique values
                         agg_stats['unique_values'] = apply_long_value_handling(serialized_agg_unique_values,
                                                                                max_value_length, long_value_handling,
@@ -2079,7 +3290,7 @@ def generate_column_analytics(input_csv, output_csv=None, chunksize=10000,
             '''
             column_name_to_track = 'level'
             if column_name_to_track in aggregated_analytics:
-                unique_values_str = json.dumps(aggregated_analytics[column_name_to_track]['unique_values'], default=str)
+                unique_values_str = dumps_json(aggregated_analytics[column_name_to_track]['unique_values'])
                 print(f"After chunk {chunk_num}, unique_values for {column_name_to_track}:")
                 print(unique_values_str[:300] + "..." if len(unique_values_str) > 300 else unique_values_str)
             '''
@@ -2103,14 +3314,14 @@ def generate_column_analytics(input_csv, output_csv=None, chunksize=10000,
 
 
 def infer_dtypes(file_path, nrows=1000):
-    df_sample = pd.read_csv(file_path, nrows=nrows)
+    df_sample = read_csv_or_parquet(file_path, nrows=nrows)
     dtypes = df_sample.dtypes.to_dict()
     return {column: str(dtype) for column, dtype in dtypes.items()}
 
 
 def read_csv_in_chunks_and_infer_dtypes(file_path, chunksize):
     dtypes = infer_dtypes(file_path)
-    reader = pd.read_csv(file_path, iterator=True, chunksize=chunksize, dtype=dtypes, low_memory=False)
+    reader = read_csv_or_parquet(file_path, iterator=True, chunksize=chunksize, dtype=dtypes, low_memory=False)
     for chunk in reader:
         yield chunk
 
@@ -2226,7 +3437,7 @@ def extract_business_units(file_path, column_name='account_name', chunksize=1000
     processed_chunks = []
 
     with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(file_path, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(file_path, chunksize=chunksize, low_memory=False):
             chunk['business_unit'] = chunk[column_name].apply(
                 lambda x: re.findall(pattern, x)[-1] if len(re.findall(pattern, x)) >= 1 else '')
 
@@ -2246,7 +3457,7 @@ def remap_values_in_csv(input_csv, remap_dict, chunksize=1000, create_new_column
     processed_chunks = []
 
     with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize):
             for column_name, value_map in remap_dict.items():
                 if column_name in chunk.columns:
                     remapped_column = chunk[column_name].map(value_map).fillna(chunk[column_name])
@@ -2343,7 +3554,7 @@ def find_ip_keys(data: Union[Dict, List], key_path: str, target_keys: List[str],
     if isinstance(data, dict):
         for key, value in data.items():
             new_key_path = f"{key_path}.{key}" if key_path else key
-            if use_jaccard and any(jaccard_index(key, target) >= threshold for target in target_keys):
+            if use_jaccard and any(is_key_match(target, key, threshold) for target in target_keys):
                 if is_ip_address(value):
                     result.append(new_key_path)
             elif not use_jaccard and is_ip_address(value):
@@ -2355,7 +3566,7 @@ def find_ip_keys(data: Union[Dict, List], key_path: str, target_keys: List[str],
 
 
 def find_ip_keys_in_json(json_file: str, target_keys: List[str], threshold: float, use_jaccard: bool) -> List[str]:
-    with open(json_file, 'r') as file:
+    with open_input_file(json_file) as file:
         data = json.load(file)
     result = []
     find_ip_keys(data, "", target_keys, threshold, result, use_jaccard)
@@ -2380,7 +3591,7 @@ def extract_first_value_from_lists_in_csv2(
     total_rows = count_rows(file_path)
 
     # Read the CSV in chunks and process it
-    reader = pd.read_csv(file_path, iterator=True, chunksize=chunksize)
+    reader = read_csv_or_parquet(file_path, iterator=True, chunksize=chunksize)
 
     # Create an empty dataframe to store the processed chunks
     processed_df = pd.DataFrame()
@@ -2426,7 +3637,7 @@ def extract_first_value_from_lists_in_csv(file_path, columns_to_extract, replace
         return value
 
     with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(file_path, chunksize=chunksize, low_memory=False, iterator=True):
+        for chunk in read_csv_or_parquet(file_path, chunksize=chunksize, low_memory=False, iterator=True):
             for col in columns_to_extract:
                 new_col = "__" + col if not replace_old_column else col
 
@@ -2445,99 +3656,98 @@ def extract_first_value_from_lists_in_csv(file_path, columns_to_extract, replace
     return new_file_path
 
 
-def select_columns_from_csv(csv_filepath, column_names, chunksize=10000):
+def select_columns_from_csv(csv_filepath, column_names, chunksize=10000, output_compression=None,
+                            max_rows_per_file=None, max_bytes_per_file=None):
     # Get the total number of rows in the CSV file using chunks
     total_rows = count_rows_in_chunks(csv_filepath, chunksize)
 
     # Create the output CSV file path with "col_clip__" appended to the front
     output_csv_filepath = os.path.join(os.path.dirname(csv_filepath),
-                                       f"col_clip__{os.path.basename(csv_filepath)}")
+                                       f"col_clip__{os.path.basename(strip_compression_ext(csv_filepath))}")
     print(output_csv_filepath)
 
     # Read the CSV file in chunks, select the specified columns, and write to the output CSV file
-    with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
+    with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar, \
+            CsvOutputFile(output_csv_filepath, output_compression, max_rows_per_file, max_bytes_per_file) as output:
         header_written = False
-        for chunk in pd.read_csv(csv_filepath, chunksize=chunksize, low_memory=False, iterator=True):
+        for chunk in read_csv_or_parquet(csv_filepath, chunksize=chunksize, low_memory=False, iterator=True):
             # Select the specified columns
             selected_chunk = chunk[column_names]
 
             # Write the chunk to the output CSV file
-            if not header_written:
-                selected_chunk.to_csv(output_csv_filepath, index=False)
-                header_written = True
-            else:
-                selected_chunk.to_csv(output_csv_filepath, index=False, header=False, mode='a')
+            selected_chunk.to_csv(output, index=False, header=not header_written)
+            header_written = True
 
             pbar.update(chunk.shape[0])
-    return output_csv_filepath
+    return output.name
 
 
-def fill_empty_values_in_csv(csv_filepath, fill_values_dict, chunksize=10000):
+def fill_empty_values_in_csv(csv_filepath, fill_values_dict, chunksize=10000,
+                             output_compression=None, max_rows_per_file=None, max_bytes_per_file=None):
     total_rows = count_rows_in_chunks(csv_filepath, chunksize)
 
     output_csv_filepath = os.path.join(os.path.dirname(csv_filepath),
-                                       f"filled__{os.path.basename(csv_filepath)}")
+                                       f"filled__{os.path.basename(strip_compression_ext(csv_filepath))}")
 
-    with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
+    with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar, \
+            CsvOutputFile(output_csv_filepath, output_compression, max_rows_per_file, max_bytes_per_file) as output:
         header_written = False
-        for chunk in pd.read_csv(csv_filepath, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(csv_filepath, chunksize=chunksize, low_memory=False):
             # Fill empty values in specified columns with values from the dictionary
             for column, fill_value in fill_values_dict.items():
                 chunk[column].fillna(fill_value, inplace=True)
 
             # Write the updated chunk to the output CSV file
-            if not header_written:
-                chunk.to_csv(output_csv_filepath, index=False)
-                header_written = True
-            else:
-                chunk.to_csv(output_csv_filepath, index=False, header=False, mode='a')
+            chunk.to_csv(output, index=False, header=not header_written)
+            header_written = True
 
             pbar.update(chunk.shape[0])
+    return output.name
 
 
-def remove_rows_with_empty_values(csv_filepath, columns_to_check, chunksize=10000):
+def remove_rows_with_empty_values(csv_filepath, columns_to_check, chunksize=10000,
+                                  output_compression=None, max_rows_per_file=None, max_bytes_per_file=None):
     total_rows = count_rows_in_chunks(csv_filepath, chunksize)
 
     output_csv_filepath = os.path.join(os.path.dirname(csv_filepath),
-                                       f"no_empty__{os.path.basename(csv_filepath)}")
+                                       f"no_empty__{os.path.basename(strip_compression_ext(csv_filepath))}")
 
-    with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
+    with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar, \
+            CsvOutputFile(output_csv_filepath, output_compression, max_rows_per_file, max_bytes_per_file) as output:
         header_written = False
-        for chunk in pd.read_csv(csv_filepath, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(csv_filepath, chunksize=chunksize, low_memory=False):
             # Remove rows with empty values in specified columns
             chunk.dropna(subset=columns_to_check, inplace=True)
 
             # Write the updated chunk to the output CSV file
-            if not header_written:
-                chunk.to_csv(output_csv_filepath, index=False)
-                header_written = True
-            else:
-                chunk.to_csv(output_csv_filepath, index=False, header=False, mode='a')
+            chunk.to_csv(output, index=False, header=not header_written)
+            header_written = True
 
             pbar.update(chunk.shape[0])
+    return output.name
 
 
-def format_datetime_columns_in_csv(csv_filepath, datetime_columns, datetime_format='%Y-%m-%d', chunksize=10000):
+def format_datetime_columns_in_csv(csv_filepath, datetime_columns, datetime_format='%Y-%m-%d', chunksize=10000,
+                                   output_compression=None, max_rows_per_file=None, max_bytes_per_file=None):
     total_rows = count_rows_in_chunks(csv_filepath, chunksize)
 
     output_csv_filepath = os.path.join(os.path.dirname(csv_filepath),
-                                       f"formatted_datetime__{os.path.basename(csv_filepath)}")
+                                       f"formatted_datetime__{os.path.basename(strip_compression_ext(csv_filepath))}")
 
-    with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
+    with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar, \
+            CsvOutputFile(output_csv_filepath, output_compression, max_rows_per_file, max_bytes_per_file) as output:
         header_written = False
-        for chunk in pd.read_csv(csv_filepath, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(csv_filepath, chunksize=chunksize, low_memory=False):
             # Format datetime columns
             for column in datetime_columns:
                 chunk[column] = pd.to_datetime(chunk[column]).dt.strftime(datetime_format)
 
             # Write the updated chunk to the output CSV file
-            if not header_written:
-                chunk.to_csv(output_csv_filepath, index=False)
-                header_written = True
-            else:
-                chunk.to_csv(output_csv_filepath, index=False, header=False, mode='a')
+            chunk.to_csv(output, index=False, header=not header_written)
+            header_written = True
 
             pbar.update(chunk.shape[0])
+    return output.name
 
 
 def transform_columns_in_csv_old(input_csv, transformations_dict, chunksize=10000):
@@ -2552,7 +3762,7 @@ def transform_columns_in_csv_old(input_csv, transformations_dict, chunksize=1000
                                        f"transformed__{os.path.basename(input_csv)}")
 
     with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, low_memory=False):
             for column, transformation in transformations_dict.items():
                 if column in chunk.columns:
                     chunk[column] = chunk.apply(transformation, axis=1)
@@ -2565,7 +3775,8 @@ def transform_columns_in_csv_old(input_csv, transformations_dict, chunksize=1000
             pbar.update(chunk.shape[0])
 
 
-def transform_columns_in_csv(input_csv, transformations_dict, chunksize=10000):
+def transform_columns_in_csv(input_csv, transformations_dict, chunksize=10000, header_mode='deferred',
+                             output_compression=None, max_rows_per_file=None, max_bytes_per_file=None):
     total_rows = count_rows_in_chunks(input_csv, chunksize)
 
     # Convert strings to lambda functions
@@ -2574,13 +3785,22 @@ def transform_columns_in_csv(input_csv, transformations_dict, chunksize=10000):
             transformations_dict[column] = eval('lambda row: ' + transformation)
 
     output_csv_filepath = os.path.join(os.path.dirname(input_csv),
-                                       f"transformed__{os.path.basename(input_csv)}")
+                                       f"transformed__{os.path.basename(strip_compression_ext(input_csv))}")
+
+    if header_mode == 'rewrite' and (output_compression or max_rows_per_file or max_bytes_per_file):
+        # rewriting the header needs a plain file it can seek in
+        print('[-] Compressed or split output writes the header once, ignoring header_mode "rewrite"')
+        header_mode = 'deferred'
 
     with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
         fieldnames = set()
-        with open(output_csv_filepath, 'w+', newline='', encoding='utf-8') as outfile:
-            writer = DynamicDictWriter(outfile, fieldnames=fieldnames, dialect='excel')
-            for chunk in pd.read_csv(input_csv, chunksize=chunksize, low_memory=False):
+        if header_mode == 'rewrite':
+            outfile = open(output_csv_filepath, 'w+', newline='', encoding='utf-8')
+        else:
+            outfile = CsvOutputFile(output_csv_filepath, output_compression, max_rows_per_file, max_bytes_per_file)
+        with outfile:
+            writer = get_dynamic_dict_writer(outfile, fieldnames=fieldnames, header_mode=header_mode, dialect='excel')
+            for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, low_memory=False):
                 rows = []
                 for _, row in chunk.iterrows():
                     new_row = row.to_dict()
@@ -2591,8 +3811,9 @@ def transform_columns_in_csv(input_csv, transformations_dict, chunksize=10000):
                 for row in transformed_chunk.to_dict('records'):
                     writer.writerow(row)
                 pbar.update(transformed_chunk.shape[0])
+            writer.close()
 
-    return output_csv_filepath
+    return outfile.name
 
 
 def bulk_value_search(csv_filepath, values_to_search, truncation_limit=32000, chunksize=10000):
@@ -2606,7 +3827,7 @@ def bulk_value_search(csv_filepath, values_to_search, truncation_limit=32000, ch
 
     with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
         header_written = False
-        for chunk in pd.read_csv(csv_filepath, chunksize=chunksize, low_memory=False, iterator=True):
+        for chunk in read_csv_or_parquet(csv_filepath, chunksize=chunksize, low_memory=False, iterator=True):
             results = []
             for col in chunk.columns:
                 for value in values_to_search:
@@ -2656,7 +3877,7 @@ def generate_pivot_table(input_csv, index_cols, pivot_cols=None, value_cols=None
     with tqdm(total=total_rows, desc='Processing chunks', unit=' rows', ncols=100) as pbar:
         full_data = pd.DataFrame()
 
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, low_memory=False):
             full_data = pd.concat([full_data, chunk])
             pbar.update(chunk.shape[0])
 
@@ -2716,7 +3937,7 @@ def process_csv_remove_parentheses(input_csv, columns, chunksize=10000, edit_in_
         processed_data = pd.DataFrame()
 
         # Read the CSV in chunks
-        for chunk in pd.read_csv(input_csv, chunksize=chunksize, low_memory=False):
+        for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, low_memory=False):
             # Process the specified columns
             for col in columns:
                 if col in chunk.columns:
@@ -2738,7 +3959,7 @@ def process_csv_remove_parentheses(input_csv, columns, chunksize=10000, edit_in_
 
 
 def csv_analytics(input_csv: str, output_csv: Optional[str] = None):
-    file_ext = os.path.splitext(input_csv)[1].lower()
+    file_ext = os.path.splitext(strip_compression_ext(input_csv))[1].lower()
     if file_ext != '.csv':
         print(f"The input file '{input_csv}' is not a CSV file. Please provide a valid CSV file.")
         return
@@ -2748,7 +3969,7 @@ def csv_analytics(input_csv: str, output_csv: Optional[str] = None):
 
     stats = {}
 
-    with open(input_csv, encoding='utf-8') as f:
+    with open_input_file(input_csv, 'r') as f:
         total_rows = sum(
             1 for _ in tqdm(f, desc='Counting rows', unit=' rows', ncols=100)) - 1  # Subtract 1 for the header
 
@@ -2756,7 +3977,7 @@ def csv_analytics(input_csv: str, output_csv: Optional[str] = None):
 
     progress_bar = tqdm(total=total_rows, desc='Processing rows', unit=' rows', ncols=100)
 
-    for chunk in pd.read_csv(input_csv, chunksize=chunksize, encoding='utf-8', low_memory=False):
+    for chunk in read_csv_or_parquet(input_csv, chunksize=chunksize, encoding='utf-8', low_memory=False):
         progress_bar.update(chunksize)
         for col in chunk.columns:
             all_keys.add(col)